@@ -1,16 +1,35 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, HTTPException
 from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
-from typing import List, Optional
-import json
+from typing import Dict, List, Optional, Union
+import asyncio
+import os
+import time
 
-from app.database import get_db
-from app.services.llm_service import generate_answer, generate_answer_stream
-from app.services.search_service import search_relevant_chunks
+from app.database import SessionLocal, AsyncSessionLocal
+from app.services.llm_service import generate_answer, generate_answer_stream, build_context
+from app.services.search_service import search_relevant_chunks_async, search_many, RETRIEVAL_MODES, DEFAULT_RETRIEVAL_MODE
+from app.services.single_flight import SingleFlight
+from app.services.extractive_service import extract_answer
+from app.services.embedding_service import peek_query_embedding
+from app.services.admission import AdmissionRejected, get_llm_admission
+from app.services.deadline import Deadline, DeadlineExceeded
+from app.services.sse import sse_frame, coalesce_frames, dumps
 
 router = APIRouter()
 
+# Identical concurrent chat requests share one retrieval and one LLM generation
+COALESCE_REQUESTS = os.getenv("CHAT_COALESCE", "true").lower() in ("1", "true", "yes")
+_flights = SingleFlight()
+
+# Batch chat: answers generated at once per request, and how many questions one request may carry
+BATCH_CHAT_CONCURRENCY = int(os.getenv("BATCH_CHAT_CONCURRENCY", "8"))
+BATCH_CHAT_MAX_QUERIES = int(os.getenv("BATCH_CHAT_MAX_QUERIES", "1000"))
+# Times a batch question waits out an LLM admission rejection before reporting it
+BATCH_CHAT_ADMISSION_RETRIES = int(os.getenv("BATCH_CHAT_ADMISSION_RETRIES", "5"))
+
 
 class ChatRequest(BaseModel):
     query: str
@@ -18,80 +37,244 @@ class ChatRequest(BaseModel):
     stream: bool = True
     document_ids: Optional[List[str]] = None
     batch_id: Optional[str] = None
+    retrieval_mode: Optional[str] = None  # vector | keyword | hybrid
+    vector_depth: Optional[int] = None
+    keyword_depth: Optional[int] = None
+    answer_mode: str = "generate"  # generate | extractive
+    preview: bool = False  # streaming: send an extractive preview before LLM tokens
+    deadline_ms: Optional[int] = None  # time budget; defaults to CHAT_DEADLINE_MS, 0 disables
 
 
 class ChatResponse(BaseModel):
     answer: str
     citations: List[dict]
+    timings: Optional[dict] = None
+    answer_mode: str = "generate"
+    spans: Optional[List[dict]] = None
+    path: Optional[dict] = None
 
 
-@router.post("/", response_model=ChatResponse)
-async def chat_without_streaming(
-    request: ChatRequest,
-    db: Session = Depends(get_db)
-):
-    """Chat with LLM (non-streaming version)"""
+class BatchChatRequest(BaseModel):
+    queries: List[str]
+    top_k: int = 5
+    document_ids: Optional[List[str]] = None
+    batch_id: Optional[str] = None
+    retrieval_mode: Optional[str] = None  # vector | keyword | hybrid
+    vector_depth: Optional[int] = None
+    keyword_depth: Optional[int] = None
+    answer_mode: str = "generate"  # generate | extractive
+    concurrency: Optional[int] = None  # parallel generations, capped at BATCH_CHAT_CONCURRENCY
+
+
+ANSWER_MODES = ("generate", "extractive")
 
-    chunks = [] if request.top_k <= 0 else search_relevant_chunks(
-        request.query,
+
+def _validate(request: Union[ChatRequest, BatchChatRequest]) -> None:
+    if request.retrieval_mode and request.retrieval_mode.lower() not in RETRIEVAL_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"retrieval_mode must be one of {list(RETRIEVAL_MODES)}",
+        )
+    if request.answer_mode not in ANSWER_MODES:
+        raise HTTPException(status_code=400, detail=f"answer_mode must be one of {list(ANSWER_MODES)}")
+
+
+def _overloaded(e: AdmissionRejected) -> HTTPException:
+    return HTTPException(
+        status_code=e.status_code,
+        detail=e.reason,
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+
+def _flight_key(kind: str, request: ChatRequest):
+    if not COALESCE_REQUESTS:
+        return (kind, object())
+    return (
+        kind,
+        " ".join(request.query.split()),
         request.top_k,
-        db,
-        document_ids=request.document_ids,
-        batch_id=request.batch_id,
+        request.batch_id,
+        tuple(sorted(request.document_ids or [])),
+        (request.retrieval_mode or "").lower(),
+        request.vector_depth,
+        request.keyword_depth,
+        request.answer_mode,
+        request.preview,
+        request.deadline_ms,
     )
-    answer = await generate_answer(request.query, chunks)
 
+
+async def _retrieve(request: ChatRequest, db: Session, timings: dict, deadline: Optional[Deadline] = None) -> list:
+    if request.top_k <= 0:
+        return []
+    async with AsyncSessionLocal() as adb:
+        return await search_relevant_chunks_async(
+            request.query,
+            request.top_k,
+            db,
+            adb,
+            document_ids=request.document_ids,
+            batch_id=request.batch_id,
+            mode=request.retrieval_mode,
+            vector_depth=request.vector_depth,
+            keyword_depth=request.keyword_depth,
+            timings=timings,
+            deadline=deadline,
+        )
+
+
+def _build_citations(chunks: list) -> List[dict]:
     citations = []
     for chunk in chunks:
         citations.append({
             "chunk_id": chunk.id,
-            "content": chunk.content[:200] + "..." if len(chunk.content) > 200 else chunk.content,
+            "content": chunk.snippet,
             "document": {
                 "id": chunk.document.id,
                 "name": chunk.document.name
             },
             "citation_locator": chunk.citation_locator
         })
+    return citations
 
-    return ChatResponse(answer=answer, citations=citations)
 
+async def _extract_answer(query: str, chunks: list) -> dict:
+    # Sentence embedding is CPU bound; keep it off the event loop, and reuse
+    # the query vector retrieval already computed instead of embedding it again
+    return await run_in_threadpool(
+        extract_answer, query, chunks, query_embedding=peek_query_embedding(query),
+    )
 
-@router.post("/stream")
-async def chat_with_streaming(
-    request: ChatRequest,
-    db: Session = Depends(get_db)
-):
-    """Chat with LLM (streaming version)"""
 
-    async def generate_stream():
-        chunks = [] if request.top_k <= 0 else search_relevant_chunks(
-            request.query,
-            request.top_k,
-            db,
-            document_ids=request.document_ids,
-            batch_id=request.batch_id,
+async def _extract(request: ChatRequest, chunks: list, timings: dict) -> dict:
+    t = time.perf_counter()
+    extracted = await _extract_answer(request.query, chunks)
+    timings["extractive_ms"] = round((time.perf_counter() - t) * 1000.0, 3)
+    return extracted
+
+
+def _path(request: ChatRequest, timings: dict, deadline: Optional[Deadline], answer_mode: str) -> dict:
+    """Which route the request actually took, including any deadline fallbacks."""
+    path = {
+        "retrieval": timings.get("retrieval", (request.retrieval_mode or DEFAULT_RETRIEVAL_MODE).lower()),
+        "embedding": timings.get("embedding"),
+        "answer": answer_mode,
+        "degraded": list(deadline.degraded) if deadline is not None else [],
+    }
+    if deadline is not None:
+        path["deadline_ms"] = deadline.budget_ms
+        path["remaining_ms"] = round(deadline.remaining() * 1000.0, 3)
+    return path
+
+
+def _should_degrade(e: Exception, deadline: Optional[Deadline]) -> bool:
+    # Without a deadline an overloaded LLM is reported as 429/503 instead
+    return deadline is not None and isinstance(e, (DeadlineExceeded, AdmissionRejected))
+
+
+async def _answer(request: ChatRequest) -> ChatResponse:
+    # Runs detached from any one client, so it owns its session
+    db = SessionLocal()
+    try:
+        timings: dict = {}
+        deadline = Deadline.from_ms(request.deadline_ms)
+        chunks = await _retrieve(request, db, timings, deadline)
+        if request.answer_mode == "generate":
+            try:
+                answer = await generate_answer(request.query, chunks, deadline)
+                return ChatResponse(
+                    answer=answer,
+                    citations=_build_citations(chunks),
+                    timings=timings,
+                    path=_path(request, timings, deadline, "generate"),
+                )
+            except (DeadlineExceeded, AdmissionRejected) as e:
+                if not _should_degrade(e, deadline):
+                    raise
+                deadline.degrade("extractive_answer")
+        extracted = await _extract(request, chunks, timings)
+        return ChatResponse(
+            answer=extracted["answer"],
+            citations=_build_citations(chunks),
+            timings=timings,
+            answer_mode="extractive",
+            spans=extracted["spans"],
+            path=_path(request, timings, deadline, "extractive"),
         )
+    finally:
+        db.close()
+
+
+def _token_frame(text: str) -> bytes:
+    return sse_frame({"type": "token", "content": text})
+
 
-        citations = []
-        for chunk in chunks:
-            citations.append({
-                "chunk_id": chunk.id,
-                "content": chunk.content[:200] + "..." if len(chunk.content) > 200 else chunk.content,
-                "document": {
-                    "id": chunk.document.id,
-                    "name": chunk.document.name
-                },
-                "citation_locator": chunk.citation_locator
-            })
-        yield f"data: {json.dumps({'type': 'citations', 'citations': citations})}\n\n"
+async def _answer_frames(request: ChatRequest):
+    # Frames are encoded once here and shared by every coalesced subscriber
+    db = SessionLocal()
+    try:
+        timings: dict = {}
+        deadline = Deadline.from_ms(request.deadline_ms)
+        chunks = await _retrieve(request, db, timings, deadline)
+        citations = _build_citations(chunks)
+        yield sse_frame({'type': 'citations', 'citations': citations, 'timings': timings})
 
-        async for token in generate_answer_stream(request.query, chunks):
-            yield f"data: {json.dumps({'type': 'token', 'content': token})}\n\n"
+        if request.answer_mode == "extractive" or request.preview:
+            extracted = await _extract(request, chunks, timings)
+            event_type = "extractive" if request.answer_mode == "extractive" else "preview"
+            yield sse_frame({'type': event_type, **extracted, 'timings': timings})
+            if request.answer_mode == "extractive":
+                path = _path(request, timings, deadline, "extractive")
+                yield sse_frame({'type': 'end', 'path': path})
+                return
 
-        yield f"data: {json.dumps({'type': 'end'})}\n\n"
+        answer_mode = "generate"
+        try:
+            # Deltas are batched into fewer frames; quiet waits get heartbeats
+            async for frame in coalesce_frames(generate_answer_stream(request.query, chunks, deadline), _token_frame):
+                yield frame
+        except (DeadlineExceeded, AdmissionRejected) as e:
+            if _should_degrade(e, deadline):
+                # No token was sent yet, so the extractive answer stands in for the LLM
+                deadline.degrade("extractive_answer")
+                answer_mode = "extractive"
+                extracted = await _extract(request, chunks, timings)
+                yield sse_frame({'type': 'extractive', **extracted, 'timings': timings})
+            else:
+                # Headers are already sent, so overload arrives as an in-band error
+                error = {'type': 'error', 'status': e.status_code, 'detail': e.reason, 'retry_after': e.retry_after}
+                yield sse_frame(error)
+
+        path = _path(request, timings, deadline, answer_mode)
+        yield sse_frame({'type': 'end', 'path': path})
+    finally:
+        db.close()
+
+
+@router.post("/", response_model=ChatResponse)
+async def chat_without_streaming(request: ChatRequest):
+    """Chat with LLM (non-streaming version)"""
+    _validate(request)
+    try:
+        return await _flights.do(_flight_key("answer", request), lambda: _answer(request))
+    except AdmissionRejected as e:
+        raise _overloaded(e)
+
+
+@router.post("/stream")
+async def chat_with_streaming(request: ChatRequest):
+    """Chat with LLM (streaming version)"""
+    _validate(request)
+    if request.answer_mode == "generate" and Deadline.from_ms(request.deadline_ms) is None:
+        # Turn work away before the 200 goes out if the LLM queue is already full
+        try:
+            get_llm_admission().check()
+        except AdmissionRejected as e:
+            raise _overloaded(e)
 
     return StreamingResponse(
-        generate_stream(),
+        _flights.stream(_flight_key("stream", request), lambda: _answer_frames(request)),
         media_type="text/plain",
         headers={
             "Cache-Control": "no-cache",
@@ -99,3 +282,116 @@ async def chat_with_streaming(
             "Content-Type": "text/event-stream"
         }
     )
+
+
+def _ndjson(obj: dict) -> bytes:
+    return dumps(obj) + b"\n"
+
+
+async def _batch_answer(
+    index: int,
+    request: BatchChatRequest,
+    chunks: list,
+    contexts: Dict[tuple, str],
+) -> dict:
+    line = {
+        "type": "answer",
+        "index": index,
+        "query": request.queries[index],
+        "citations": _build_citations(chunks),
+        "answer_mode": request.answer_mode,
+    }
+    if request.answer_mode == "extractive":
+        extracted = await _extract_answer(request.queries[index], chunks)
+        line.update(answer=extracted["answer"], spans=extracted["spans"])
+        return line
+
+    # Questions that retrieved the same chunks share one packed context
+    key = tuple(chunk.id for chunk in chunks)
+    if key not in contexts:
+        contexts[key] = build_context(chunks)
+    attempts = 0
+    while True:
+        try:
+            line["answer"] = await generate_answer(request.queries[index], chunks, context=contexts[key])
+            return line
+        except AdmissionRejected as e:
+            # Offline work can afford to wait for the live traffic to drain
+            attempts += 1
+            if attempts > BATCH_CHAT_ADMISSION_RETRIES:
+                raise
+            await asyncio.sleep(e.retry_after)
+
+
+async def _batch_lines(request: BatchChatRequest):
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        timings: dict = {}
+        if request.top_k > 0:
+            # Batched embedding + search is CPU heavy; keep it off the event loop
+            chunk_lists = await run_in_threadpool(
+                search_many,
+                request.queries,
+                request.top_k,
+                db,
+                document_ids=request.document_ids,
+                batch_id=request.batch_id,
+                mode=request.retrieval_mode,
+                vector_depth=request.vector_depth,
+                keyword_depth=request.keyword_depth,
+                timings=timings,
+            )
+        else:
+            chunk_lists = [[] for _ in request.queries]
+        yield _ndjson({"type": "retrieval", "queries": len(request.queries), "timings": timings})
+
+        concurrency = max(1, min(request.concurrency or BATCH_CHAT_CONCURRENCY, BATCH_CHAT_CONCURRENCY))
+        limit = asyncio.Semaphore(concurrency)
+        done: asyncio.Queue = asyncio.Queue()
+        contexts: Dict[tuple, str] = {}
+
+        async def run(index: int) -> None:
+            async with limit:
+                try:
+                    line = await _batch_answer(index, request, chunk_lists[index], contexts)
+                except Exception as e:
+                    line = {"type": "error", "index": index, "query": request.queries[index], "error": str(e)}
+            await done.put(line)
+
+        # Results stream back in completion order; "index" ties them to the input
+        tasks = [asyncio.create_task(run(i)) for i in range(len(request.queries))]
+        failed = 0
+        try:
+            for _ in tasks:
+                line = await done.get()
+                failed += line["type"] == "error"
+                yield _ndjson(line)
+        finally:
+            for task in tasks:
+                task.cancel()
+        yield _ndjson({
+            "type": "end",
+            "answered": len(tasks) - failed,
+            "failed": failed,
+            "total_ms": round((time.perf_counter() - started) * 1000.0, 3),
+        })
+    finally:
+        db.close()
+
+
+@router.post("/batch")
+async def chat_batch(request: BatchChatRequest):
+    """Answer many questions over one scope, streaming NDJSON lines as answers complete"""
+    _validate(request)
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="queries must not be empty")
+    if len(request.queries) > BATCH_CHAT_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_CHAT_MAX_QUERIES} queries per batch")
+    return StreamingResponse(_batch_lines(request), media_type="application/x-ndjson")
+
+
+@router.get("/inflight")
+async def chat_inflight():
+    """Coalescing stats: distinct generations in flight and leader/follower counts"""
+    return {"in_flight": _flights.in_flight(), **_flights.stats}
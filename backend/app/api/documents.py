@@ -1,13 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime
 
-from app.database import get_db
-from app.models.models import Document, DocumentStatus
-from app.services.s3_service import delete_file
-from app.services.vector_store import rebuild_index
+from app.database import get_db, get_async_db
+from app.models.models import Document, DocumentStatus, Job, JobStatus
+from app.services.document_service import delete_documents
+from app.services.ingest_service import enqueue_ingest
+from app.services.ingest_scheduler import SchedulerFull
+from app.services.pagination import sort_key, encode_cursor, decode_cursor, after, clamp_limit, estimate_count
 
 router = APIRouter()
 
@@ -25,43 +29,104 @@ class DocumentResponse(BaseModel):
         from_attributes = True
 
 
+class BulkDeleteRequest(BaseModel):
+    document_ids: Optional[List[str]] = None
+    batch_id: Optional[str] = None
+
+
+class BulkDeleteResponse(BaseModel):
+    deleted_documents: int
+    deleted_chunks: int
+    failed_s3_keys: List[str]
+
+
+def _filtered(stmt, status: Optional[DocumentStatus], batch_id: Optional[str]):
+    if status is not None:
+        stmt = stmt.where(Document.status == status)
+    if batch_id:
+        stmt = stmt.where(Document.batch_id == batch_id)
+    return stmt
+
+
 @router.get("/", response_model=List[DocumentResponse])
-async def list_documents(db: Session = Depends(get_db)):
-    """List all documents"""
-    documents = db.query(Document).order_by(Document.created_at.desc()).all()
-    return documents
+async def list_documents(
+    response: Response,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    status: Optional[DocumentStatus] = None,
+    batch_id: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """List documents, newest first, one keyset page at a time.
+
+    The cursor for the next page is returned in the X-Next-Cursor header.
+    """
+    limit = clamp_limit(limit)
+    created = sort_key(Document.created_at)
+    stmt = _filtered(
+        select(
+            Document.id,
+            Document.name,
+            Document.mime_type,
+            Document.size_bytes,
+            Document.status,
+            Document.created_at,
+            Document.updated_at,
+            created.label("sort_created"),
+        ),
+        status,
+        batch_id,
+    )
+    if cursor:
+        try:
+            stmt = stmt.where(after(created, Document.id, decode_cursor(cursor), descending=True))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    stmt = stmt.order_by(created.desc(), Document.id.desc()).limit(limit + 1)
+    rows = (await db.execute(stmt)).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(rows[-1].sort_created, rows[-1].id)
+    return [DocumentResponse.model_validate(row) for row in rows]
+
+
+@router.get("/count")
+async def count_documents(
+    status: Optional[DocumentStatus] = None,
+    batch_id: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Approximate document count (exact on SQLite) without listing them"""
+    stmt = _filtered(select(Document.id), status, batch_id)
+    count, exact = await estimate_count(db, stmt, Document.__tablename__, filtered=status is not None or bool(batch_id))
+    return {"count": count, "exact": exact}
 
 
 @router.get("/{document_id}", response_model=DocumentResponse)
-async def get_document(document_id: str, db: Session = Depends(get_db)):
+async def get_document(document_id: str, db: AsyncSession = Depends(get_async_db)):
     """Get document by ID"""
-    document = db.query(Document).filter(Document.id == document_id).first()
+    document = await db.get(Document, document_id)
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
     return document
 
 
+@router.post("/bulk-delete", response_model=BulkDeleteResponse)
+def bulk_delete_documents(request: BulkDeleteRequest, db: Session = Depends(get_db)):
+    """Delete a list of documents, or a whole batch, in one pass"""
+    if not request.document_ids and not request.batch_id:
+        raise HTTPException(status_code=400, detail="Provide document_ids or batch_id")
+    return delete_documents(db, document_ids=request.document_ids, batch_id=request.batch_id)
+
+
 @router.delete("/{document_id}")
-async def delete_document(document_id: str, db: Session = Depends(get_db)):
+def delete_document(document_id: str, db: Session = Depends(get_db)):
     """Delete document and all associated chunks"""
-    document = db.query(Document).filter(Document.id == document_id).first()
+    document = db.query(Document.id).filter(Document.id == document_id).first()
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
     
-    # Delete from S3/MinIO
-    try:
-        delete_file(document.s3_key)
-    except Exception as e:
-        # Log error but continue with database deletion
-        print(f"Error deleting file from S3: {e}")
-    
-    # Delete from database (cascade will delete chunks)
-    db.delete(document)
-    db.commit()
-    try:
-        rebuild_index(db)
-    except Exception:
-        pass
+    delete_documents(db, document_ids=[document_id])
     return {"message": "Document deleted successfully"}
 
 
@@ -74,12 +139,23 @@ async def trigger_ingestion(document_id: str, db: Session = Depends(get_db)):
     
     if document.status == DocumentStatus.READY:
         raise HTTPException(status_code=400, detail="Document already processed")
+
+    # A second job would ingest the document concurrently and duplicate its chunks
+    active_job = (
+        db.query(Job.id)
+        .filter(Job.document_id == document_id, Job.status.in_([JobStatus.PENDING, JobStatus.PROCESSING]))
+        .first()
+    )
+    if document.status == DocumentStatus.PROCESSING or active_job:
+        raise HTTPException(status_code=409, detail="Document is already being ingested")
     
-    # Update status to processing
-    document.status = DocumentStatus.PROCESSING
-    db.commit()
-    
-    # TODO: Enqueue ingestion job
-    # This will be implemented when we add the job queue
+    try:
+        job, position = enqueue_ingest(document, db)
+    except SchedulerFull as e:
+        raise HTTPException(
+            status_code=429,
+            detail="Ingestion queue is full, retry later",
+            headers={"Retry-After": str(e.retry_after)},
+        )
     
-    return {"message": "Ingestion job enqueued"}
+    return {"message": "Ingestion job enqueued", "job_id": job.id, "queue_position": position}
@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from typing import Optional
@@ -6,6 +7,10 @@ from datetime import datetime
 
 from app.database import get_db
 from app.models.models import Job, JobStatus, JobType
+from app.services.ingest_scheduler import get_scheduler
+from app.services.events import get_broker, job_topic, sse_event_stream
+
+TERMINAL_STAGES = {"completed", "failed"}
 
 router = APIRouter()
 
@@ -20,22 +25,67 @@ class JobResponse(BaseModel):
     max_retries: int
     created_at: datetime
     updated_at: Optional[datetime]
+    queue_position: Optional[int] = None
 
     class Config:
         from_attributes = True
 
 
+def _with_queue_position(job: Job) -> JobResponse:
+    response = JobResponse.model_validate(job)
+    if job.status == JobStatus.PENDING:
+        response.queue_position = get_scheduler().position(job.id)
+    return response
+
+
+@router.get("/queue")
+async def get_queue_stats():
+    """Get ingestion scheduler queue depth and concurrency"""
+    return get_scheduler().stats()
+
+
 @router.get("/{job_id}", response_model=JobResponse)
 async def get_job_status(job_id: str, db: Session = Depends(get_db)):
     """Get job status by ID"""
     job = db.query(Job).filter(Job.id == job_id).first()
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
-    return job
+    return _with_queue_position(job)
 
 
 @router.get("/document/{document_id}", response_model=list[JobResponse])
 async def get_document_jobs(document_id: str, db: Session = Depends(get_db)):
     """Get all jobs for a document"""
     jobs = db.query(Job).filter(Job.document_id == document_id).order_by(Job.created_at.desc()).all()
-    return jobs
+    return [_with_queue_position(job) for job in jobs]
+
+
+@router.get("/{job_id}/events")
+async def stream_job_events(job_id: str, db: Session = Depends(get_db)):
+    """Stream ingestion progress for a job as server-sent events"""
+    # Subscribe before reading state so no transition is missed in between
+    sub = get_broker().subscribe([job_topic(job_id)])
+    job = db.query(Job).filter(Job.id == job_id).first()
+    if not job:
+        sub.close()
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    status = job.status.value if hasattr(job.status, "value") else str(job.status)
+    initial = {
+        "job_id": job.id,
+        "document_id": job.document_id,
+        "stage": status,
+        "queue_position": get_scheduler().position(job.id) if job.status == JobStatus.PENDING else None,
+    }
+    if job.error_message:
+        initial["error"] = job.error_message
+
+    return StreamingResponse(
+        sse_event_stream(sub, [initial], TERMINAL_STAGES),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+        }
+    )
+
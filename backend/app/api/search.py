@@ -1,19 +1,35 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import List, Optional
-from datetime import datetime
+import base64
+import hashlib
+import json
+import os
 
-from app.database import get_db
-from app.models.models import Chunk, Document
-from app.services.embedding_service import get_embedding
+from app.database import get_db, get_async_db
+from app.services.hydration import Hydrator
+from app.services.search_service import retrieve_chunk_ids, RETRIEVAL_MODES, DEFAULT_RETRIEVAL_MODE
 
 router = APIRouter()
 
+# Candidates ranked up front; later pages are sliced from this list, which the
+# search result cache keeps, so paging doesn't search again
+SEARCH_PAGE_DEPTH = int(os.getenv("SEARCH_PAGE_DEPTH", "100"))
+SEARCH_MAX_DEPTH = int(os.getenv("SEARCH_MAX_DEPTH", "1000"))
+
 
 class SearchRequest(BaseModel):
     query: str
-    top_k: int = 5
+    top_k: int = 5  # page size
+    document_ids: Optional[List[str]] = None
+    batch_id: Optional[str] = None
+    retrieval_mode: Optional[str] = None  # vector | keyword | hybrid
+    min_score: Optional[float] = None  # cosine (vector), BM25 (keyword) or RRF (hybrid)
+    depth: Optional[int] = None  # candidates ranked across all pages
+    cursor: Optional[str] = None  # next_cursor from the previous page
 
 
 class ChunkResponse(BaseModel):
@@ -23,6 +39,7 @@ class ChunkResponse(BaseModel):
     citation_locator: Optional[dict]
     chunk_index: int
     document: dict
+    score: float
 
     class Config:
         from_attributes = True
@@ -32,30 +49,89 @@ class SearchResponse(BaseModel):
     chunks: List[ChunkResponse]
     query: str
     total_results: int
+    total_candidates: int = 0
+    next_cursor: Optional[str] = None
+    retrieval_mode: Optional[str] = None
+    timings: Optional[dict] = None
+
+
+def _fingerprint(request: SearchRequest, mode: str, depth: int) -> str:
+    """Ties a cursor to the search it came from."""
+    key = json.dumps([
+        " ".join(request.query.split()),
+        mode,
+        request.batch_id,
+        sorted(request.document_ids or []),
+        request.min_score,
+        depth,
+    ])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+
+def _encode_cursor(offset: int, depth: int, fingerprint: str) -> str:
+    raw = json.dumps({"o": offset, "d": depth, "f": fingerprint}).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> dict:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        cursor = {"o": int(data["o"]), "d": int(data["d"]), "f": str(data["f"])}
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # The fingerprint can be recomputed by anyone, so the numbers need checking too
+    if cursor["o"] < 0 or cursor["d"] <= 0:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return cursor
 
 
 @router.post("/", response_model=SearchResponse)
 async def search_chunks(
     request: SearchRequest,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    adb: AsyncSession = Depends(get_async_db),
 ):
-    """Search for relevant chunks using vector similarity"""
-    
-    # Get query embedding
-    query_embedding = get_embedding(request.query)
-    
-    # Perform vector similarity search
-    # Note: This is a simplified version. In production, you'd use pgvector's similarity functions
-    chunks = db.query(Chunk).filter(
-        Chunk.embedding.isnot(None)
-    ).limit(request.top_k).all()
-    
-    # TODO: Implement proper vector similarity search with pgvector
-    # For now, return all chunks with embeddings
-    
+    """Search for relevant chunks using the vector, keyword or hybrid index"""
+    mode = (request.retrieval_mode or DEFAULT_RETRIEVAL_MODE).lower()
+    if mode not in RETRIEVAL_MODES:
+        raise HTTPException(status_code=400, detail=f"retrieval_mode must be one of {list(RETRIEVAL_MODES)}")
+    if request.top_k <= 0:
+        raise HTTPException(status_code=400, detail="top_k must be positive")
+
+    offset = 0
+    depth = min(max(request.depth or SEARCH_PAGE_DEPTH, request.top_k), SEARCH_MAX_DEPTH)
+    if request.cursor:
+        cursor = _decode_cursor(request.cursor)
+        offset, depth = cursor["o"], cursor["d"]
+        if cursor["f"] != _fingerprint(request, mode, depth):
+            raise HTTPException(status_code=400, detail="Cursor does not belong to this search")
+        depth = min(depth, SEARCH_MAX_DEPTH)
+
+    # Same query, scope and depth as the first page, so this is a result-cache hit
+    timings: dict = {}
+    ranked = await run_in_threadpool(
+        retrieve_chunk_ids,
+        request.query,
+        depth,
+        db,
+        document_ids=request.document_ids,
+        batch_id=request.batch_id,
+        mode=mode,
+        timings=timings,
+    )
+    # Keep each chunk once, at its first (best) rank, so pages and totals don't repeat it
+    best: dict = {}
+    for cid, score in ranked:
+        best.setdefault(cid, score)
+    ranked = list(best.items())
+    if request.min_score is not None:
+        ranked = [(cid, score) for cid, score in ranked if score >= request.min_score]
+
+    page = ranked[offset:offset + request.top_k]
+    scores = dict(page)
     chunk_responses = []
-    for chunk in chunks:
-        document = db.query(Document).filter(Document.id == chunk.document_id).first()
+    for chunk in await Hydrator().load_async([cid for cid, _ in page], adb):
         chunk_responses.append(ChunkResponse(
             id=chunk.id,
             content=chunk.content,
@@ -63,14 +139,24 @@ async def search_chunks(
             citation_locator=chunk.citation_locator,
             chunk_index=chunk.chunk_index,
             document={
-                "id": document.id,
-                "name": document.name,
-                "mime_type": document.mime_type
-            }
+                "id": chunk.document.id,
+                "name": chunk.document.name,
+                "mime_type": chunk.document.mime_type
+            },
+            score=round(scores[chunk.id], 6),
         ))
-    
+
+    next_offset = offset + request.top_k
+    next_cursor = (
+        _encode_cursor(next_offset, depth, _fingerprint(request, mode, depth))
+        if next_offset < len(ranked) else None
+    )
     return SearchResponse(
         chunks=chunk_responses,
         query=request.query,
-        total_results=len(chunk_responses)
+        total_results=len(chunk_responses),
+        total_candidates=len(ranked),
+        next_cursor=next_cursor,
+        retrieval_mode=mode,
+        timings=timings,
     )
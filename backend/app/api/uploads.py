@@ -1,5 +1,8 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, Request, UploadFile, File, Form
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, select
 from pydantic import BaseModel
 import boto3
 import uuid
@@ -7,10 +10,23 @@ import os
 from datetime import datetime, timedelta
 from typing import Optional
 
-from app.database import get_db
+from app.database import get_db, get_async_db
 from app.models.models import Document, DocumentStatus, Batch
 from app.services.s3_service import get_s3_client
-from app.services.ingest_service import ingest_document
+from app.services.ingest_service import enqueue_ingest
+from app.services.document_service import delete_documents
+from app.services.upload_service import (
+    MAX_UPLOAD_BYTES,
+    UPLOAD_CHUNK_BYTES,
+    OffsetMismatch,
+    UploadTooLarge,
+    get_upload_sessions,
+    save_upload,
+    stored_offset,
+)
+from app.services.ingest_scheduler import SchedulerFull, PRIORITIES
+from app.services.events import get_broker, batch_topic, sse_event_stream
+from app.services.pagination import sort_key, encode_cursor, decode_cursor, after, clamp_limit
 
 router = APIRouter()
 
@@ -46,6 +62,41 @@ class BatchWithDocumentsResponse(BaseModel):
     name: Optional[str]
     created_at: datetime
     documents: list
+    next_cursor: Optional[str] = None
+
+
+class UploadSessionResponse(BaseModel):
+    document_id: str
+    offset: int
+    size_bytes: int
+    chunk_bytes: int
+    complete: bool = False
+    content_hash: Optional[str] = None
+    duplicate_of: Optional[str] = None
+
+
+def _duplicate_of(document: Document, db: Session) -> Optional[str]:
+    """Id of an earlier document with the same bytes, if any"""
+    match = (
+        db.query(Document.id)
+        .filter(
+            Document.content_hash == document.content_hash,
+            Document.size_bytes == document.size_bytes,
+            Document.id != document.id,
+        )
+        .order_by(Document.created_at.asc())
+        .first()
+    )
+    return match.id if match else None
+
+
+def _uploading_document(document_id: str, db: Session) -> Document:
+    document = db.query(Document).filter(Document.id == document_id).first()
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    if document.status != DocumentStatus.UPLOADING:
+        raise HTTPException(status_code=400, detail="Document not in uploading state")
+    return document
 
 
 @router.post("/init", response_model=UploadInitResponse)
@@ -55,6 +106,11 @@ async def init_upload(
 ):
     """Initialize file upload with presigned URL"""
     
+    if request.size_bytes < 0:
+        raise HTTPException(status_code=400, detail="size_bytes must not be negative")
+    if request.size_bytes > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Files are limited to {MAX_UPLOAD_BYTES} bytes")
+
     # Generate unique document ID
     document_id = str(uuid.uuid4())
     
@@ -106,37 +162,48 @@ async def direct_upload(
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
 ):
-    """Accept file upload directly to the backend for local development."""
-    # Ensure document exists
-    document = db.query(Document).filter(Document.id == document_id).first()
-    if not document:
-        raise HTTPException(status_code=404, detail="Document not found")
+    """Accept file upload directly to the backend for local development.
+
+    Starlette spools the whole multipart body to a temporary file before
+    this runs, so an oversized body has already been received by then.
+    The spooled file is copied to its target in large chunks off the event
+    loop and hashed on the way, and rejected once it passes the declared
+    size. Large files should use the resumable session endpoints, which
+    stream each chunk straight to disk.
+    """
+    # Once uploaded, a document's bytes only change through a new upload
+    document = _uploading_document(document_id, db)
 
-    # Save to local disk
-    import pathlib
-    import shutil
-
-    uploads_root = pathlib.Path("uploaded_files")
-    target_dir = uploads_root / document_id
-    target_dir.mkdir(parents=True, exist_ok=True)
-
-    target_path = target_dir / file.filename
-    with target_path.open("wb") as out_file:
-        shutil.copyfileobj(file.file, out_file)
+    try:
+        # Multipart parts may omit the filename; the document was named at init
+        target_path, content_hash = await save_upload(
+            file, document_id, file.filename or document.name, document.size_bytes,
+        )
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     # Update document record with local path
     document.s3_key = str(target_path)
+    document.content_hash = content_hash
     db.commit()
 
-    return {"message": "File uploaded successfully (direct)", "path": str(target_path)}
+    return {
+        "message": "File uploaded successfully (direct)",
+        "path": str(target_path),
+        "content_hash": content_hash,
+        "duplicate_of": _duplicate_of(document, db),
+    }
 
 
 @router.post("/{document_id}/complete")
 async def complete_upload(
     document_id: str,
+    priority: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
-    """Mark upload as complete and trigger ingestion"""
+    """Mark upload as complete and queue ingestion"""
     
     document = db.query(Document).filter(Document.id == document_id).first()
     if not document:
@@ -144,20 +211,31 @@ async def complete_upload(
     
     if document.status != DocumentStatus.UPLOADING:
         raise HTTPException(status_code=400, detail="Document not in uploading state")
-    
-    # Update status to processing
-    document.status = DocumentStatus.PROCESSING
-    db.commit()
 
-    # In local non-docker mode, ingest synchronously
+    if stored_offset(document_id) is not None:
+        raise HTTPException(status_code=400, detail="Upload session still in progress")
+
+    if priority is not None and priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"priority must be one of {sorted(PRIORITIES)}")
+
     try:
-        ingest_document(document, db)
-    except Exception as e:
-        document.status = DocumentStatus.FAILED
-        db.commit()
-        raise HTTPException(status_code=500, detail=f"Ingestion failed: {e}")
+        job, position = enqueue_ingest(
+            document,
+            db,
+            priority=PRIORITIES[priority] if priority else None,
+        )
+    except SchedulerFull as e:
+        raise HTTPException(
+            status_code=429,
+            detail="Ingestion queue is full, retry later",
+            headers={"Retry-After": str(e.retry_after)},
+        )
 
-    return {"message": "Upload completed, document ready"}
+    return {
+        "message": "Upload completed, ingestion queued",
+        "job_id": job.id,
+        "queue_position": position,
+    }
 
 
 @router.post("/batches", response_model=BatchResponse)
@@ -175,11 +253,40 @@ async def create_batch(
 
 
 @router.get("/batches/{batch_id}", response_model=BatchWithDocumentsResponse)
-async def get_batch(batch_id: str, db: Session = Depends(get_db)):
-    batch = db.query(Batch).filter(Batch.id == batch_id).first()
+async def get_batch(
+    batch_id: str,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    status: Optional[DocumentStatus] = None,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Batch details with one keyset page of its documents, oldest first"""
+    batch = await db.get(Batch, batch_id)
     if not batch:
         raise HTTPException(status_code=404, detail="Batch not found")
-    docs = db.query(Document).filter(Document.batch_id == batch_id).order_by(Document.created_at.asc()).all()
+    limit = clamp_limit(limit)
+    created = sort_key(Document.created_at)
+    stmt = select(
+        Document.id,
+        Document.name,
+        Document.mime_type,
+        Document.size_bytes,
+        Document.status,
+        Document.created_at,
+        created.label("sort_created"),
+    ).where(Document.batch_id == batch_id)
+    if status is not None:
+        stmt = stmt.where(Document.status == status)
+    if cursor:
+        try:
+            stmt = stmt.where(after(created, Document.id, decode_cursor(cursor), descending=False))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    rows = (await db.execute(stmt.order_by(created.asc(), Document.id.asc()).limit(limit + 1))).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].sort_created, rows[-1].id)
     documents = [
         {
             "id": d.id,
@@ -189,11 +296,141 @@ async def get_batch(batch_id: str, db: Session = Depends(get_db)):
             "status": d.status.value if hasattr(d.status, 'value') else str(d.status),
             "created_at": d.created_at.isoformat() if d.created_at else None,
         }
-        for d in docs
+        for d in rows
     ]
     return {
         "id": batch.id,
         "name": batch.name,
         "created_at": batch.created_at,
         "documents": documents,
+        "next_cursor": next_cursor,
+    }
+
+
+@router.delete("/batches/{batch_id}")
+def delete_batch(batch_id: str, db: Session = Depends(get_db)):
+    """Delete a batch with all of its documents, chunks and stored files"""
+    batch = db.query(Batch.id).filter(Batch.id == batch_id).first()
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return delete_documents(db, batch_id=batch_id)
+
+
+@router.get("/batches/{batch_id}/events")
+async def stream_batch_events(batch_id: str, db: Session = Depends(get_db)):
+    """Stream ingestion progress for every document in a batch as server-sent events"""
+    sub = get_broker().subscribe([batch_topic(batch_id)])
+    batch = db.query(Batch).filter(Batch.id == batch_id).first()
+    if not batch:
+        sub.close()
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    # One snapshot read on connect; everything after that is pushed
+    rows = (
+        db.query(Document.status, func.count(Document.id))
+        .filter(Document.batch_id == batch_id)
+        .group_by(Document.status)
+        .all()
+    )
+    counts = {
+        (status.value if hasattr(status, "value") else str(status)): count
+        for status, count in rows
     }
+    initial = {"batch_id": batch_id, "stage": "snapshot", "documents_by_status": counts}
+
+    return StreamingResponse(
+        sse_event_stream(sub, [initial]),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+        }
+    )
+
+
+
+@router.post("/{document_id}/session", response_model=UploadSessionResponse)
+async def open_upload_session(document_id: str, db: Session = Depends(get_db)):
+    """Start a resumable upload, or report how far an existing one got.
+
+    Send the file in pieces with PUT /uploads/{id}/session?offset=N; after a
+    dropped connection, call this again and continue from the returned offset.
+    """
+    document = _uploading_document(document_id, db)
+    offset = await get_upload_sessions().open(document_id)
+    return UploadSessionResponse(
+        document_id=document_id,
+        offset=offset,
+        size_bytes=document.size_bytes,
+        chunk_bytes=UPLOAD_CHUNK_BYTES,
+    )
+
+
+@router.get("/{document_id}/session", response_model=UploadSessionResponse)
+async def get_upload_session(document_id: str, db: Session = Depends(get_db)):
+    """Current offset of a resumable upload"""
+    document = _uploading_document(document_id, db)
+    offset = stored_offset(document_id)
+    if offset is None:
+        raise HTTPException(status_code=404, detail="No upload session")
+    return UploadSessionResponse(
+        document_id=document_id,
+        offset=offset,
+        size_bytes=document.size_bytes,
+        chunk_bytes=UPLOAD_CHUNK_BYTES,
+    )
+
+
+@router.put("/{document_id}/session", response_model=UploadSessionResponse)
+async def upload_session_chunk(
+    document_id: str,
+    offset: int,
+    request: Request,
+    db: Session = Depends(get_db),
+):
+    """Append the raw request body at ``offset``.
+
+    The body is streamed straight to disk. A wrong offset gets 409 with the
+    current one; the upload completes when the declared size is reached.
+    """
+    document = _uploading_document(document_id, db)
+    sessions = get_upload_sessions()
+    try:
+        new_offset, finished = await sessions.append(
+            document_id, offset, request.stream(), document.size_bytes, filename=document.name,
+        )
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="No upload session")
+    except OffsetMismatch as e:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Upload offset is {e.offset}",
+            headers={"Upload-Offset": str(e.offset)},
+        )
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    response = UploadSessionResponse(
+        document_id=document_id,
+        offset=new_offset,
+        size_bytes=document.size_bytes,
+        chunk_bytes=UPLOAD_CHUNK_BYTES,
+    )
+    if finished is not None:
+        target_path, content_hash = finished
+        document.s3_key = str(target_path)
+        document.content_hash = content_hash
+        db.commit()
+        response.complete = True
+        response.content_hash = content_hash
+        response.duplicate_of = _duplicate_of(document, db)
+    return response
+
+
+@router.delete("/{document_id}/session")
+async def abort_upload_session(document_id: str, db: Session = Depends(get_db)):
+    """Abandon a resumable upload and discard the bytes received so far"""
+    _uploading_document(document_id, db)
+    if not await get_upload_sessions().abort(document_id):
+        raise HTTPException(status_code=404, detail="No upload session")
+    return {"message": "Upload session aborted"}
@@ -1,8 +1,12 @@
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.pool import QueuePool, StaticPool
+from contextlib import contextmanager
+from typing import Optional
 import os
+import threading
 
 # Database configuration
 DATABASE_URL = os.getenv(
@@ -11,9 +15,47 @@ DATABASE_URL = os.getenv(
 )
 
 IS_POSTGRES = DATABASE_URL.startswith("postgresql")
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+# In-memory SQLite only exists on one connection, so it can't be pooled
+IS_SQLITE_MEMORY = IS_SQLITE and (":memory:" in DATABASE_URL or DATABASE_URL.rstrip("/") in ("sqlite:", "sqlite+pysqlite:"))
+
+# File-backed SQLite: WAL journaling so readers don't block on the writer, plus
+# tuned pragmas. SQLITE_TUNED=false restores the old single-connection setup.
+SQLITE_TUNED = IS_SQLITE and not IS_SQLITE_MEMORY and os.getenv("SQLITE_TUNED", "true").lower() in ("1", "true", "yes")
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    # Negative means KiB rather than pages
+    "cache_size": -int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024))),
+    "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+}
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
 
 # Create engine
-if DATABASE_URL.startswith("sqlite"):
+if SQLITE_TUNED:
+    # One pooled connection per concurrently active thread
+    engine = create_engine(
+        DATABASE_URL,
+        connect_args={"check_same_thread": False},
+        poolclass=QueuePool,
+        pool_size=int(os.getenv("SQLITE_POOL_SIZE", "8")),
+        max_overflow=int(os.getenv("SQLITE_MAX_OVERFLOW", "16")),
+        pool_pre_ping=True,
+        echo=False,
+    )
+    event.listen(engine, "connect", _apply_sqlite_pragmas)
+elif IS_SQLITE:
     engine = create_engine(
         DATABASE_URL,
         connect_args={"check_same_thread": False},
@@ -34,6 +76,102 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 # Create base class for models
 Base = declarative_base()
 
+# Async engine for read paths in the routers; created on first use so the
+# driver (aiosqlite / asyncpg) is only imported where it's needed
+_async_engine = None
+_async_session_factory: Optional[async_sessionmaker] = None
+
+
+def _async_url(url: str) -> str:
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    if url.startswith("postgresql+psycopg2:"):
+        return "postgresql+asyncpg:" + url[len("postgresql+psycopg2:"):]
+    if url.startswith("postgresql:"):
+        return "postgresql+asyncpg:" + url[len("postgresql:"):]
+    return url
+
+
+def get_async_engine():
+    global _async_engine
+    if _async_engine is None:
+        if IS_SQLITE:
+            _async_engine = create_async_engine(_async_url(DATABASE_URL), echo=False)
+            if SQLITE_TUNED:
+                event.listen(_async_engine.sync_engine, "connect", _apply_sqlite_pragmas)
+        else:
+            _async_engine = create_async_engine(
+                _async_url(DATABASE_URL),
+                pool_pre_ping=True,
+                pool_size=int(os.getenv("DB_ASYNC_POOL_SIZE", "20")),
+                max_overflow=int(os.getenv("DB_ASYNC_MAX_OVERFLOW", "20")),
+                echo=False,
+            )
+    return _async_engine
+
+
+def AsyncSessionLocal() -> AsyncSession:
+    """New AsyncSession; objects stay readable after commit/close."""
+    global _async_session_factory
+    if _async_session_factory is None:
+        _async_session_factory = async_sessionmaker(
+            get_async_engine(), expire_on_commit=False, autoflush=False
+        )
+    return _async_session_factory()
+
+
+class _WriterQueue:
+    """FIFO turnstile: SQLite takes one writer at a time, so let them queue in order.
+
+    Without it, concurrent ingest transactions race for the write lock and
+    the losers spin in busy_timeout; with it they wait their turn here while
+    readers carry on against the WAL snapshot.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._next_ticket = 0
+        self._serving = 0
+
+    @contextmanager
+    def turn(self):
+        with self._cond:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            while ticket != self._serving:
+                self._cond.wait()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._serving += 1
+                self._cond.notify_all()
+
+    def waiting(self) -> int:
+        with self._cond:
+            return max(0, self._next_ticket - self._serving - 1)
+
+
+_writer_queue = _WriterQueue()
+
+
+@contextmanager
+def single_writer():
+    """Hold for the span of a large write transaction; a no-op on Postgres."""
+    if not IS_SQLITE:
+        yield
+        return
+    with _writer_queue.turn():
+        yield
+
+
+def sqlite_status() -> dict:
+    info = {"tuned": SQLITE_TUNED, "writers_waiting": _writer_queue.waiting()}
+    if SQLITE_TUNED:
+        info["pragmas"] = SQLITE_PRAGMAS
+        info["pool"] = engine.pool.status()
+    return info
+
 
 def get_db():
     """Dependency to get database session"""
@@ -44,6 +182,20 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    """Dependency to get an async database session (doesn't block the event loop)"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def dispose_async_engine() -> None:
+    global _async_engine, _async_session_factory
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    _async_engine = None
+    _async_session_factory = None
+
+
 def init_db():
     """Initialize database"""
     try:
@@ -63,18 +215,29 @@ def create_tables():
     try:
         Base.metadata.create_all(bind=engine)
         # Ensure new columns added post-initialization exist (idempotent)
+        added_columns = {"batch_id": "VARCHAR", "content_hash": "VARCHAR(64)"}
         try:
             with engine.connect() as conn:
-                if DATABASE_URL.startswith("sqlite"):
-                    # Check if batch_id exists on documents
+                if IS_SQLITE:
                     res = conn.execute(text("PRAGMA table_info(documents)")).fetchall()
                     cols = {row[1] for row in res}  # name is 2nd column
-                    if "batch_id" not in cols:
-                        conn.execute(text("ALTER TABLE documents ADD COLUMN batch_id VARCHAR"))
+                    for name, ddl in added_columns.items():
+                        if name not in cols:
+                            conn.execute(text(f"ALTER TABLE documents ADD COLUMN {name} {ddl}"))
                 else:
-                    conn.execute(text("ALTER TABLE documents ADD COLUMN IF NOT EXISTS batch_id VARCHAR"))
+                    for name, ddl in added_columns.items():
+                        conn.execute(text(f"ALTER TABLE documents ADD COLUMN IF NOT EXISTS {name} {ddl}"))
+                conn.commit()
+        except Exception as e:
+            print(f"Warning: Could not ensure added columns: {e}")
+        # Indexes added after a table already existed aren't created by create_all
+        try:
+            with engine.begin() as conn:
+                for table in Base.metadata.sorted_tables:
+                    for index in table.indexes:
+                        index.create(bind=conn, checkfirst=True)
         except Exception as e:
-            print(f"Warning: Could not ensure batch_id column: {e}")
+            print(f"Warning: Could not ensure indexes: {e}")
         if IS_POSTGRES:
             try:
                 # Create IVFFlat index if possible (requires ANALYZE after data grows; safe to attempt)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Enum, Float, JSON
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Enum, Float, JSON, Index
 import os
 from app.database import IS_POSTGRES
 from sqlalchemy.orm import relationship
@@ -43,6 +43,8 @@ class Document(Base):
     size_bytes = Column(Integer, nullable=False)
     status = Column(Enum(DocumentStatus), default=DocumentStatus.UPLOADING)
     s3_key = Column(String, nullable=False)
+    # sha256 of the uploaded bytes, for spotting duplicate uploads
+    content_hash = Column(String(64), nullable=True, index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
@@ -50,6 +52,13 @@ class Document(Base):
     chunks = relationship("Chunk", back_populates="document", cascade="all, delete-orphan")
     jobs = relationship("Job", back_populates="document", cascade="all, delete-orphan")
 
+    # Keyset pagination orders by (created_at, id), optionally within a status or batch
+    __table_args__ = (
+        Index("ix_documents_created_id", "created_at", "id"),
+        Index("ix_documents_status_created_id", "status", "created_at", "id"),
+        Index("ix_documents_batch_created_id", "batch_id", "created_at", "id"),
+    )
+
 
 class Batch(Base):
     __tablename__ = "batches"
@@ -63,7 +72,7 @@ class Chunk(Base):
     __tablename__ = "chunks"
 
     id = Column(Integer, primary_key=True, index=True)
-    document_id = Column(String, ForeignKey("documents.id"), nullable=False)
+    document_id = Column(String, ForeignKey("documents.id"), nullable=False, index=True)
     content = Column(Text, nullable=False)
     modality = Column(Enum(Modality), nullable=False)
     citation_locator = Column(JSON, nullable=True)  # page number, frame, timestamp, etc.
@@ -81,7 +90,7 @@ class Job(Base):
     __tablename__ = "jobs"
 
     id = Column(String, primary_key=True, index=True)
-    document_id = Column(String, ForeignKey("documents.id"), nullable=False)
+    document_id = Column(String, ForeignKey("documents.id"), nullable=False, index=True)
     job_type = Column(Enum(JobType), nullable=False)
     status = Column(Enum(JobStatus), default=JobStatus.PENDING)
     error_message = Column(Text, nullable=True)
@@ -0,0 +1,187 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Optional
+
+from app.services import metrics
+
+
+class AdmissionRejected(Exception):
+    """Work was turned away; maps to an HTTP 429/503 with Retry-After."""
+
+    def __init__(self, status_code: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Concurrency limit with a bounded FIFO wait queue and provider cooldown.
+
+    At most ``max_concurrency`` holders run at once. Up to ``max_queue`` more
+    wait in arrival order for at most ``max_wait`` seconds; anyone beyond that
+    is rejected immediately with 429, and anyone who waits too long gets 503.
+    When the provider signals a rate limit, ``note_rate_limited`` starts a
+    cooldown during which new work waits (or is rejected if the cooldown is
+    longer than it could wait anyway).
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int, max_wait: float):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.max_wait = max_wait
+        self._active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._cooldown_until = 0.0
+        # Exponentially weighted average time a slot is held, for Retry-After estimates
+        self._avg_hold = 1.0
+        self._recent_waits: Deque[float] = deque(maxlen=1000)
+        self._stats = {
+            "admitted": 0,
+            "rejected_queue_full": 0,
+            "rejected_wait_timeout": 0,
+            "rejected_cooldown": 0,
+            "rate_limited": 0,
+        }
+
+    # -- admission -----------------------------------------------------
+
+    def _retry_after(self) -> int:
+        backlog = (len(self._waiters) + 1) / self.max_concurrency
+        cooldown = max(0.0, self._cooldown_until - time.monotonic())
+        return max(1, math.ceil(max(cooldown, backlog * self._avg_hold)))
+
+    def check(self) -> None:
+        """Fast pre-flight: raise if new work would be rejected right now."""
+        cooldown = self._cooldown_until - time.monotonic()
+        if cooldown > self.max_wait:
+            raise AdmissionRejected(503, "LLM provider is rate limiting", self._retry_after())
+        if self._active >= self.max_concurrency and len(self._waiters) >= self.max_queue:
+            raise AdmissionRejected(429, "Too many concurrent LLM requests", self._retry_after())
+
+    async def acquire(self) -> None:
+        started = time.monotonic()
+        cooldown = self._cooldown_until - started
+        if cooldown > self.max_wait:
+            self._stats["rejected_cooldown"] += 1
+            raise AdmissionRejected(503, "LLM provider is rate limiting", self._retry_after())
+
+        if self._active < self.max_concurrency and not self._waiters:
+            self._active += 1
+        else:
+            if len(self._waiters) >= self.max_queue:
+                self._stats["rejected_queue_full"] += 1
+                raise AdmissionRejected(429, "Too many concurrent LLM requests", self._retry_after())
+            fut = asyncio.get_running_loop().create_future()
+            self._waiters.append(fut)
+            try:
+                await asyncio.wait_for(asyncio.shield(fut), self.max_wait)
+            except asyncio.TimeoutError:
+                if not (fut.done() and not fut.cancelled()):
+                    fut.cancel()
+                    self._discard(fut)
+                    self._stats["rejected_wait_timeout"] += 1
+                    raise AdmissionRejected(503, "Timed out waiting for an LLM slot", self._retry_after())
+                # The slot was handed over just as we timed out: keep it
+            except BaseException:
+                if fut.done() and not fut.cancelled():
+                    self.release(0.0)
+                else:
+                    fut.cancel()
+                    self._discard(fut)
+                raise
+
+        # Honour a provider cooldown that started while we were queued
+        cooldown = self._cooldown_until - time.monotonic()
+        if cooldown > 0:
+            try:
+                await asyncio.sleep(cooldown)
+            except BaseException:
+                self.release(0.0)
+                raise
+        self._recent_waits.append(time.monotonic() - started)
+        self._stats["admitted"] += 1
+
+    def _discard(self, fut: asyncio.Future) -> None:
+        try:
+            self._waiters.remove(fut)
+        except ValueError:
+            pass
+
+    def release(self, held_for: float) -> None:
+        if held_for > 0:
+            self._avg_hold = 0.9 * self._avg_hold + 0.1 * held_for
+        # Hand the slot straight to the next live waiter so nobody can jump the queue
+        while self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self._active -= 1
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    # -- provider backoff ----------------------------------------------
+
+    def note_rate_limited(self, delay: float) -> None:
+        self._stats["rate_limited"] += 1
+        self._cooldown_until = max(self._cooldown_until, time.monotonic() + delay)
+
+    # -- metrics ---------------------------------------------------------
+
+    def stats(self) -> dict:
+        waits = sorted(self._recent_waits)
+
+        def pct(p: float) -> float:
+            if not waits:
+                return 0.0
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000.0, 3)
+
+        return {
+            **self._stats,
+            "active": self._active,
+            "queue_depth": len(self._waiters),
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "max_wait_s": self.max_wait,
+            "cooldown_remaining_s": round(max(0.0, self._cooldown_until - time.monotonic()), 3),
+            "avg_hold_s": round(self._avg_hold, 3),
+            "wait_ms_p50": pct(0.50),
+            "wait_ms_p95": pct(0.95),
+            "wait_ms_max": round(waits[-1] * 1000.0, 3) if waits else 0.0,
+        }
+
+
+_controller: Optional[AdmissionController] = None
+
+
+def _admission_gauge() -> dict:
+    if _controller is None:
+        return {}
+    return {("active",): _controller._active, ("queued",): len(_controller._waiters)}
+
+
+metrics.Gauge("rag_llm_admission", "LLM calls holding a slot or queued for one", ("state",), fn=_admission_gauge)
+
+
+def get_llm_admission() -> AdmissionController:
+    """Process-wide admission controller for upstream LLM calls"""
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController(
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "32")),
+            max_queue=int(os.getenv("LLM_MAX_QUEUE", "128")),
+            max_wait=float(os.getenv("LLM_MAX_QUEUE_WAIT", "10")),
+        )
+    return _controller
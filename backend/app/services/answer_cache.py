@@ -0,0 +1,196 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+
+def answer_cache_key(model: str, system_prompt: str, query: str, chunks: List[Tuple[int, str]]) -> str:
+    """Stable hash of everything that determines an answer."""
+    h = hashlib.sha256()
+    h.update(json.dumps([model, system_prompt, query], ensure_ascii=False).encode("utf-8"))
+    for chunk_id, content in chunks:
+        h.update(b"\x00")
+        h.update(str(chunk_id).encode("utf-8"))
+        h.update(b"\x01")
+        h.update((content or "").encode("utf-8"))
+    return h.hexdigest()
+
+
+class _DiskBackend:
+    """Answers persisted in a small SQLite file so they survive restarts."""
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " key TEXT PRIMARY KEY, answer TEXT NOT NULL,"
+            " expires_at REAL NOT NULL, used_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_used_at ON answers (used_at)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT answer, expires_at FROM answers WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._conn.execute("DELETE FROM answers WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE answers SET used_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return row[0]
+
+    def put(self, key: str, answer: str, ttl_seconds: float) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers (key, answer, expires_at, used_at) VALUES (?, ?, ?, ?)",
+                (key, answer, now + ttl_seconds, now),
+            )
+            self._conn.execute("DELETE FROM answers WHERE expires_at < ?", (now,))
+            # Size-based eviction: keep the most recently used rows
+            self._conn.execute(
+                "DELETE FROM answers WHERE key IN ("
+                " SELECT key FROM answers ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM answers")
+            self._conn.commit()
+
+
+class AnswerCache:
+    """In-process LRU + TTL answer cache with an optional on-disk second tier."""
+
+    def __init__(
+        self,
+        max_entries: int,
+        max_bytes: int,
+        ttl_seconds: float,
+        disk_path: Optional[str] = None,
+        disk_max_entries: int = 100_000,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._bytes = 0
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        self._disk: Optional[_DiskBackend] = None
+        if disk_path:
+            try:
+                self._disk = _DiskBackend(disk_path, disk_max_entries)
+            except Exception as e:
+                print(f"Warning: Could not open answer cache at {disk_path}: {e}")
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                answer, expires_at = entry
+                if expires_at >= time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return answer
+                self._remove_locked(key)
+        if self._disk is not None:
+            try:
+                answer = self._disk.get(key)
+            except Exception:
+                answer = None
+            if answer is not None:
+                with self._lock:
+                    self._stats["disk_hits"] += 1
+                    self._store_locked(key, answer)
+                return answer
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def put(self, key: str, answer: str) -> None:
+        with self._lock:
+            self._store_locked(key, answer)
+        if self._disk is not None:
+            try:
+                self._disk.put(key, answer, self.ttl_seconds)
+            except Exception:
+                pass
+
+    def _store_locked(self, key: str, answer: str) -> None:
+        if key in self._entries:
+            self._remove_locked(key)
+        size = len(answer.encode("utf-8"))
+        if self.max_entries <= 0 or size > self.max_bytes:
+            return
+        while self._entries and (
+            len(self._entries) >= self.max_entries or self._bytes + size > self.max_bytes
+        ):
+            self._remove_locked(next(iter(self._entries)))
+            self._stats["evictions"] += 1
+        self._entries[key] = (answer, time.monotonic() + self.ttl_seconds)
+        self._bytes += size
+
+    def _remove_locked(self, key: str) -> None:
+        answer, _ = self._entries.pop(key)
+        self._bytes -= len(answer.encode("utf-8"))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self._disk is not None:
+            self._disk.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self._stats["hits"] + self._stats["disk_hits"]
+            lookups = hits + self._stats["misses"]
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "disk": self._disk.path if self._disk is not None else None,
+            }
+
+
+_cache: Optional[AnswerCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> Optional[AnswerCache]:
+    """Get or create the process-wide answer cache (None when disabled)"""
+    global _cache
+    if os.getenv("ANSWER_CACHE_ENABLED", "true").lower() not in ("1", "true", "yes"):
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = AnswerCache(
+                    max_entries=int(os.getenv("ANSWER_CACHE_SIZE", "1024")),
+                    max_bytes=int(os.getenv("ANSWER_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+                    ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+                    disk_path=os.getenv("ANSWER_CACHE_PATH") or None,
+                    disk_max_entries=int(os.getenv("ANSWER_CACHE_DISK_SIZE", "100000")),
+                )
+    return _cache
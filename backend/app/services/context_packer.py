@@ -0,0 +1,149 @@
+import math
+import os
+from typing import Callable, Dict, List, Optional
+
+from app.models.models import Chunk
+
+try:
+    import tiktoken  # type: ignore
+except Exception:  # pragma: no cover
+    tiktoken = None  # type: ignore
+
+# Token budget for the retrieved context portion of the prompt
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+# Longest shared prefix/suffix checked when stitching neighbouring chunks
+MAX_STITCH_OVERLAP = int(os.getenv("CONTEXT_MAX_OVERLAP", "400"))
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "cl100k_base")
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        if tiktoken is not None:
+            try:
+                _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+            except Exception:
+                _encoding = None
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Token count with tiktoken, or a ~4 chars/token estimate if it's unavailable."""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / 4)
+
+
+def _truncate_to_tokens(text: str, max_tokens: int) -> str:
+    encoding = _get_encoding()
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+    return text[: max_tokens * 4]
+
+
+def _overlap(prev: str, nxt: str) -> int:
+    """Length of the longest suffix of ``prev`` that is also a prefix of ``nxt``."""
+    for k in range(min(len(prev), len(nxt), MAX_STITCH_OVERLAP), 0, -1):
+        if prev.endswith(nxt[:k]):
+            return k
+    return 0
+
+
+class PackedSpan:
+    """Consecutive chunks of one document stitched into a single passage."""
+
+    def __init__(self, document_name: str, chunks: List[Chunk], text: str, rank: int):
+        self.document_name = document_name
+        self.chunks = chunks
+        self.text = text
+        self.rank = rank
+
+    @property
+    def chunk_ids(self) -> List[int]:
+        return [chunk.id for chunk in self.chunks]
+
+    @property
+    def citation_locator(self):
+        return self.chunks[0].citation_locator
+
+
+def render_span(span: PackedSpan) -> str:
+    return (
+        f"Document: {span.document_name}\n"
+        f"Content: {span.text}\n"
+        f"Location: {span.citation_locator or 'Unknown'}"
+    )
+
+
+def _build_spans(document_name: str, selected: Dict[int, Chunk], ranks: Dict[int, int]) -> List[PackedSpan]:
+    spans: List[PackedSpan] = []
+    run: List[Chunk] = []
+    text = ""
+    for index in sorted(selected):
+        chunk = selected[index]
+        if run and run[-1].chunk_index == index - 1:
+            text += chunk.content[_overlap(text, chunk.content):]
+            run.append(chunk)
+            continue
+        if run:
+            spans.append(PackedSpan(document_name, run, text, min(ranks[c.id] for c in run)))
+        run, text = [chunk], chunk.content
+    if run:
+        spans.append(PackedSpan(document_name, run, text, min(ranks[c.id] for c in run)))
+    return spans
+
+
+def pack_context(
+    chunks: List[Chunk],
+    budget: Optional[int] = None,
+    counter: Callable[[str], int] = count_tokens,
+) -> List[PackedSpan]:
+    """Fill a token budget with chunks in score order.
+
+    Neighbouring chunks of the same document are stitched into one span with
+    their overlapping text removed, so each added chunk only costs the tokens
+    it actually contributes. Chunks that would overflow the budget are skipped
+    in favour of later (smaller) ones; if even the best chunk doesn't fit it is
+    truncated. Spans are returned ordered by their best-ranked chunk.
+    """
+    budget = CONTEXT_TOKEN_BUDGET if budget is None else budget
+    ranks: Dict[int, int] = {}
+    selected: Dict[str, Dict[int, Chunk]] = {}
+    names: Dict[str, str] = {}
+    doc_spans: Dict[str, List[PackedSpan]] = {}
+    doc_cost: Dict[str, int] = {}
+    total = 0
+
+    for rank, chunk in enumerate(chunks):
+        doc_id = chunk.document_id
+        if chunk.chunk_index in selected.get(doc_id, {}):
+            continue
+        ranks[chunk.id] = rank
+        if doc_id not in names:
+            names[doc_id] = chunk.document.name if chunk.document is not None else doc_id
+        candidate = dict(selected.get(doc_id, {}))
+        candidate[chunk.chunk_index] = chunk
+        spans = _build_spans(names[doc_id], candidate, ranks)
+        cost = sum(counter(render_span(span)) for span in spans)
+        delta = cost - doc_cost.get(doc_id, 0)
+        if total + delta > budget:
+            if total == 0:
+                # Nothing fits yet: keep a truncated version of the best chunk
+                span = spans[0]
+                overhead = counter(render_span(PackedSpan(span.document_name, span.chunks, "", rank)))
+                span.text = _truncate_to_tokens(span.text, max(0, budget - overhead))
+                return [span]
+            continue
+        selected[doc_id] = candidate
+        doc_spans[doc_id] = spans
+        doc_cost[doc_id] = cost
+        total += delta
+
+    packed = [span for spans in doc_spans.values() for span in spans]
+    packed.sort(key=lambda span: span.rank)
+    return packed
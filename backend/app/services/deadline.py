@@ -0,0 +1,78 @@
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+# Default end-to-end budget for a chat request; 0 disables deadlines
+CHAT_DEADLINE_MS = int(os.getenv("CHAT_DEADLINE_MS", "0"))
+# Time held back for the cheapest fallback (keyword search, extractive answer)
+DEADLINE_RESERVE_MS = float(os.getenv("DEADLINE_RESERVE_MS", "50"))
+
+# Starting guesses for stage latency (seconds) until real samples arrive
+_INITIAL_ESTIMATES = {
+    "embed": 0.05,
+    "vector": 0.02,
+    "llm": 3.0,
+    "llm_first_token": 1.0,
+}
+
+_lock = threading.Lock()
+_estimates: Dict[str, float] = dict(_INITIAL_ESTIMATES)
+
+
+class DeadlineExceeded(Exception):
+    """A stage ran out of time; the caller should take its fallback path."""
+
+    def __init__(self, stage: str):
+        super().__init__(f"Deadline exceeded during {stage}")
+        self.stage = stage
+
+
+def observe(stage: str, seconds: float) -> None:
+    """Feed a measured stage duration into its moving estimate."""
+    with _lock:
+        previous = _estimates.get(stage)
+        _estimates[stage] = seconds if previous is None else 0.8 * previous + 0.2 * seconds
+
+
+def expected(stage: str) -> float:
+    with _lock:
+        return _estimates.get(stage, 0.0)
+
+
+class Deadline:
+    """Absolute time budget for one request, plus a record of degradations.
+
+    Stages ask ``allows(stage)`` before starting; that is false when the
+    stage's typical duration would eat into the reserve kept for fallbacks.
+    Each fallback taken is recorded with ``degrade`` so the response can say
+    which path it went down.
+    """
+
+    def __init__(self, budget_ms: float):
+        self.budget_ms = budget_ms
+        self.expires_at = time.monotonic() + budget_ms / 1000.0
+        self.degraded: List[str] = []
+
+    @classmethod
+    def from_ms(cls, budget_ms: Optional[int]) -> Optional["Deadline"]:
+        budget_ms = CHAT_DEADLINE_MS if budget_ms is None else budget_ms
+        return cls(budget_ms) if budget_ms and budget_ms > 0 else None
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def allows(self, stage: str) -> bool:
+        return self.remaining() - DEADLINE_RESERVE_MS / 1000.0 > expected(stage)
+
+    def timeout(self) -> float:
+        """Seconds a stage may block before its fallback must run instead."""
+        return max(0.0, self.remaining() - DEADLINE_RESERVE_MS / 1000.0)
+
+    def degrade(self, step: str) -> None:
+        if step not in self.degraded:
+            self.degraded.append(step)
@@ -0,0 +1,96 @@
+import os
+from typing import Dict, List, Optional
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from app.database import single_writer
+from app.models.models import Batch, Chunk, Document, Job, JobStatus
+from app.services.s3_service import delete_files
+from app.services.ingest_scheduler import get_scheduler
+from app.services.vector_store import remove_chunks as remove_vector_chunks
+from app.services.keyword_index import remove_documents as remove_keyword_documents
+
+# Ids per IN (...) list; keeps each statement under SQLite's bound-parameter limit
+DELETE_SQL_BATCH_SIZE = int(os.getenv("DELETE_SQL_BATCH_SIZE", "500"))
+
+
+def _id_groups(ids: List[str]):
+    for start in range(0, len(ids), DELETE_SQL_BATCH_SIZE):
+        yield ids[start:start + DELETE_SQL_BATCH_SIZE]
+
+
+def delete_documents(
+    db: Session,
+    document_ids: Optional[List[str]] = None,
+    batch_id: Optional[str] = None,
+) -> Dict[str, object]:
+    """Delete documents, their chunks, jobs and stored files in bulk.
+
+    Rows go with set-based DELETEs in one transaction, objects with S3
+    DeleteObjects 1000 keys at a time, and each search index is updated once
+    at the end, however many documents are involved. With ``batch_id`` every
+    document of the batch is deleted along with the batch itself.
+
+    Queued ingest jobs of the documents are dropped from the scheduler. An
+    ingest already running either commits its chunks before the delete
+    (which then removes them) or finds the document gone and writes nothing.
+    """
+    stmt = select(Document.id, Document.s3_key)
+    if batch_id:
+        stmt = stmt.where(Document.batch_id == batch_id)
+        if document_ids:
+            stmt = stmt.where(Document.id.in_(document_ids))
+        rows = db.execute(stmt).all()
+    else:
+        rows = []
+        for group in _id_groups(list(dict.fromkeys(document_ids or []))):
+            rows.extend(db.execute(stmt.where(Document.id.in_(group))).all())
+
+    ids = [row.id for row in rows]
+    job_ids: List[str] = []
+    for group in _id_groups(ids):
+        job_ids.extend(db.execute(
+            select(Job.id).where(
+                Job.document_id.in_(group),
+                Job.status.in_([JobStatus.PENDING, JobStatus.PROCESSING]),
+            )
+        ).scalars())
+    if job_ids:
+        get_scheduler().cancel(job_ids)
+
+    chunk_ids: List[int] = []
+    with single_writer():
+        for group in _id_groups(ids):
+            # Row locks order this against an ingest's own check on Postgres;
+            # on SQLite single_writer() already does. Chunk ids are read inside,
+            # so chunks an ingest committed just before are included.
+            db.execute(select(Document.id).where(Document.id.in_(group)).with_for_update()).all()
+            chunk_ids.extend(db.execute(select(Chunk.id).where(Chunk.document_id.in_(group))).scalars())
+            db.execute(delete(Chunk).where(Chunk.document_id.in_(group)), execution_options={"synchronize_session": False})
+            db.execute(delete(Job).where(Job.document_id.in_(group)), execution_options={"synchronize_session": False})
+            db.execute(delete(Document).where(Document.id.in_(group)), execution_options={"synchronize_session": False})
+        if batch_id and not document_ids:
+            db.execute(delete(Batch).where(Batch.id == batch_id), execution_options={"synchronize_session": False})
+        db.commit()
+
+    if ids:
+        remove_keyword_documents(ids)
+        try:
+            remove_vector_chunks(chunk_ids, db)
+        except Exception as e:
+            print(f"Error updating vector index after delete: {e}")
+
+    failed_keys: List[str] = []
+    try:
+        failed_keys = delete_files(row.s3_key for row in rows)
+    except Exception as e:
+        # Rows are already gone; orphaned objects are only wasted space
+        print(f"Error deleting files from S3: {e}")
+        failed_keys = [row.s3_key for row in rows]
+
+    return {
+        "deleted_documents": len(ids),
+        "deleted_chunks": len(chunk_ids),
+        "failed_s3_keys": failed_keys,
+    }
@@ -1,10 +1,31 @@
 from sentence_transformers import SentenceTransformer
+from collections import OrderedDict
+from typing import Optional, Tuple
 import numpy as np
 import os
+import threading
+import time
+
+from app.services import deadline as deadlines
+from app.services import metrics
 
 # Global model instance
 _model = None
 
+# Recent query embeddings, so a request short on time can skip the model
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "4096"))
+_query_lock = threading.Lock()
+_query_cache: "OrderedDict[str, list]" = OrderedDict()
+
+_EMBED_QUERY = metrics.stage("embed_query")
+_EMBED_BATCH = metrics.stage("embed_batch")
+QUERY_EMBEDDINGS = metrics.Counter(
+    "rag_query_embeddings", "Query embeddings by source (cached, computed, skipped)", ("source",)
+)
+_QUERY_CACHED = QUERY_EMBEDDINGS.labels("cached")
+_QUERY_COMPUTED = QUERY_EMBEDDINGS.labels("computed")
+_QUERY_SKIPPED = QUERY_EMBEDDINGS.labels("skipped")
+
 
 def get_embedding_model():
     """Get or create the embedding model instance"""
@@ -23,10 +44,75 @@ def get_embedding(text: str) -> list:
     return embedding.tolist()
 
 
+def get_query_embedding(
+    text: str,
+    deadline: Optional[deadlines.Deadline] = None,
+) -> Tuple[Optional[list], str]:
+    """(embedding, source) for a search query, reusing recent ones.
+
+    ``source`` is "cached", "computed" or "skipped": with a deadline that
+    can't absorb a model call, a cache miss returns None instead of
+    embedding, and the caller falls back to keyword search.
+    """
+    key = " ".join(text.split())
+    with _query_lock:
+        cached = _query_cache.get(key)
+        if cached is not None:
+            _query_cache.move_to_end(key)
+            _QUERY_CACHED.inc()
+            return cached, "cached"
+    if deadline is not None and not deadline.allows("embed"):
+        deadline.degrade("embedding_skipped")
+        _QUERY_SKIPPED.inc()
+        return None, "skipped"
+    started = time.perf_counter()
+    embedding = get_embedding(text)
+    elapsed = time.perf_counter() - started
+    deadlines.observe("embed", elapsed)
+    _EMBED_QUERY.observe(elapsed)
+    _QUERY_COMPUTED.inc()
+    with _query_lock:
+        _query_cache[key] = embedding
+        while len(_query_cache) > QUERY_EMBEDDING_CACHE_SIZE:
+            _query_cache.popitem(last=False)
+    return embedding, "computed"
+
+
+def peek_query_embedding(text: str) -> Optional[list]:
+    """The embedding retrieval already computed for this query, if still cached; never calls the model."""
+    with _query_lock:
+        return _query_cache.get(" ".join(text.split()))
+
+
+def get_query_embeddings(texts: list[str]) -> list[list]:
+    """Embeddings for many queries; only the ones not seen recently hit the model, in one batch."""
+    keys = [" ".join(text.split()) for text in texts]
+    found: dict = {}
+    with _query_lock:
+        for key in keys:
+            cached = _query_cache.get(key)
+            if cached is not None:
+                _query_cache.move_to_end(key)
+                found[key] = cached
+    missing = list(dict.fromkeys(key for key in keys if key not in found))
+    _QUERY_CACHED.inc(len(keys) - len(missing))
+    _QUERY_COMPUTED.inc(len(missing))
+    if missing:
+        for key, embedding in zip(missing, get_embeddings(missing)):
+            found[key] = embedding
+        with _query_lock:
+            for key in missing:
+                _query_cache[key] = found[key]
+            while len(_query_cache) > QUERY_EMBEDDING_CACHE_SIZE:
+                _query_cache.popitem(last=False)
+    return [found[key] for key in keys]
+
+
 def get_embeddings(texts: list[str]) -> list[list]:
     """Generate embeddings for multiple texts"""
     model = get_embedding_model()
-    embeddings = model.encode(texts)
+    with _EMBED_BATCH.time():
+        embeddings = model.encode(texts)
     return embeddings.tolist()
 
 
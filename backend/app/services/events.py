@@ -0,0 +1,177 @@
+import asyncio
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Set
+
+from app.services.sse import sse_frame, HEARTBEAT, SSE_HEARTBEAT_SECONDS
+
+try:
+    import redis  # type: ignore
+except Exception:  # pragma: no cover
+    redis = None  # type: ignore
+
+
+REDIS_CHANNEL_PREFIX = "rag:events:"
+
+
+def job_topic(job_id: str) -> str:
+    return f"job:{job_id}"
+
+
+def batch_topic(batch_id: str) -> str:
+    return f"batch:{batch_id}"
+
+
+class Subscription:
+    """A subscriber's queue on one or more topics; iterate with ``get``."""
+
+    def __init__(self, broker: "EventBroker", topics: List[str], maxsize: int):
+        self.broker = broker
+        self.topics = topics
+        self.loop = asyncio.get_running_loop()
+        self.queue: "asyncio.Queue[dict]" = asyncio.Queue(maxsize=maxsize)
+
+    def _offer(self, event: dict) -> None:
+        # Runs on the subscriber's loop; drop the oldest event rather than block publishers
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[dict]:
+        """Next event, or None if ``timeout`` elapses first."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self) -> None:
+        self.broker.unsubscribe(self)
+
+
+class EventBroker:
+    """In-process topic pub/sub bridging worker threads to asyncio subscribers.
+
+    Publishing to a topic nobody is listening on is a dict lookup, so progress
+    reporting costs nothing when no client is watching. When REDIS_URL is set
+    and ``EVENTS_BACKEND=redis``, events are relayed through Redis pub/sub so
+    subscribers in other processes see them too.
+    """
+
+    def __init__(self, redis_url: Optional[str] = None):
+        self._lock = threading.Lock()
+        self._subs: Dict[str, Set[Subscription]] = {}
+        self._redis = None
+        if redis_url and redis is not None:
+            try:
+                self._redis = redis.Redis.from_url(redis_url)
+                self._redis.ping()
+                threading.Thread(target=self._redis_listener, name="events-redis", daemon=True).start()
+            except Exception as e:
+                print(f"Warning: Redis events unavailable, using in-process broker: {e}")
+                self._redis = None
+
+    def subscribe(self, topics: List[str], maxsize: int = 256) -> Subscription:
+        sub = Subscription(self, topics, maxsize)
+        with self._lock:
+            for topic in topics:
+                self._subs.setdefault(topic, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            for topic in sub.topics:
+                subs = self._subs.get(topic)
+                if subs is None:
+                    continue
+                subs.discard(sub)
+                if not subs:
+                    del self._subs[topic]
+
+    def publish(self, topics: List[str], event: dict) -> None:
+        """Publish an event to topics. Safe to call from any thread."""
+        if self._redis is not None:
+            try:
+                payload = json.dumps({"topics": topics, "event": event})
+                self._redis.publish(REDIS_CHANNEL_PREFIX + "all", payload)
+                return
+            except Exception:
+                pass
+        self._deliver(topics, event)
+
+    def _deliver(self, topics: List[str], event: dict) -> None:
+        with self._lock:
+            targets: Set[Subscription] = set()
+            for topic in topics:
+                targets.update(self._subs.get(topic, ()))
+        for sub in targets:
+            try:
+                sub.loop.call_soon_threadsafe(sub._offer, event)
+            except RuntimeError:
+                # Subscriber's loop is gone
+                self.unsubscribe(sub)
+
+    def _redis_listener(self) -> None:
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(REDIS_CHANNEL_PREFIX + "all")
+        for message in pubsub.listen():
+            try:
+                data = json.loads(message["data"])
+                self._deliver(data["topics"], data["event"])
+            except Exception:
+                continue
+
+
+_broker: Optional[EventBroker] = None
+_broker_lock = threading.Lock()
+
+
+def get_broker() -> EventBroker:
+    """Get or create the process-wide event broker"""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                redis_url = None
+                if os.getenv("EVENTS_BACKEND", "local").lower() == "redis":
+                    redis_url = os.getenv("REDIS_URL", "redis://localhost:6379")
+                _broker = EventBroker(redis_url)
+    return _broker
+
+
+def publish_progress(job_id: Optional[str], batch_id: Optional[str], event: dict) -> None:
+    """Publish an ingestion progress event to its job and batch topics."""
+    topics = []
+    if job_id:
+        topics.append(job_topic(job_id))
+    if batch_id:
+        topics.append(batch_topic(batch_id))
+    if topics:
+        get_broker().publish(topics, event)
+
+
+async def sse_event_stream(
+    sub: Subscription,
+    initial: List[dict],
+    terminal_stages: Set[str] = frozenset(),
+    keepalive: float = SSE_HEARTBEAT_SECONDS,
+):
+    """Render a subscription as SSE frames, closing after a terminal stage."""
+    try:
+        for event in initial:
+            yield sse_frame(event)
+            if event.get("stage") in terminal_stages:
+                return
+        while True:
+            event = await sub.get(timeout=keepalive)
+            if event is None:
+                yield HEARTBEAT
+                continue
+            yield sse_frame(event)
+            if event.get("stage") in terminal_stages:
+                return
+    finally:
+        sub.close()
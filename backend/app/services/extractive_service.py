@@ -0,0 +1,127 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.models.models import Chunk
+from app.services.embedding_service import get_embeddings
+
+EXTRACTIVE_MAX_SPANS = int(os.getenv("EXTRACTIVE_MAX_SPANS", "3"))
+EXTRACTIVE_MIN_CHARS = int(os.getenv("EXTRACTIVE_MIN_CHARS", "20"))
+# Sentence embeddings kept per chunk, so repeat lookups only embed the query
+EXTRACTIVE_CACHE_SIZE = int(os.getenv("EXTRACTIVE_CACHE_SIZE", "4096"))
+
+_SENTENCE_RE = re.compile(r"[^.!?\n]*[.!?]+|[^.!?\n]+")
+
+_cache_lock = threading.Lock()
+# (chunk_id, content hash) -> (sentence offsets, normalised embedding matrix)
+_sentence_cache: "OrderedDict[Tuple[int, int], Tuple[List[Tuple[int, int]], np.ndarray]]" = OrderedDict()
+
+
+def split_sentences(text: str) -> List[Tuple[int, int]]:
+    """(start, end) offsets of sentences in text, whitespace-trimmed."""
+    offsets: List[Tuple[int, int]] = []
+    for match in _SENTENCE_RE.finditer(text):
+        start, end = match.span()
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if end - start >= EXTRACTIVE_MIN_CHARS:
+            offsets.append((start, end))
+    return offsets
+
+
+def _normalize(mat: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(mat, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return mat / norms
+
+
+def extract_answer(
+    query: str,
+    chunks: List[Chunk],
+    max_spans: int = EXTRACTIVE_MAX_SPANS,
+    query_embedding: Optional[List[float]] = None,
+) -> dict:
+    """Pick the sentences in the retrieved chunks that best match the query.
+
+    All sentences not already cached are embedded in one batch together with
+    the query, then scored with a single matrix-vector product. Returns the
+    joined answer text plus spans carrying chunk ids, character offsets into
+    the chunk content and the chunk's citation locator.
+    """
+    keys: List[Tuple[int, int]] = []
+    cached: Dict[Tuple[int, int], Tuple[List[Tuple[int, int]], np.ndarray]] = {}
+    pending: List[Tuple[Tuple[int, int], Chunk, List[Tuple[int, int]]]] = []
+    with _cache_lock:
+        for chunk in chunks:
+            key = (chunk.id, hash(chunk.content))
+            keys.append(key)
+            hit = _sentence_cache.get(key)
+            if hit is not None:
+                _sentence_cache.move_to_end(key)
+                cached[key] = hit
+    for chunk, key in zip(chunks, keys):
+        if key not in cached:
+            pending.append((key, chunk, split_sentences(chunk.content or "")))
+
+    texts: List[str] = [] if query_embedding is not None else [query]
+    for _, chunk, offsets in pending:
+        texts.extend(chunk.content[s:e] for s, e in offsets)
+    vectors = np.asarray(get_embeddings(texts), dtype="float32") if texts else np.zeros((0, 0), dtype="float32")
+    if query_embedding is None:
+        q = np.asarray(vectors[0], dtype="float32")
+        vectors = vectors[1:]
+    else:
+        q = np.asarray(query_embedding, dtype="float32")
+    q = q / (np.linalg.norm(q) or 1.0)
+
+    pos = 0
+    with _cache_lock:
+        for key, _, offsets in pending:
+            mat = _normalize(vectors[pos:pos + len(offsets)]) if offsets else np.zeros((0, q.shape[0]), dtype="float32")
+            pos += len(offsets)
+            cached[key] = (offsets, mat)
+            _sentence_cache[key] = (offsets, mat)
+        while len(_sentence_cache) > EXTRACTIVE_CACHE_SIZE:
+            _sentence_cache.popitem(last=False)
+
+    # Stack every sentence of every chunk and score them in one product
+    owners: List[Tuple[Chunk, Tuple[int, int]]] = []
+    mats: List[np.ndarray] = []
+    for chunk, key in zip(chunks, keys):
+        offsets, mat = cached[key]
+        if not offsets:
+            continue
+        owners.extend((chunk, off) for off in offsets)
+        mats.append(mat)
+    if not mats:
+        return {"answer": "", "spans": []}
+    scores = np.vstack(mats) @ q
+
+    spans: List[dict] = []
+    seen = set()
+    for i in np.argsort(-scores):
+        chunk, (start, end) = owners[int(i)]
+        sentence = chunk.content[start:end]
+        # Adjacent chunks overlap, so the same sentence can appear twice
+        norm = " ".join(sentence.lower().split())
+        if norm in seen:
+            continue
+        seen.add(norm)
+        spans.append({
+            "text": sentence,
+            "score": round(float(scores[int(i)]), 4),
+            "chunk_id": chunk.id,
+            "start": start,
+            "end": end,
+            "document": {"id": chunk.document.id, "name": chunk.document.name},
+            "citation_locator": chunk.citation_locator,
+        })
+        if len(spans) >= max_spans:
+            break
+    return {"answer": " ".join(span["text"] for span in spans), "spans": spans}
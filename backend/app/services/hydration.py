@@ -0,0 +1,120 @@
+import os
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.models.models import Chunk, Document
+
+# Length of the citation snippet cut by the database
+SNIPPET_CHARS = int(os.getenv("SNIPPET_CHARS", "200"))
+
+
+class DocumentRef:
+    """The document fields retrieval results need, shared by all chunks of a document."""
+
+    __slots__ = ("id", "name", "mime_type")
+
+    def __init__(self, id: str, name: str, mime_type: Optional[str]):
+        self.id = id
+        self.name = name
+        self.mime_type = mime_type
+
+
+class HydratedChunk:
+    """Read-only view of a chunk row plus its document.
+
+    Quacks like ``Chunk`` for everything retrieval consumers touch, but never
+    carries the embedding, and only carries ``content`` when it was asked for;
+    ``snippet`` is always there for citations.
+    """
+
+    __slots__ = ("id", "document_id", "chunk_index", "modality", "citation_locator", "snippet", "content", "document")
+
+    def __init__(self, id, document_id, chunk_index, modality, citation_locator, snippet, content, document):
+        self.id = id
+        self.document_id = document_id
+        self.chunk_index = chunk_index
+        self.modality = modality
+        self.citation_locator = citation_locator
+        self.snippet = snippet
+        self.content = content
+        self.document = document
+
+
+class Hydrator:
+    """Per-request identity map for chunks and documents.
+
+    Ids already loaded in this request aren't fetched again, and every chunk
+    of a document points at the same ``DocumentRef``. Missing ids are loaded
+    in one joined query that projects only the needed columns and cuts the
+    snippet server-side; full ``content`` is deferred unless requested.
+    """
+
+    def __init__(self):
+        self._chunks: Dict[int, HydratedChunk] = {}
+        self._documents: Dict[str, DocumentRef] = {}
+
+    def _missing(self, ids: Iterable[int], with_content: bool) -> List[int]:
+        missing = []
+        for cid in ids:
+            chunk = self._chunks.get(cid)
+            if chunk is None or (with_content and chunk.content is None):
+                missing.append(cid)
+        return list(dict.fromkeys(missing))
+
+    @staticmethod
+    def _statement(ids: List[int], with_content: bool):
+        columns = [
+            Chunk.id,
+            Chunk.document_id,
+            Chunk.chunk_index,
+            Chunk.modality,
+            Chunk.citation_locator,
+            # One extra char tells us whether the snippet was cut
+            func.substr(Chunk.content, 1, SNIPPET_CHARS + 1).label("snippet"),
+            Document.name,
+            Document.mime_type,
+        ]
+        if with_content:
+            columns.append(Chunk.content)
+        return select(*columns).join(Document, Document.id == Chunk.document_id).where(Chunk.id.in_(ids))
+
+    def _absorb(self, rows, with_content: bool) -> None:
+        for row in rows:
+            document = self._documents.get(row.document_id)
+            if document is None:
+                document = DocumentRef(row.document_id, row.name, row.mime_type)
+                self._documents[row.document_id] = document
+            snippet = row.snippet or ""
+            if len(snippet) > SNIPPET_CHARS:
+                snippet = snippet[:SNIPPET_CHARS] + "..."
+            self._chunks[row.id] = HydratedChunk(
+                row.id,
+                row.document_id,
+                row.chunk_index,
+                row.modality,
+                row.citation_locator,
+                snippet,
+                row.content if with_content else None,
+                document,
+            )
+
+    def _ordered(self, ids: List[int]) -> List[HydratedChunk]:
+        # One entry per chunk even if the index returned an id twice
+        return [self._chunks[cid] for cid in dict.fromkeys(ids) if cid in self._chunks]
+
+    def load(self, ids: List[int], db: Session, with_content: bool = True) -> List[HydratedChunk]:
+        """Chunks for ``ids`` in the given order; unknown and repeated ids are dropped."""
+        missing = self._missing(ids, with_content)
+        if missing:
+            self._absorb(db.execute(self._statement(missing, with_content)).all(), with_content)
+        return self._ordered(ids)
+
+    async def load_async(self, ids: List[int], adb: AsyncSession, with_content: bool = True) -> List[HydratedChunk]:
+        missing = self._missing(ids, with_content)
+        if missing:
+            result = await adb.execute(self._statement(missing, with_content))
+            self._absorb(result.all(), with_content)
+        return self._ordered(ids)
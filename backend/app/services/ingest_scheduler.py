@@ -0,0 +1,254 @@
+import os
+import threading
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, List, Optional
+
+from app.services import metrics
+
+# Priorities: lower value is served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+PRIORITIES = {"interactive": PRIORITY_INTERACTIVE, "bulk": PRIORITY_BULK}
+
+
+class SchedulerFull(Exception):
+    """Raised when the ingestion queue cannot admit more work."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Ingestion queue is full")
+        self.retry_after = retry_after
+
+
+class _Task:
+    __slots__ = ("job_id", "batch_key", "priority", "fn")
+
+    def __init__(self, job_id: str, batch_key: str, priority: int, fn: Callable[[str], None]):
+        self.job_id = job_id
+        self.batch_key = batch_key
+        self.priority = priority
+        self.fn = fn
+
+
+class IngestScheduler:
+    """Fair, priority-aware dispatcher for ingestion jobs.
+
+    Jobs are queued per priority and, within a priority, per batch. Workers
+    take the highest non-empty priority and round-robin across its batches, so
+    a large batch only ever gets one turn per round. A global cap bounds the
+    number of worker threads and a per-batch cap bounds how many of those a
+    single batch may occupy at once.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        per_batch_concurrency: int,
+        max_queued: int,
+        bulk_threshold: int,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.per_batch_concurrency = max(1, per_batch_concurrency)
+        self.max_queued = max_queued
+        self.bulk_threshold = bulk_threshold
+        self._cond = threading.Condition()
+        self._queues: Dict[int, "OrderedDict[str, Deque[_Task]]"] = {
+            p: OrderedDict() for p in sorted(PRIORITIES.values())
+        }
+        self._running: Dict[str, int] = {}
+        self._queued = 0
+        self._workers: List[threading.Thread] = []
+        self._stopped = False
+
+    # -- admission -----------------------------------------------------
+
+    def submit(
+        self,
+        job_id: str,
+        batch_key: str,
+        fn: Callable[[str], None],
+        priority: Optional[int] = None,
+    ) -> int:
+        """Queue a job and return its estimated queue position (0 = next)."""
+        with self._cond:
+            if self.max_queued and self._queued >= self.max_queued:
+                raise SchedulerFull(retry_after=self._retry_after())
+            if priority is None:
+                priority = self._auto_priority(batch_key)
+            queue = self._queues[priority].setdefault(batch_key, deque())
+            queue.append(_Task(job_id, batch_key, priority, fn))
+            self._queued += 1
+            self._ensure_workers()
+            self._cond.notify()
+            return self._position_locked(job_id)
+
+    def cancel(self, job_ids) -> int:
+        """Drop queued jobs before a worker picks them up; returns how many were dropped.
+
+        Jobs already running are not interrupted.
+        """
+        doomed = set(job_ids)
+        if not doomed:
+            return 0
+        dropped = 0
+        with self._cond:
+            for batches in self._queues.values():
+                for key in list(batches.keys()):
+                    queue = batches[key]
+                    kept = deque(task for task in queue if task.job_id not in doomed)
+                    dropped += len(queue) - len(kept)
+                    if kept:
+                        batches[key] = kept
+                    else:
+                        del batches[key]
+            self._queued -= dropped
+        return dropped
+
+    def _auto_priority(self, batch_key: str) -> int:
+        # Batches that already have a backlog are demoted so one-off uploads stay fast
+        backlog = sum(len(q.get(batch_key, ())) for q in self._queues.values())
+        backlog += self._running.get(batch_key, 0)
+        if self.bulk_threshold and backlog >= self.bulk_threshold:
+            return PRIORITY_BULK
+        return PRIORITY_INTERACTIVE
+
+    def _retry_after(self) -> int:
+        # Rough guess: one round of the workers per queued slot over capacity
+        return max(1, self._queued // self.max_concurrency)
+
+    # -- introspection -------------------------------------------------
+
+    def position(self, job_id: str) -> Optional[int]:
+        """Estimated number of jobs dispatched before this one, or None if not queued."""
+        with self._cond:
+            return self._position_locked(job_id)
+
+    def _position_locked(self, job_id: str) -> Optional[int]:
+        ahead = 0
+        for priority in sorted(self._queues):
+            batches = self._queues[priority]
+            for order, (key, queue) in enumerate(batches.items()):
+                for k, task in enumerate(queue):
+                    if task.job_id != job_id:
+                        continue
+                    # Round-robin: every other batch gets up to k turns first, plus one
+                    # more if it comes earlier in the rotation.
+                    for other_order, (other_key, other) in enumerate(batches.items()):
+                        if other_key == key:
+                            continue
+                        ahead += min(len(other), k)
+                        if len(other) > k and other_order < order:
+                            ahead += 1
+                    return ahead + k
+            ahead += sum(len(q) for q in batches.values())
+        return None
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "queued": self._queued,
+                "running": sum(self._running.values()),
+                "max_concurrency": self.max_concurrency,
+                "per_batch_concurrency": self.per_batch_concurrency,
+                "max_queued": self.max_queued,
+                "queued_by_priority": {
+                    name: sum(len(q) for q in self._queues[p].values())
+                    for name, p in PRIORITIES.items()
+                },
+                "active_batches": len({
+                    key for p in self._queues for key in self._queues[p]
+                } | set(self._running)),
+            }
+
+    # -- dispatch ------------------------------------------------------
+
+    def _ensure_workers(self) -> None:
+        while len(self._workers) < self.max_concurrency:
+            worker = threading.Thread(
+                target=self._worker_loop,
+                name=f"ingest-worker-{len(self._workers)}",
+                daemon=True,
+            )
+            self._workers.append(worker)
+            worker.start()
+
+    def _next_task_locked(self) -> Optional[_Task]:
+        for priority in sorted(self._queues):
+            batches = self._queues[priority]
+            for key in list(batches.keys()):
+                if self._running.get(key, 0) >= self.per_batch_concurrency:
+                    continue
+                queue = batches.pop(key)
+                task = queue.popleft()
+                if queue:
+                    # Rotate the batch to the back for round-robin fairness
+                    batches[key] = queue
+                return task
+        return None
+
+    def _worker_loop(self) -> None:
+        while True:
+            with self._cond:
+                task = self._next_task_locked()
+                while task is None and not self._stopped:
+                    self._cond.wait()
+                    task = self._next_task_locked()
+                if task is None:
+                    return
+                self._queued -= 1
+                self._running[task.batch_key] = self._running.get(task.batch_key, 0) + 1
+            try:
+                task.fn(task.job_id)
+            except Exception as e:
+                print(f"Ingest job {task.job_id} failed: {e}")
+            finally:
+                with self._cond:
+                    remaining = self._running.get(task.batch_key, 1) - 1
+                    if remaining > 0:
+                        self._running[task.batch_key] = remaining
+                    else:
+                        self._running.pop(task.batch_key, None)
+                    # A per-batch slot opened up; wake everyone so capped batches are re-checked
+                    self._cond.notify_all()
+
+    def shutdown(self) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+
+_scheduler: Optional[IngestScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def _queue_gauge() -> dict:
+    if _scheduler is None:
+        return {}
+    stats = _scheduler.stats()
+    return {("queued",): stats["queued"], ("running",): stats["running"]}
+
+
+metrics.Gauge("rag_ingest_jobs", "Ingest jobs queued and running", ("state",), fn=_queue_gauge)
+
+
+def get_scheduler() -> IngestScheduler:
+    """Get or create the process-wide ingestion scheduler"""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                from app.database import IS_POSTGRES
+                # SQLite defaults to one worker even when tuned; raise
+                # INGEST_MAX_CONCURRENCY to overlap extraction and embedding there
+                default_concurrency = "4" if IS_POSTGRES else "1"
+                _scheduler = IngestScheduler(
+                    max_concurrency=int(os.getenv("INGEST_MAX_CONCURRENCY", default_concurrency)),
+                    per_batch_concurrency=int(os.getenv("INGEST_PER_BATCH_CONCURRENCY", "2")),
+                    max_queued=int(os.getenv("INGEST_MAX_QUEUED", "20000")),
+                    bulk_threshold=int(os.getenv("INGEST_BULK_THRESHOLD", "20")),
+                )
+    return _scheduler
+
+
+def batch_key_for(document_id: str, batch_id: Optional[str]) -> str:
+    """Fairness key: the batch, or the document itself for unbatched uploads."""
+    return f"batch:{batch_id}" if batch_id else f"doc:{document_id}"
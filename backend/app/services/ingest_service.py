@@ -1,12 +1,56 @@
+import io
 import json
 import os
-from typing import List
+import uuid
+from typing import BinaryIO, Callable, List, Optional
 
 from sqlalchemy.orm import Session
 
-from app.models.models import Document, DocumentStatus, Chunk, Modality
+from app.database import SessionLocal, single_writer
+from app.models.models import Document, DocumentStatus, Chunk, Modality, Job, JobStatus, JobType
 from app.services.embedding_service import get_embeddings
-from app.services.vector_store import add_embeddings
+from app.services.vector_store import add_embeddings, remove_chunks as remove_vector_chunks
+from app.services.keyword_index import add_chunks as add_keyword_chunks, remove_documents as remove_keyword_documents
+from app.services.ingest_scheduler import SchedulerFull, get_scheduler, batch_key_for
+from app.services.events import publish_progress
+from app.services.s3_service import open_object
+from app.services import metrics
+
+# Progress callback: progress(stage, **fields)
+ProgressFn = Callable[..., None]
+
+EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", "64"))
+# Documents whose s3_key isn't a local path are streamed from object storage.
+# Off unless asked for or object storage is configured, so a local-only setup
+# fails such documents straight away instead of waiting on S3 retries.
+_S3_CONFIGURED = bool(os.getenv("S3_ENDPOINT_URL") or os.getenv("S3_BUCKET"))
+INGEST_FROM_S3 = os.getenv("INGEST_FROM_S3", "true" if _S3_CONFIGURED else "false").lower() in ("1", "true", "yes")
+
+_EXTRACT = metrics.stage("ingest_extract")
+_EMBED = metrics.stage("ingest_embed")
+_PERSIST = metrics.stage("ingest_persist")
+_INDEX = metrics.stage("ingest_index")
+_INGEST = metrics.stage("ingest_total")
+INGESTED_DOCUMENTS = metrics.Counter(
+    "rag_ingested_documents", "Ingest attempts by outcome (ready, retried, failed, cancelled)", ("status",)
+)
+INGESTED_CHUNKS = metrics.Counter("rag_ingested_chunks", "Chunks written by ingestion")
+
+
+class DocumentDeleted(Exception):
+    """The document was deleted while it was being ingested."""
+
+
+def _noop_progress(stage: str, **fields) -> None:
+    return None
+
+
+def _document_exists(db: Session, document_id: str, lock: bool = False) -> bool:
+    stmt = db.query(Document.id).filter(Document.id == document_id)
+    if lock:
+        # Pairs with the row lock delete_documents takes (a no-op on SQLite)
+        stmt = stmt.with_for_update()
+    return stmt.first() is not None
 
 
 def _chunk_text(text: str, chunk_size: int = 800, overlap: int = 100) -> List[str]:
@@ -24,61 +68,99 @@ def _chunk_text(text: str, chunk_size: int = 800, overlap: int = 100) -> List[st
     return chunks
 
 
-def _extract_text_from_pdf(file_path: str) -> str:
+def _extract_text_from_pdf(source: BinaryIO, progress: ProgressFn = _noop_progress) -> str:
     try:
         from PyPDF2 import PdfReader
-        reader = PdfReader(file_path)
+        reader = PdfReader(source)
         pages_text = []
+        pages_total = len(reader.pages)
         for page in reader.pages:
             pages_text.append(page.extract_text() or "")
+            progress("extracting", pages_done=len(pages_text), pages_total=pages_total)
         return "\n".join(pages_text)
     except Exception as e:
         return f"[PDF text extraction failed: {e}]"
 
 
-def _extract_text_generic(file_path: str) -> str:
+def _extract_text_generic(source: BinaryIO) -> str:
     try:
         # For txt/markdown simple read
-        with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+        with io.TextIOWrapper(source, encoding="utf-8", errors="ignore") as f:
             return f.read()
     except Exception:
         return ""
 
 
-def ingest_document(document: Document, db: Session) -> None:
-    """Synchronously ingest a document from local file into chunks with embeddings."""
-    file_path = document.s3_key  # For direct uploads we stored local path here
-    if not file_path or not os.path.exists(file_path):
+def _open_source(document: Document) -> Optional[BinaryIO]:
+    """Readable, seekable handle on the document's bytes, or None if they're gone.
+
+    Direct uploads keep a local path in ``s3_key``; anything else is read
+    straight from object storage with ranged GETs, so extraction starts
+    right away and no local copy is made.
+    """
+    key = document.s3_key
+    if not key:
+        return None
+    if os.path.exists(key):
+        return open(key, "rb")
+    if not INGEST_FROM_S3:
+        return None
+    try:
+        return open_object(key)
+    except Exception as e:
+        print(f"Error opening {key} from S3: {e}")
+        return None
+
+
+def ingest_document(document: Document, db: Session, progress: ProgressFn = _noop_progress) -> None:
+    """Synchronously ingest a document (local file or S3 object) into chunks with embeddings."""
+    with _INGEST.time():
+        _ingest_document(document, db, progress)
+
+
+def _ingest_document(document: Document, db: Session, progress: ProgressFn) -> None:
+    source = _open_source(document)
+    if source is None:
         document.status = DocumentStatus.FAILED
         db.commit()
+        INGESTED_DOCUMENTS.labels("failed").inc()
         return
 
+    progress("extracting")
+
     # Very simple modality detection
     mime = (document.mime_type or "").lower()
+    name = (document.s3_key or "").lower()
     text: str = ""
     modality = Modality.TEXT
 
-    if "/pdf" in mime or file_path.lower().endswith(".pdf"):
-        text = _extract_text_from_pdf(file_path)
-    elif mime.startswith("text/") or file_path.lower().endswith((".txt", ".md")):
-        text = _extract_text_generic(file_path)
-    else:
-        # For images/audio/video, skip heavy OCR/ASR in local mode
-        text = f"Uploaded file '{document.name}' (type {document.mime_type})"
+    with source, _EXTRACT.time():
+        if "/pdf" in mime or name.endswith(".pdf"):
+            text = _extract_text_from_pdf(source, progress)
+        elif mime.startswith("text/") or name.endswith((".txt", ".md")):
+            text = _extract_text_generic(source)
+        else:
+            # For images/audio/video, skip heavy OCR/ASR in local mode
+            text = f"Uploaded file '{document.name}' (type {document.mime_type})"
 
     # Create chunks
     chunks_text = _chunk_text(text)
     if not chunks_text:
         chunks_text = [text or f"No extractable text for {document.name}"]
 
-    # Embeddings
-    embeddings = get_embeddings(chunks_text)
+    # Embeddings, in slices so progress can be reported
+    chunks_total = len(chunks_text)
+    progress("embedding", chunks_embedded=0, chunks_total=chunks_total)
+    embeddings = []
+    with _EMBED.time():
+        for start in range(0, chunks_total, EMBED_BATCH_SIZE):
+            embeddings.extend(get_embeddings(chunks_text[start:start + EMBED_BATCH_SIZE]))
+            progress("embedding", chunks_embedded=len(embeddings), chunks_total=chunks_total)
 
     # Persist chunks
-    chunk_ids = []
-    to_add = []
-    for idx, (chunk_text, embedding) in enumerate(zip(chunks_text, embeddings)):
-        chunk = Chunk(
+    progress("persisting", chunks_total=chunks_total)
+    chunks = [
+        Chunk(
             document_id=document.id,
             content=chunk_text,
             modality=modality,
@@ -86,17 +168,209 @@ def ingest_document(document: Document, db: Session) -> None:
             embedding=json.dumps(embedding),
             chunk_index=idx,
         )
-        db.add(chunk)
-        db.flush()  # assign id
-        chunk_ids.append(chunk.id)
-        to_add.append((chunk.id, embedding))
+        for idx, (chunk_text, embedding) in enumerate(zip(chunks_text, embeddings))
+    ]
+    # Everything slow is done; the write transaction only covers the inserts.
+    # On SQLite, concurrent ingests take turns here instead of fighting for the lock.
+    # Read ids up front: once a delete lands, touching expired attributes fails
+    document_id = document.id
+    with _PERSIST.time(), single_writer():
+        # A delete that got here first must not be followed by orphaned chunks
+        if not _document_exists(db, document_id, lock=True):
+            db.rollback()
+            raise DocumentDeleted(document_id)
+        db.add_all(chunks)
+        db.flush()  # assign ids in one batched INSERT
+        chunk_ids = [chunk.id for chunk in chunks]
+        document.status = DocumentStatus.READY
+        db.commit()
+    INGESTED_DOCUMENTS.labels("ready").inc()
+    INGESTED_CHUNKS.inc(len(chunks))
+    to_add = list(zip(chunk_ids, embeddings))
+    keyword_rows = [(cid, document_id, content) for cid, content in zip(chunk_ids, chunks_text)]
+    progress("indexing", chunks_total=chunks_total)
+    with _INDEX.time():
+        try:
+            add_embeddings(to_add, db)
+        except Exception:
+            pass
+        try:
+            add_keyword_chunks(keyword_rows)
+        except Exception:
+            pass
+    # Deleted between the chunk commit and the index update: the delete may
+    # have cleaned the indexes before these chunks reached them
+    if not _document_exists(db, document_id):
+        remove_vector_chunks(chunk_ids, db)
+        remove_keyword_documents([document_id])
+        raise DocumentDeleted(document_id)
+
+
+def enqueue_ingest(document: Document, db: Session, priority: Optional[int] = None) -> tuple:
+    """Create an ingest Job for the document and hand it to the scheduler.
 
-    # Update status
-    document.status = DocumentStatus.READY
+    Returns (job, queue_position). Raises SchedulerFull when admission fails,
+    in which case no job row is left behind and the document status is restored.
+    """
+    previous_status = document.status
+    job = Job(
+        id=str(uuid.uuid4()),
+        document_id=document.id,
+        job_type=JobType.INGEST,
+        status=JobStatus.PENDING,
+    )
+    db.add(job)
+    # Flip status before the job becomes visible to workers
+    document.status = DocumentStatus.PROCESSING
     db.commit()
     try:
-        add_embeddings(to_add, db)
+        position = get_scheduler().submit(
+            job.id,
+            batch_key_for(document.id, document.batch_id),
+            run_ingest_job,
+            priority=priority,
+        )
     except Exception:
-        pass
+        db.delete(job)
+        document.status = previous_status
+        db.commit()
+        raise
+    publish_progress(job.id, document.batch_id, {
+        "job_id": job.id,
+        "document_id": document.id,
+        "batch_id": document.batch_id,
+        "stage": "queued",
+        "queue_position": position,
+    })
+    return job, position
+
+
+def _job_progress(job: Job, document: Document) -> ProgressFn:
+    base = {"job_id": job.id, "document_id": document.id, "batch_id": document.batch_id}
+
+    def progress(stage: str, **fields) -> None:
+        # Only the captured ids: the rows may be deleted by the time this runs
+        publish_progress(base["job_id"], base["batch_id"], {**base, "stage": stage, **fields})
 
+    return progress
+
+
+def run_ingest_job(job_id: str) -> None:
+    """Scheduler entry point: run one ingest job in its own session, retrying on failure."""
+    db = SessionLocal()
+    try:
+        job = db.query(Job).filter(Job.id == job_id).first()
+        if not job:
+            return
+        document = db.query(Document).filter(Document.id == job.document_id).first()
+        if not document:
+            job.status = JobStatus.FAILED
+            job.error_message = "Document not found"
+            db.commit()
+            return
+
+        job.status = JobStatus.PROCESSING
+        document.status = DocumentStatus.PROCESSING
+        db.commit()
+        progress = _job_progress(job, document)
+        progress("started")
+        try:
+            ingest_document(document, db, progress)
+        except DocumentDeleted:
+            # The job row went with the document; nothing left to update
+            db.rollback()
+            INGESTED_DOCUMENTS.labels("cancelled").inc()
+            progress("cancelled")
+            return
+        except Exception as e:
+            db.rollback()
+            job.retry_count = (job.retry_count or 0) + 1
+            job.error_message = str(e)
+            if job.retry_count < (job.max_retries or 0):
+                job.status = JobStatus.PENDING
+                db.commit()
+                try:
+                    get_scheduler().submit(
+                        job.id,
+                        batch_key_for(document.id, document.batch_id),
+                        run_ingest_job,
+                    )
+                except SchedulerFull:
+                    # Nothing would ever pick a PENDING job up; fail it so it can be re-triggered
+                    job.error_message = f"{job.error_message}; retry not queued, ingestion queue full"
+                else:
+                    INGESTED_DOCUMENTS.labels("retried").inc()
+                    progress("retrying", retry_count=job.retry_count, error=job.error_message)
+                    return
+            job.status = JobStatus.FAILED
+            document.status = DocumentStatus.FAILED
+            db.commit()
+            INGESTED_DOCUMENTS.labels("failed").inc()
+            progress("failed", error=job.error_message)
+            return
+
+        if document.status == DocumentStatus.READY:
+            job.status = JobStatus.COMPLETED
+        else:
+            job.status = JobStatus.FAILED
+            job.error_message = job.error_message or "Source file not found"
+        db.commit()
+        if job.status == JobStatus.COMPLETED:
+            progress("completed")
+        else:
+            progress("failed", error=job.error_message)
+    finally:
+        db.close()
+
+
+def resume_pending_jobs(db: Session) -> int:
+    """Re-queue ingest jobs left pending or in-flight by a previous process.
+
+    Jobs whose document already reached READY (the process died between the
+    chunk commit and the job update) are closed instead of ingested again.
+    Returns the number of jobs re-queued.
+    """
+    jobs = (
+        db.query(Job)
+        .filter(
+            Job.job_type == JobType.INGEST,
+            Job.status.in_([JobStatus.PENDING, JobStatus.PROCESSING]),
+        )
+        .order_by(Job.created_at.asc())
+        .all()
+    )
+    to_submit = []
+    for job in jobs:
+        document = job.document
+        if not document:
+            continue
+        if document.status == DocumentStatus.READY:
+            job.status = JobStatus.COMPLETED
+            continue
+        job.status = JobStatus.PENDING
+        to_submit.append((job.id, document.id, batch_key_for(document.id, document.batch_id)))
+    # Commit before any worker can see the jobs, or this write would land on
+    # top of the status the worker records
+    db.commit()
+
+    scheduler = get_scheduler()
+    rejected = []
+    for job_id, document_id, batch_key in to_submit:
+        try:
+            scheduler.submit(job_id, batch_key, run_ingest_job)
+        except SchedulerFull:
+            rejected.append((job_id, document_id))
+    if rejected:
+        # Never queued, so no worker touches these rows
+        for job_id, document_id in rejected:
+            db.query(Job).filter(Job.id == job_id).update(
+                {Job.status: JobStatus.FAILED, Job.error_message: "Not resumed: ingestion queue full"},
+                synchronize_session=False,
+            )
+            db.query(Document).filter(Document.id == document_id).update(
+                {Document.status: DocumentStatus.FAILED},
+                synchronize_session=False,
+            )
+        db.commit()
+    return len(to_submit) - len(rejected)
 
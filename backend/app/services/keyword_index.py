@@ -0,0 +1,242 @@
+import heapq
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.models.models import Chunk
+from app.services import metrics
+
+# BM25 parameters
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+# Words, numbers and joined identifiers such as "ab-1234" or "v2.3.1"
+_TOKEN_RE = re.compile(r"[0-9a-z]+(?:[-_./:#][0-9a-z]+)*")
+_SPLIT_RE = re.compile(r"[-_./:#]")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the "
+    "this to was were what when where which who why will with".split()
+)
+
+_lock = threading.RLock()
+# Serializes builds; the scan itself runs without _lock
+_build_lock = threading.Lock()
+_built = False
+# While a build scans the database, index changes are also logged here and
+# replayed on the new postings, since the scan may have missed them
+_pending: Optional[List[Tuple[str, list]]] = None
+# term -> {chunk_id: term frequency}
+_postings: Dict[str, Dict[int, int]] = {}
+_doc_len: Dict[int, int] = {}
+# chunk_id -> distinct terms, so removal only touches that chunk's postings
+_chunk_terms: Dict[int, Tuple[str, ...]] = {}
+_chunk_doc: Dict[int, str] = {}
+_doc_chunks: Dict[str, Set[int]] = {}
+_total_len = 0
+# Bumped on every mutation so result caches can tell they are stale
+_generation = 0
+
+
+def generation() -> int:
+    return _generation
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase terms; joined identifiers are kept whole and also split into parts."""
+    tokens: List[str] = []
+    for tok in _TOKEN_RE.findall((text or "").lower()):
+        if tok in _STOPWORDS:
+            continue
+        tokens.append(tok)
+        if _SPLIT_RE.search(tok):
+            tokens.extend(p for p in _SPLIT_RE.split(tok) if p and p not in _STOPWORDS)
+    return tokens
+
+
+def _add_locked(chunk_id: int, document_id: str, content: str) -> None:
+    global _total_len, _generation
+    _generation += 1
+    if chunk_id in _doc_len:
+        _remove_locked(chunk_id)
+    counts = Counter(tokenize(content))
+    for term, tf in counts.items():
+        _postings.setdefault(term, {})[chunk_id] = tf
+    length = sum(counts.values())
+    _doc_len[chunk_id] = length
+    _total_len += length
+    _chunk_terms[chunk_id] = tuple(counts)
+    _chunk_doc[chunk_id] = document_id
+    _doc_chunks.setdefault(document_id, set()).add(chunk_id)
+
+
+def _remove_locked(chunk_id: int) -> None:
+    global _total_len, _generation
+    _generation += 1
+    _total_len -= _doc_len.pop(chunk_id, 0)
+    for term in _chunk_terms.pop(chunk_id, ()):
+        posting = _postings.get(term)
+        if posting is None:
+            continue
+        posting.pop(chunk_id, None)
+        if not posting:
+            del _postings[term]
+    document_id = _chunk_doc.pop(chunk_id, None)
+    ids = _doc_chunks.get(document_id) if document_id is not None else None
+    if ids is not None:
+        ids.discard(chunk_id)
+        if not ids:
+            del _doc_chunks[document_id]
+
+
+def load_or_build_keyword_index(db: Session) -> None:
+    """Build the inverted index from the database once per process."""
+    if _built:
+        return
+    with _build_lock:
+        # Another thread may have built it while we waited
+        if _built:
+            return
+        _rebuild(db)
+
+
+def rebuild_keyword_index(db: Session) -> None:
+    """Rebuild the inverted index from all chunks in the database.
+
+    The scan and tokenizing run without ``_lock``, so searches and ingests
+    keep using the current index; the new one is swapped in at the end.
+    """
+    with _build_lock:
+        _rebuild(db)
+
+
+def _rebuild(db: Session) -> None:
+    global _postings, _doc_len, _chunk_terms, _chunk_doc, _doc_chunks, _total_len, _generation
+    global _built, _pending
+    with _lock:
+        _pending = []
+    try:
+        postings: Dict[str, Dict[int, int]] = {}
+        doc_len: Dict[int, int] = {}
+        chunk_terms: Dict[int, Tuple[str, ...]] = {}
+        chunk_doc: Dict[int, str] = {}
+        doc_chunks: Dict[str, Set[int]] = {}
+        total_len = 0
+        rows = db.query(Chunk.id, Chunk.document_id, Chunk.content).yield_per(1000)
+        for cid, doc_id, content in rows:
+            cid = int(cid)
+            counts = Counter(tokenize(content))
+            for term, tf in counts.items():
+                postings.setdefault(term, {})[cid] = tf
+            length = sum(counts.values())
+            doc_len[cid] = length
+            total_len += length
+            chunk_terms[cid] = tuple(counts)
+            chunk_doc[cid] = doc_id
+            doc_chunks.setdefault(doc_id, set()).add(cid)
+
+        with _lock:
+            _generation += 1
+            _postings, _doc_len, _chunk_terms = postings, doc_len, chunk_terms
+            _chunk_doc, _doc_chunks, _total_len = chunk_doc, doc_chunks, total_len
+            for op, items in _pending:
+                if op == "add":
+                    for cid, doc_id, content in items:
+                        _add_locked(int(cid), doc_id, content)
+                else:
+                    _remove_documents_locked(items)
+            _built = True
+    finally:
+        with _lock:
+            _pending = None
+
+
+def add_chunks(rows: Iterable[Tuple[int, str, str]]) -> None:
+    """Index (chunk_id, document_id, content) rows; a no-op until the index is built."""
+    rows = list(rows)
+    with _lock:
+        if _pending is not None:
+            _pending.append(("add", rows))
+        if not _built:
+            # The first search builds from the DB, which will include these rows
+            return
+        for cid, doc_id, content in rows:
+            _add_locked(int(cid), doc_id, content)
+
+
+def remove_documents(document_ids: Iterable[str]) -> None:
+    """Drop all indexed chunks belonging to the given documents."""
+    document_ids = list(document_ids)
+    with _lock:
+        if _pending is not None:
+            _pending.append(("remove", document_ids))
+        _remove_documents_locked(document_ids)
+
+
+def _remove_documents_locked(document_ids: List[str]) -> None:
+    for doc_id in document_ids:
+        for cid in list(_doc_chunks.get(doc_id, ())):
+            _remove_locked(cid)
+
+
+def search_keywords(
+    query: str,
+    top_k: int,
+    db: Optional[Session],
+    document_ids: Optional[List[str]] = None,
+) -> List[Tuple[int, float]]:
+    """BM25-ranked (chunk_id, score) pairs, optionally restricted to documents.
+
+    ``db`` is only used to build the index on first use; callers on another
+    thread than the session's pass None once the index is loaded.
+    """
+    if db is not None:
+        load_or_build_keyword_index(db)
+    terms = set(tokenize(query))
+    if not terms or top_k <= 0:
+        return []
+    with _lock:
+        n = len(_doc_len)
+        if n == 0:
+            return []
+        avgdl = _total_len / n if n else 1.0
+        allowed: Optional[Set[int]] = None
+        if document_ids is not None:
+            allowed = set()
+            for doc_id in document_ids:
+                allowed.update(_doc_chunks.get(doc_id, ()))
+            if not allowed:
+                return []
+        scores: Dict[int, float] = {}
+        for term in terms:
+            posting = _postings.get(term)
+            if not posting:
+                continue
+            df = len(posting)
+            idf = math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+            for cid, tf in posting.items():
+                if allowed is not None and cid not in allowed:
+                    continue
+                norm = BM25_K1 * (1.0 - BM25_B + BM25_B * _doc_len[cid] / avgdl)
+                scores[cid] = scores.get(cid, 0.0) + idf * tf * (BM25_K1 + 1.0) / (tf + norm)
+    if not scores:
+        return []
+    best = heapq.nlargest(top_k, scores.items(), key=lambda kv: kv[1])
+    return [(cid, float(score)) for cid, score in best]
+
+
+def index_stats() -> dict:
+    with _lock:
+        return {"chunks": len(_doc_len), "terms": len(_postings), "documents": len(_doc_chunks)}
+
+
+metrics.Gauge(
+    "rag_keyword_index_size",
+    "Entries in the keyword index (chunks, terms, documents)",
+    ("kind",),
+    fn=lambda: {(kind,): n for kind, n in index_stats().items()},
+)
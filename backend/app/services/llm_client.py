@@ -0,0 +1,274 @@
+import asyncio
+import json
+import os
+import random
+import threading
+from pathlib import Path
+from typing import AsyncGenerator, Optional, Tuple
+
+import httpx
+from dotenv import load_dotenv, find_dotenv, dotenv_values
+
+from app.services.admission import get_llm_admission
+
+try:
+    from openai import AsyncOpenAI, APIStatusError  # new SDK (>=1.0)
+except Exception:  # pragma: no cover
+    AsyncOpenAI = None  # type: ignore
+    APIStatusError = None  # type: ignore
+
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+
+# Connection pool shared by the SDK and the raw HTTP path
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "20"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+# Retries on upstream 429/503 before giving up; Retry-After is honoured when sent
+LLM_RATE_LIMIT_RETRIES = int(os.getenv("LLM_RATE_LIMIT_RETRIES", "3"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "20"))
+
+_env_lock = threading.Lock()
+_env_loaded = False
+_root_env_key: Optional[str] = None
+
+_http_client: Optional[httpx.AsyncClient] = None
+_sdk_client = None
+_sdk_client_config: Optional[Tuple[str, str]] = None
+
+
+class LLMUnavailable(Exception):
+    """No API key is configured."""
+
+
+class LLMError(Exception):
+    """The upstream returned an error response."""
+
+    def __init__(self, status_code: int, body: str, retry_after: Optional[float] = None):
+        super().__init__(body or f"HTTP {status_code}")
+        self.status_code = status_code
+        self.body = body
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        return self.status_code in (429, 503)
+
+
+def _parse_retry_after(headers) -> Optional[float]:
+    value = headers.get("retry-after") if headers is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+def _load_env_once() -> None:
+    """Load the root .env a single time instead of on every request."""
+    global _env_loaded, _root_env_key
+    if _env_loaded:
+        return
+    with _env_lock:
+        if _env_loaded:
+            return
+        try:
+            load_dotenv(find_dotenv())
+        except Exception:
+            pass
+        try:
+            # backend/app/services -> parents[3] == project root
+            root_env = Path(__file__).resolve().parents[3] / ".env"
+            if root_env.exists():
+                _root_env_key = dotenv_values(str(root_env)).get("OPENAI_API_KEY")
+        except Exception:
+            pass
+        _env_loaded = True
+
+
+def get_settings() -> Tuple[Optional[str], str, str]:
+    """(api_key, base_url, model) from the environment."""
+    _load_env_once()
+    api_key = os.getenv("OPENAI_API_KEY") or _root_env_key
+    base_url = (os.getenv("OPENAI_BASE_URL") or DEFAULT_BASE_URL).rstrip("/")
+    model = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+    return api_key, base_url, model
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Process-wide keep-alive connection pool for upstream LLM calls."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(LLM_TIMEOUT, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE,
+            ),
+        )
+    return _http_client
+
+
+def _get_sdk_client(api_key: str, base_url: str):
+    """Cached AsyncOpenAI client riding on the shared pool; rebuilt only if config changes."""
+    global _sdk_client, _sdk_client_config
+    if AsyncOpenAI is None or os.getenv("LLM_TRANSPORT", "auto").lower() == "http":
+        return None
+    if _sdk_client is None or _sdk_client_config != (api_key, base_url):
+        # Retries are ours (see _backoff) so rate limits also feed the admission controller
+        _sdk_client = AsyncOpenAI(
+            api_key=api_key, base_url=base_url, http_client=get_http_client(), max_retries=0
+        )
+        _sdk_client_config = (api_key, base_url)
+    return _sdk_client
+
+
+def _as_llm_error(e: Exception) -> Optional[LLMError]:
+    if isinstance(e, LLMError):
+        return e
+    if APIStatusError is not None and isinstance(e, APIStatusError):
+        return LLMError(e.status_code, str(e.message), _parse_retry_after(e.response.headers))
+    return None
+
+
+async def _backoff(error: LLMError, attempt: int) -> None:
+    """Sleep before retrying a rate-limited call, and make new admissions wait too."""
+    delay = error.retry_after
+    if delay is None:
+        delay = LLM_BACKOFF_BASE * (2 ** attempt) * (1 + random.random())
+    delay = min(delay, LLM_BACKOFF_MAX)
+    get_llm_admission().note_rate_limited(delay)
+    await asyncio.sleep(delay)
+
+
+def _payload(model: str, system_prompt: str, user_message: str, stream: bool) -> dict:
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_message},
+        ],
+        "max_tokens": 1000,
+        "temperature": 0.7,
+        "stream": stream,
+    }
+
+
+async def chat_completion(system_prompt: str, user_message: str) -> str:
+    """Full answer text for one chat completion."""
+    api_key, base_url, model = get_settings()
+    if not api_key:
+        raise LLMUnavailable()
+    async with get_llm_admission().slot():
+        attempt = 0
+        while True:
+            try:
+                return await _complete_once(api_key, base_url, model, system_prompt, user_message)
+            except Exception as e:
+                error = _as_llm_error(e)
+                if error is None or not error.retryable or attempt >= LLM_RATE_LIMIT_RETRIES:
+                    raise error or e
+                await _backoff(error, attempt)
+                attempt += 1
+
+
+async def _complete_once(api_key: str, base_url: str, model: str, system_prompt: str, user_message: str) -> str:
+    client = _get_sdk_client(api_key, base_url)
+    if client is not None:
+        response = await client.chat.completions.create(
+            **_payload(model, system_prompt, user_message, stream=False)
+        )
+        return response.choices[0].message.content or ""
+
+    response = await get_http_client().post(
+        f"{base_url}/chat/completions",
+        json=_payload(model, system_prompt, user_message, stream=False),
+        headers={"Authorization": f"Bearer {api_key}"},
+    )
+    if response.status_code >= 400:
+        raise LLMError(response.status_code, response.text, _parse_retry_after(response.headers))
+    choice = response.json().get("choices", [{}])[0]
+    return choice.get("message", {}).get("content", "") or ""
+
+
+async def chat_completion_stream(system_prompt: str, user_message: str) -> AsyncGenerator[str, None]:
+    """Yield answer deltas as the upstream streams them."""
+    api_key, base_url, model = get_settings()
+    if not api_key:
+        raise LLMUnavailable()
+    async with get_llm_admission().slot():
+        attempt = 0
+        while True:
+            started = False
+            try:
+                async for delta in _stream_once(api_key, base_url, model, system_prompt, user_message):
+                    started = True
+                    yield delta
+                return
+            except Exception as e:
+                if started:
+                    # Once tokens have gone out a retry would duplicate them
+                    raise
+                error = _as_llm_error(e)
+                if error is None or not error.retryable or attempt >= LLM_RATE_LIMIT_RETRIES:
+                    raise error or e
+                await _backoff(error, attempt)
+                attempt += 1
+
+
+async def _stream_once(
+    api_key: str, base_url: str, model: str, system_prompt: str, user_message: str
+) -> AsyncGenerator[str, None]:
+    client = _get_sdk_client(api_key, base_url)
+    if client is not None:
+        stream = await client.chat.completions.create(
+            **_payload(model, system_prompt, user_message, stream=True)
+        )
+        async for event in stream:
+            if not event.choices:
+                continue
+            delta = getattr(event.choices[0].delta, "content", None)
+            if delta:
+                yield delta
+        return
+
+    async for delta in _http_stream(api_key, base_url, _payload(model, system_prompt, user_message, stream=True)):
+        yield delta
+
+
+async def _http_stream(api_key: str, base_url: str, payload: dict) -> AsyncGenerator[str, None]:
+    """Parse the upstream's SSE stream (``data: {...}`` lines, ``[DONE]`` terminator)."""
+    async with get_http_client().stream(
+        "POST",
+        f"{base_url}/chat/completions",
+        json=payload,
+        headers={"Authorization": f"Bearer {api_key}", "Accept": "text/event-stream"},
+    ) as response:
+        if response.status_code >= 400:
+            body = (await response.aread()).decode("utf-8", errors="replace")
+            raise LLMError(response.status_code, body, _parse_retry_after(response.headers))
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                return
+            try:
+                obj = json.loads(data)
+            except ValueError:
+                continue
+            choices = obj.get("choices") or [{}]
+            delta = (choices[0].get("delta") or {}).get("content")
+            if delta:
+                yield delta
+
+
+async def aclose() -> None:
+    """Close pooled connections (called on app shutdown)."""
+    global _http_client, _sdk_client, _sdk_client_config
+    if _http_client is not None:
+        await _http_client.aclose()
+    _http_client = None
+    _sdk_client = None
+    _sdk_client_config = None
@@ -1,209 +1,187 @@
-import os
-from typing import List, AsyncGenerator
-
-try:
-    from openai import OpenAI  # new SDK (>=1.0)
-    _OPENAI_NEW = True
-except Exception:  # pragma: no cover
-    OpenAI = None  # type: ignore
-    try:
-        import openai as openai_legacy  # old SDK (<1.0)
-        _OPENAI_NEW = False
-    except Exception:  # pragma: no cover
-        openai_legacy = None  # type: ignore
-        _OPENAI_NEW = False
+import asyncio
+import time
+from typing import List, AsyncGenerator, Optional
 
 from app.models.models import Chunk
-from dotenv import load_dotenv, find_dotenv, dotenv_values
-from pathlib import Path
-import json
-import urllib.request
-import urllib.error
+from app.services.answer_cache import get_answer_cache, answer_cache_key
+from app.services import llm_client
+from app.services.llm_client import LLMError, LLMUnavailable
+from app.services.admission import AdmissionRejected
+from app.services import deadline as deadlines
+from app.services.deadline import Deadline, DeadlineExceeded
+from app.services.context_packer import pack_context, render_span, CONTEXT_TOKEN_BUDGET
+from app.services import metrics
 
 
-def get_client():
-    """Create OpenAI client lazily so fresh env vars are picked up."""
-    # Ensure environment from root .env is loaded even if backend started elsewhere
-    try:
-        load_dotenv(find_dotenv())
-    except Exception:
-        pass
-    # If neither new nor legacy client is available, bail
-    if not (OpenAI or openai_legacy):
-        return None
-    api_key = os.getenv("OPENAI_API_KEY")
-    base_url = os.getenv("OPENAI_BASE_URL")
-    if not api_key:
-        # Fallback: read root .env directly
-        try:
-            # backend/app/services -> parents[3] == project root
-            root_env = Path(__file__).resolve().parents[3] / ".env"
-            if root_env.exists():
-                vals = dotenv_values(str(root_env))
-                api_key = vals.get("OPENAI_API_KEY") or api_key
-        except Exception:
-            pass
-    if not api_key:
-        return None
-    try:
-        if OpenAI:
-            if base_url:
-                return OpenAI(api_key=api_key, base_url=base_url)
-            return OpenAI(api_key=api_key)
-        # Legacy fallback
-        if openai_legacy:
-            openai_legacy.api_key = api_key
-            if base_url:
-                openai_legacy.base_url = base_url
-            return openai_legacy
-        return None
-    except Exception:
-        return None
-
-
-def _build_prompts(query: str, chunks: List[Chunk]):
-    context = "\n\n".join([
-        f"Document: {chunk.document.name}\n"
-        f"Content: {chunk.content}\n"
-        f"Location: {chunk.citation_locator or 'Unknown'}"
-        for chunk in chunks
-    ])
-    system_prompt = (
-        "You are a helpful assistant that answers questions based on the provided document context. "
-        "Always cite your sources by referring to the document name and location when possible. "
-        "If the context doesn't contain enough information to answer the question, say so clearly. "
-        "Keep your answers concise and accurate."
-    )
-    user_message = f"""Context from documents:
+SYSTEM_PROMPT = (
+    "You are a helpful assistant that answers questions based on the provided document context. "
+    "Always cite your sources by referring to the document name and location when possible. "
+    "If the context doesn't contain enough information to answer the question, say so clearly. "
+    "Keep your answers concise and accurate."
+)
+
+USER_PROMPT_TEMPLATE = """Context from documents:
 {context}
 
 Question: {query}
 
 Please answer the question based on the context provided above."""
-    return system_prompt, user_message
 
+# Size of the pieces a cached or non-streamed answer is replayed in
+REPLAY_STEP = 80
 
-def _http_chat_completion(system_prompt: str, user_message: str, stream: bool = False) -> str:
-    """HTTP fallback that calls OpenAI Chat Completions without SDK.
-    Returns the full answer text (non-stream)."""
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        return "LLM unavailable (no OPENAI_API_KEY set)."
-    base = (os.getenv("OPENAI_BASE_URL") or "https://api.openai.com/v1").rstrip("/")
-    url = f"{base}/chat/completions"
-    payload = {
-        "model": os.getenv("OPENAI_MODEL", "gpt-3.5-turbo"),
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_message},
-        ],
-        "max_tokens": 1000,
-        "temperature": 0.7,
-        "stream": False,
-    }
-    data = json.dumps(payload).encode("utf-8")
-    req = urllib.request.Request(url, data=data, method="POST")
-    req.add_header("Authorization", f"Bearer {api_key}")
-    req.add_header("Content-Type", "application/json")
-    try:
-        with urllib.request.urlopen(req, timeout=60) as resp:
-            body = resp.read().decode("utf-8")
-            obj = json.loads(body)
-            choice = obj.get("choices", [{}])[0]
-            message = choice.get("message", {})
-            return message.get("content", "")
-    except urllib.error.HTTPError as e:
+_PROMPT_BUILD = metrics.stage("prompt_build")
+_LLM_COMPLETION = metrics.stage("llm_completion")
+_LLM_FIRST_TOKEN = metrics.stage("llm_first_token")
+_LLM_STREAM = metrics.stage("llm_stream")
+ANSWERS = metrics.Counter("rag_answers", "Answers by source (cache, llm, error)", ("source",))
+_FROM_CACHE = ANSWERS.labels("cache")
+_FROM_LLM = ANSWERS.labels("llm")
+_FAILED = ANSWERS.labels("error")
+
+
+def build_context(chunks: List[Chunk]) -> str:
+    # Stitch neighbouring chunks, drop their overlap and stay within the token budget
+    return "\n\n".join(render_span(span) for span in pack_context(chunks))
+
+
+def _build_prompts(query: str, chunks: List[Chunk], context: Optional[str] = None):
+    with _PROMPT_BUILD.time():
+        if context is None:
+            context = build_context(chunks)
+        user_message = USER_PROMPT_TEMPLATE.format(context=context, query=query)
+    return SYSTEM_PROMPT, user_message
+
+
+def _answer_key(query: str, chunks: List[Chunk]) -> str:
+    _, _, model = llm_client.get_settings()
+    return answer_cache_key(
+        model,
+        f"{SYSTEM_PROMPT}\x00{USER_PROMPT_TEMPLATE}\x00budget={CONTEXT_TOKEN_BUDGET}",
+        query,
+        [(chunk.id, chunk.content) for chunk in chunks],
+    )
+
+
+def _is_cacheable(answer: str) -> bool:
+    return bool(answer) and not answer.startswith(("Error generating answer", "LLM unavailable"))
+
+
+async def generate_answer(
+    query: str,
+    chunks: List[Chunk],
+    deadline: Optional[Deadline] = None,
+    context: Optional[str] = None,
+) -> str:
+    """Generate complete answer (non-streaming), served from the answer cache when possible.
+
+    Raises DeadlineExceeded if ``deadline`` can't fit a generation, or runs
+    out while waiting on one. ``context`` is the packed context for
+    ``chunks`` if the caller already built it (see ``build_context``).
+    """
+    cache = get_answer_cache()
+    key = _answer_key(query, chunks) if cache is not None else None
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            _FROM_CACHE.inc()
+            return cached
+    if deadline is not None and not deadline.allows("llm"):
+        raise DeadlineExceeded("llm")
+    system_prompt, user_message = _build_prompts(query, chunks, context)
+    started = time.perf_counter()
+    if deadline is not None:
         try:
-            err = e.read().decode("utf-8")
-            return f"Error generating answer: {err}"
-        except Exception:
-            return f"Error generating answer: HTTP {e.code}"
-    except Exception as e:
-        return f"Error generating answer: {str(e)}"
+            answer = await asyncio.wait_for(
+                _generate_answer_uncached(system_prompt, user_message), deadline.timeout()
+            )
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded("llm")
+    else:
+        answer = await _generate_answer_uncached(system_prompt, user_message)
+    if _is_cacheable(answer):
+        elapsed = time.perf_counter() - started
+        deadlines.observe("llm", elapsed)
+        _LLM_COMPLETION.observe(elapsed)
+        _FROM_LLM.inc()
+    else:
+        _FAILED.inc()
+    if cache is not None and _is_cacheable(answer):
+        cache.put(key, answer)
+    return answer
 
 
-async def generate_answer(query: str, chunks: List[Chunk]) -> str:
-    """Generate complete answer (non-streaming)."""
-    system_prompt, user_message = _build_prompts(query, chunks)
-    client = get_client()
-    if not client:
-        # HTTP fallback
-        return _http_chat_completion(system_prompt, user_message, stream=False)
+async def _generate_answer_uncached(system_prompt: str, user_message: str) -> str:
     try:
-        model = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
-        if hasattr(client, "chat"):
-            response = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-                max_tokens=1000,
-                temperature=0.7
-            )
-            return response.choices[0].message.content or ""
-        else:
-            # legacy client
-            response = client.ChatCompletion.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-                max_tokens=1000,
-                temperature=0.7
-            )
-            return response["choices"][0]["message"]["content"]
+        return await llm_client.chat_completion(system_prompt, user_message)
+    except AdmissionRejected:
+        # Overload is the caller's to report (429/503), not an answer
+        raise
     except Exception as e:
-        return f"Error generating answer: {str(e)}"
+        return _error_message(e)
 
 
-async def generate_answer_stream(query: str, chunks: List[Chunk]) -> AsyncGenerator[str, None]:
-    """Stream answer tokens as they arrive from the LLM."""
-    system_prompt, user_message = _build_prompts(query, chunks)
-    client = get_client()
-    if not client:
-        # HTTP fallback (non-stream) then yield in chunks
-        text = _http_chat_completion(system_prompt, user_message, stream=False)
-        if not text:
+def _error_message(e: Exception) -> str:
+    if isinstance(e, LLMUnavailable):
+        return "LLM unavailable (no OPENAI_API_KEY set)."
+    if isinstance(e, LLMError):
+        return f"Error generating answer: {e.body or f'HTTP {e.status_code}'}"
+    return f"Error generating answer: {str(e)}"
+
+
+async def generate_answer_stream(
+    query: str,
+    chunks: List[Chunk],
+    deadline: Optional[Deadline] = None,
+) -> AsyncGenerator[str, None]:
+    """Stream answer tokens as they arrive from the LLM; cache hits are replayed immediately.
+
+    With a ``deadline`` the first token must arrive within it, otherwise
+    DeadlineExceeded is raised before anything is yielded. Once tokens are
+    flowing the stream runs to completion.
+    """
+    cache = get_answer_cache()
+    key = _answer_key(query, chunks) if cache is not None else None
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            _FROM_CACHE.inc()
+            for i in range(0, len(cached), REPLAY_STEP):
+                yield cached[i:i + REPLAY_STEP]
             return
-        # yield in small pieces to mimic streaming
-        step = 80
-        for i in range(0, len(text), step):
-            yield text[i:i+step]
-        return
+    if deadline is not None and not deadline.allows("llm_first_token"):
+        raise DeadlineExceeded("llm")
+    system_prompt, user_message = _build_prompts(query, chunks)
+    parts: List[str] = []
+    stream = llm_client.chat_completion_stream(system_prompt, user_message)
     try:
-        model = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
-        if hasattr(client, "chat"):
-            stream = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-                max_tokens=1000,
-                temperature=0.7,
-                stream=True
-            )
-            for event in stream:
-                delta = getattr(event.choices[0].delta, "content", None)
-                if delta:
-                    yield delta
-        else:
-            # legacy streaming
-            stream = client.ChatCompletion.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-                max_tokens=1000,
-                temperature=0.7,
-                stream=True
-            )
-            for chunk in stream:
-                delta = chunk["choices"][0]["delta"].get("content") if "choices" in chunk else None
-                if delta:
-                    yield delta
+        started = time.perf_counter()
+        try:
+            first = stream.__anext__()
+            delta = await (asyncio.wait_for(first, deadline.timeout()) if deadline is not None else first)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded("llm")
+        except StopAsyncIteration:
+            return
+        first_token = time.perf_counter() - started
+        deadlines.observe("llm_first_token", first_token)
+        _LLM_FIRST_TOKEN.observe(first_token)
+        parts.append(delta)
+        yield delta
+        async for delta in stream:
+            parts.append(delta)
+            yield delta
+    except (AdmissionRejected, DeadlineExceeded):
+        raise
     except Exception as e:
-        yield f"Error generating answer: {str(e)}"
+        # Partial output plus an error is never cached
+        _FAILED.inc()
+        yield _error_message(e)
+        return
+    finally:
+        await stream.aclose()
+    _LLM_STREAM.observe(time.perf_counter() - started)
+    _FROM_LLM.inc()
+    answer = "".join(parts)
+    if cache is not None and _is_cacheable(answer):
+        cache.put(key, answer)
@@ -0,0 +1,274 @@
+import abc
+import bisect
+import math
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Off: every observe/inc/set returns immediately and /metrics is empty
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; from sub-millisecond index lookups up to slow LLM calls and ingests
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0,
+)
+
+_registry: List["_Metric"] = []
+_registry_lock = threading.Lock()
+
+
+class _Timer:
+    __slots__ = ("_child", "_started")
+
+    def __init__(self, child):
+        self._child = child
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._child.observe(time.perf_counter() - self._started)
+        return False
+
+
+class _Metric(abc.ABC):
+    """A named metric with zero or more label dimensions.
+
+    ``labels(*values)`` returns the child for one label combination; hot
+    paths should bind it once at import and reuse it. Unlabelled metrics
+    forward ``inc``/``set``/``observe`` to their single child.
+    """
+
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], object] = {}
+        with _registry_lock:
+            _registry.append(self)
+
+    @abc.abstractmethod
+    def _new_child(self):
+        """A fresh child holding the values for one label combination."""
+
+    def labels(self, *values):
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _items(self):
+        with self._lock:
+            return list(self._children.items())
+
+    @abc.abstractmethod
+    def samples(self) -> List[Tuple[str, Tuple[Tuple[str, str], ...], float]]:
+        """(sample name, labels, value) triples for the exposition format."""
+
+
+class _CounterChild:
+    __slots__ = ("_lock", "value")
+
+    def __init__(self, lock):
+        self._lock = lock
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild(self._lock)
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def samples(self):
+        return [
+            (self.name + "_total", tuple(zip(self.labelnames, values)), child.value)
+            for values, child in self._items()
+        ]
+
+
+class _GaugeChild:
+    __slots__ = ("_lock", "value")
+
+    def __init__(self, lock):
+        self._lock = lock
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        if METRICS_ENABLED:
+            self.value = value
+
+    def inc(self, amount: float = 1.0) -> None:
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.inc(-amount)
+
+
+class Gauge(_Metric):
+    """A value that goes up and down.
+
+    With ``fn`` the gauge is read at scrape time instead of being set, so
+    things like index sizes cost nothing on the paths that change them.
+    ``fn`` returns a number, or for labelled gauges a dict of label-value
+    tuples to numbers.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), fn: Optional[Callable] = None):
+        super().__init__(name, help, labelnames)
+        self._fn = fn
+
+    def _new_child(self):
+        return _GaugeChild(self._lock)
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.labels().dec(amount)
+
+    def samples(self):
+        if self._fn is None:
+            return [(self.name, tuple(zip(self.labelnames, values)), child.value) for values, child in self._items()]
+        try:
+            value = self._fn()
+        except Exception:
+            return []
+        if isinstance(value, dict):
+            return [
+                (self.name, tuple(zip(self.labelnames, (str(v) for v in values))), float(v))
+                for values, v in value.items()
+            ]
+        return [(self.name, (), float(value))]
+
+
+class _HistogramChild:
+    __slots__ = ("_lock", "_buckets", "counts", "sum", "count")
+
+    def __init__(self, lock, buckets):
+        self._lock = lock
+        self._buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        if not METRICS_ENABLED:
+            return
+        i = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self) -> _Timer:
+        """Context manager observing the seconds spent inside it."""
+        return _Timer(self)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self._lock, self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def time(self) -> _Timer:
+        return self.labels().time()
+
+    def samples(self):
+        out = []
+        for values, child in self._items():
+            labels = tuple(zip(self.labelnames, values))
+            with self._lock:
+                counts, total, count = list(child.counts), child.sum, child.count
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), counts):
+                cumulative += n
+                out.append((self.name + "_bucket", labels + (("le", _format_value(bound)),), cumulative))
+            out.append((self.name + "_sum", labels, total))
+            out.append((self.name + "_count", labels, count))
+        return out
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render() -> str:
+    """Every registered metric in the Prometheus text exposition format."""
+    if not METRICS_ENABLED:
+        return ""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        # Text format 0.0.4 names a counter family by its _total sample
+        family = metric.name + "_total" if metric.kind == "counter" else metric.name
+        lines.append(f"# HELP {family} {_escape(metric.help)}")
+        lines.append(f"# TYPE {family} {metric.kind}")
+        for name, labels, value in metric.samples():
+            if labels:
+                rendered = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+                lines.append(f"{name}{{{rendered}}} {_format_value(value)}")
+            else:
+                lines.append(f"{name} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# Shared by every service: one histogram, one label per pipeline stage
+STAGE_SECONDS = Histogram(
+    "rag_stage_duration_seconds",
+    "Time spent in each retrieval, generation and ingest stage",
+    ("stage",),
+)
+
+
+def stage(name: str) -> _HistogramChild:
+    """Bound child of the stage histogram; ``with stage("x").time(): ...``."""
+    return STAGE_SECONDS.labels(name)
@@ -0,0 +1,82 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, Optional, Tuple
+
+from sqlalchemy import String, and_, func, or_, select, text, type_coerce
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import IS_POSTGRES, IS_SQLITE
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def sort_key(column):
+    """Expression to order, compare and read a timestamp keyset column by.
+
+    SQLite stores timestamps as text, and rows written by server defaults
+    lack the microseconds SQLAlchemy adds when binding a datetime, so values
+    are compared as the raw stored strings there. The column itself is left
+    untouched, so its index still applies.
+    """
+    return type_coerce(column, String) if IS_SQLITE else column
+
+
+def encode_cursor(sort_value: Any, row_id: Any) -> str:
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+    raw = json.dumps([sort_value, row_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, Any]:
+    """(sort value, id) from a cursor; raises ValueError if it's malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sort_value, row_id = json.loads(raw)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not IS_SQLITE and sort_value is not None:
+        sort_value = datetime.fromisoformat(sort_value)
+    return sort_value, row_id
+
+
+def after(sort_expr, id_column, cursor: Tuple[Any, Any], descending: bool):
+    """WHERE clause selecting rows strictly past ``cursor`` in (sort, id) order."""
+    sort_value, row_id = cursor
+    if descending:
+        return or_(sort_expr < sort_value, and_(sort_expr == sort_value, id_column < row_id))
+    return or_(sort_expr > sort_value, and_(sort_expr == sort_value, id_column > row_id))
+
+
+def clamp_limit(limit: Optional[int]) -> int:
+    return max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+
+
+async def estimate_count(db: AsyncSession, stmt, table_name: str, filtered: bool) -> Tuple[int, bool]:
+    """(count, exact) for ``stmt`` (a SELECT of the rows to count).
+
+    On Postgres this reads the planner's estimate, from pg_class for the
+    whole table or from EXPLAIN when filters apply, instead of scanning.
+    SQLite has no estimates, so it counts exactly over the covering index.
+    """
+    if IS_POSTGRES:
+        if not filtered:
+            result = await db.execute(
+                text("SELECT reltuples::bigint FROM pg_class WHERE relname = :name"),
+                {"name": table_name},
+            )
+            estimate = result.scalar()
+            if estimate is not None and estimate >= 0:
+                return int(estimate), False
+        else:
+            compiled = stmt.compile(dialect=db.bind.dialect, compile_kwargs={"literal_binds": True})
+            result = await db.execute(text(f"EXPLAIN (FORMAT JSON) {compiled}"))
+            plan = result.scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return int(plan[0]["Plan"]["Plan Rows"]), False
+    result = await db.execute(select(func.count()).select_from(stmt.subquery()))
+    return int(result.scalar() or 0), True
+
@@ -0,0 +1,243 @@
+import heapq
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Dict, List, Optional
+
+# Opt-in: nothing is sampled unless this is on (also switchable at runtime)
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() in ("1", "true", "yes")
+# Fraction of requests profiled without being asked to
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# Requests carrying this header are always profiled; when PROFILING_TOKEN is
+# set the header value has to match it
+PROFILE_HEADER = os.getenv("PROFILE_HEADER", "X-Profile")
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+# Slowest traces kept for the admin endpoints
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "20"))
+PROFILE_MAX_DEPTH = int(os.getenv("PROFILE_MAX_DEPTH", "128"))
+PROFILE_MAX_SAMPLES = int(os.getenv("PROFILE_MAX_SAMPLES", "20000"))
+
+# A thread whose innermost frame is in one of these is parked, not working
+_IDLE_FILES = ("threading.py", "selectors.py", "queue.py")
+# Reading profiles or metrics shouldn't push real requests out of the buffer
+_UNPROFILED_PATHS = ("/admin/profil", "/metrics")
+
+
+class Trace:
+    """Collapsed stack samples taken while one request was in flight."""
+
+    def __init__(self, method: str, path: str, trigger: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.trigger = trigger
+        self.status: Optional[int] = None
+        self.started_at = time.time()
+        self.duration_ms = 0.0
+        self.samples = 0
+        # Other profiled requests in flight at the same time; their samples mix
+        self.overlapping = 0
+        self.stacks: Counter = Counter()
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "trigger": self.trigger,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration_ms, 3),
+            "samples": self.samples,
+            "overlapping": self.overlapping,
+        }
+
+    def collapsed(self) -> str:
+        return collapsed(self.stacks)
+
+
+def collapsed(stacks: Counter) -> str:
+    """``frame;frame;... count`` lines, as flamegraph.pl / speedscope read them."""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class StackSampler:
+    """Wall-clock stack sampler that runs only while a traced request is active.
+
+    Every ``interval`` it snapshots all thread stacks via
+    ``sys._current_frames()``, drops parked threads, and adds the rest to
+    every active trace. The event loop and the threadpool are shared, so
+    samples can't be pinned to one request; a trace records how many other
+    traced requests overlapped it.
+    """
+
+    def __init__(self, interval_ms: float = PROFILE_INTERVAL_MS, keep: int = PROFILE_KEEP):
+        self.interval = max(0.001, interval_ms / 1000.0)
+        self.keep = keep
+        self._cond = threading.Condition()
+        self._active: Dict[str, Trace] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._slowest: List[tuple] = []  # min-heap of (duration, seq, trace)
+        self._seq = itertools.count()
+
+    def start(self, trace: Trace) -> None:
+        with self._cond:
+            for other in self._active.values():
+                other.overlapping += 1
+                trace.overlapping += 1
+            self._active[trace.id] = trace
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def finish(self, trace: Trace) -> None:
+        with self._cond:
+            self._active.pop(trace.id, None)
+            entry = (trace.duration_ms, next(self._seq), trace)
+            if len(self._slowest) < self.keep:
+                heapq.heappush(self._slowest, entry)
+            elif self._slowest and trace.duration_ms > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, entry)
+
+    def traces(self) -> List[Trace]:
+        """Kept traces, slowest first."""
+        with self._cond:
+            return [trace for _, _, trace in sorted(self._slowest, reverse=True)]
+
+    def get(self, trace_id: str) -> Optional[Trace]:
+        with self._cond:
+            for _, _, trace in self._slowest:
+                if trace.id == trace_id:
+                    return trace
+        return None
+
+    def clear(self) -> None:
+        with self._cond:
+            self._slowest = []
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while True:
+            with self._cond:
+                while not self._active:
+                    self._cond.wait()
+                active = list(self._active.values())
+            names = {t.ident: t.name for t in threading.enumerate()}
+            stacks = []
+            for ident, frame in sys._current_frames().items():
+                if ident == me or os.path.basename(frame.f_code.co_filename) in _IDLE_FILES:
+                    continue
+                labels = []
+                while frame is not None and len(labels) < PROFILE_MAX_DEPTH:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append(names.get(ident, str(ident)))
+                stacks.append(";".join(reversed(labels)))
+            with self._cond:
+                for trace in active:
+                    if trace.samples >= PROFILE_MAX_SAMPLES:
+                        continue
+                    trace.samples += 1
+                    trace.stacks.update(stacks)
+            time.sleep(self.interval)
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that samples stacks for chosen requests.
+
+    A request is traced when profiling is enabled and it either carries the
+    profile header or falls in the random sample. Timing covers the whole
+    response, streamed bodies included; header-triggered responses get an
+    ``X-Profile-Id`` header naming their trace.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        settings = get_profiling_settings()
+        if (
+            scope["type"] != "http"
+            or not settings["enabled"]
+            or scope.get("path", "").startswith(_UNPROFILED_PATHS)
+        ):
+            await self.app(scope, receive, send)
+            return
+        trigger = _trigger(scope, settings)
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+
+        sampler = get_sampler()
+        trace = Trace(scope.get("method", ""), scope.get("path", ""), trigger)
+
+        async def send_traced(message):
+            if message["type"] == "http.response.start":
+                trace.status = message.get("status")
+                if trigger == "header":
+                    headers = list(message.get("headers", []))
+                    headers.append((b"x-profile-id", trace.id.encode("ascii")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        started = time.perf_counter()
+        sampler.start(trace)
+        try:
+            await self.app(scope, receive, send_traced)
+        finally:
+            trace.duration_ms = (time.perf_counter() - started) * 1000.0
+            sampler.finish(trace)
+
+
+def _trigger(scope, settings: dict) -> Optional[str]:
+    wanted = PROFILE_HEADER.lower().encode("latin-1")
+    for name, value in scope.get("headers", []):
+        if name == wanted:
+            if PROFILING_TOKEN is None or value.decode("latin-1") == PROFILING_TOKEN:
+                return "header"
+            break
+    if settings["sample_rate"] > 0 and random.random() < settings["sample_rate"]:
+        return "sampled"
+    return None
+
+
+_settings = {"enabled": PROFILING_ENABLED, "sample_rate": PROFILE_SAMPLE_RATE}
+_sampler: Optional[StackSampler] = None
+_sampler_lock = threading.Lock()
+
+
+def get_profiling_settings() -> dict:
+    return _settings
+
+
+def configure_profiling(enabled: Optional[bool] = None, sample_rate: Optional[float] = None) -> dict:
+    """Change profiling at runtime; returns the settings now in effect."""
+    global _settings
+    updated = dict(_settings)
+    if enabled is not None:
+        updated["enabled"] = bool(enabled)
+    if sample_rate is not None:
+        updated["sample_rate"] = min(1.0, max(0.0, float(sample_rate)))
+    _settings = updated
+    return updated
+
+
+def get_sampler() -> StackSampler:
+    global _sampler
+    if _sampler is None:
+        with _sampler_lock:
+            if _sampler is None:
+                _sampler = StackSampler()
+    return _sampler
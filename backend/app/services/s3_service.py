@@ -1,24 +1,96 @@
 import boto3
+import io
 import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from boto3.s3.transfer import TransferConfig
 from botocore.config import Config
 
+# Connections kept open per client; bulk helpers and multipart transfers
+# share them, so keep this at or above the concurrency settings below
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "50"))
+S3_MAX_ATTEMPTS = int(os.getenv("S3_MAX_ATTEMPTS", "5"))
+S3_CONNECT_TIMEOUT = float(os.getenv("S3_CONNECT_TIMEOUT", "5"))
+S3_READ_TIMEOUT = float(os.getenv("S3_READ_TIMEOUT", "60"))
 
-def get_s3_client():
-    """Get S3 client configured for MinIO or AWS S3"""
-    
+# Objects above the threshold go up/down as parallel multipart transfers
+S3_MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD_MB", "64")) * 1024 * 1024
+S3_MULTIPART_CHUNKSIZE = int(os.getenv("S3_MULTIPART_CHUNKSIZE_MB", "16")) * 1024 * 1024
+S3_TRANSFER_CONCURRENCY = int(os.getenv("S3_TRANSFER_CONCURRENCY", "10"))
+# Files moved at once by the bulk helpers
+S3_BULK_CONCURRENCY = int(os.getenv("S3_BULK_CONCURRENCY", "16"))
+
+# Streaming reads: ranged GETs of this size, prefetched this many blocks ahead
+S3_READ_BLOCK_SIZE = int(os.getenv("S3_READ_BLOCK_MB", "4")) * 1024 * 1024
+S3_READ_AHEAD_BLOCKS = int(os.getenv("S3_READ_AHEAD_BLOCKS", "2"))
+S3_READ_CACHE_BLOCKS = int(os.getenv("S3_READ_CACHE_BLOCKS", "8"))
+S3_READ_AHEAD_WORKERS = int(os.getenv("S3_READ_AHEAD_WORKERS", "8"))
+
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=S3_MULTIPART_THRESHOLD,
+    multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+    max_concurrency=S3_TRANSFER_CONCURRENCY,
+    use_threads=True,
+)
+
+_client = None
+_client_lock = threading.Lock()
+_read_ahead_pool = None
+
+
+def _client_config() -> Config:
+    return Config(
+        signature_version='s3v4',
+        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+        connect_timeout=S3_CONNECT_TIMEOUT,
+        read_timeout=S3_READ_TIMEOUT,
+        retries={"max_attempts": S3_MAX_ATTEMPTS, "mode": "standard"},
+        tcp_keepalive=True,
+    )
+
+
+def _create_client():
+    # Own session: the default one isn't safe to build clients from concurrently
+    session = boto3.session.Session()
     # Check if we're using MinIO (local development)
     if os.getenv("S3_ENDPOINT_URL"):
-        return boto3.client(
+        return session.client(
             's3',
             endpoint_url=os.getenv("S3_ENDPOINT_URL", "http://localhost:9000"),
             aws_access_key_id=os.getenv("S3_ACCESS_KEY", "minio"),
             aws_secret_access_key=os.getenv("S3_SECRET_KEY", "minio123"),
-            config=Config(signature_version='s3v4'),
+            config=_client_config(),
             region_name='us-east-1'
         )
     else:
         # Use AWS S3
-        return boto3.client('s3')
+        return session.client('s3', config=_client_config())
+
+
+def get_s3_client():
+    """Shared S3 client configured for MinIO or AWS S3.
+
+    Built once per process; boto3 clients are thread-safe, so every caller
+    reuses its credentials, endpoint setup and connection pool.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _create_client()
+    return _client
+
+
+def reset_s3_client() -> None:
+    """Drop the shared client, e.g. after the S3 settings changed."""
+    global _client
+    with _client_lock:
+        _client = None
+
+
+def _bucket(bucket_name: str = None) -> str:
+    return bucket_name or os.getenv("S3_BUCKET", "rag-bucket")
 
 
 def create_bucket_if_not_exists(bucket_name: str):
@@ -52,28 +124,226 @@ def create_bucket_if_not_exists(bucket_name: str):
 
 
 def upload_file(file_path: str, s3_key: str, bucket_name: str = None):
-    """Upload file to S3/MinIO"""
-    if bucket_name is None:
-        bucket_name = os.getenv("S3_BUCKET", "rag-bucket")
-    
-    s3_client = get_s3_client()
-    s3_client.upload_file(file_path, bucket_name, s3_key)
+    """Upload file to S3/MinIO (multipart above the threshold)"""
+    get_s3_client().upload_file(file_path, _bucket(bucket_name), s3_key, Config=TRANSFER_CONFIG)
 
 
 def download_file(s3_key: str, local_path: str, bucket_name: str = None):
-    """Download file from S3/MinIO"""
-    if bucket_name is None:
-        bucket_name = os.getenv("S3_BUCKET", "rag-bucket")
-    
-    s3_client = get_s3_client()
-    s3_client.download_file(bucket_name, s3_key, local_path)
+    """Download file from S3/MinIO (ranged parts in parallel above the threshold)"""
+    get_s3_client().download_file(_bucket(bucket_name), s3_key, local_path, Config=TRANSFER_CONFIG)
 
 
 def delete_file(s3_key: str, bucket_name: str = None):
     """Delete file from S3/MinIO"""
-    if bucket_name is None:
-        bucket_name = os.getenv("S3_BUCKET", "rag-bucket")
-    
+    get_s3_client().delete_object(Bucket=_bucket(bucket_name), Key=s3_key)
+
+
+def upload_files(items, bucket_name: str = None, max_workers: int = S3_BULK_CONCURRENCY) -> list:
+    """Upload many (file_path, s3_key) pairs concurrently over the shared client.
+
+    Returns the keys that failed to upload.
+    """
+    bucket_name = _bucket(bucket_name)
+    items = list(items)
+    failed = []
+    if not items:
+        return failed
+    client = get_s3_client()
+    # Small files go one per worker; big ones still split into parallel parts
+    # (TransferConfig), so keep workers * concurrency within the pool size
+    config = TransferConfig(
+        multipart_threshold=S3_MULTIPART_THRESHOLD,
+        multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+        max_concurrency=max(1, S3_MAX_POOL_CONNECTIONS // max(1, max_workers)),
+        use_threads=True,
+    )
+
+    def _upload(item):
+        file_path, s3_key = item
+        try:
+            client.upload_file(file_path, bucket_name, s3_key, Config=config)
+            return None
+        except Exception as e:
+            print(f"Error uploading {file_path} to S3: {e}")
+            return s3_key
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items)))) as pool:
+        failed.extend(key for key in pool.map(_upload, items) if key is not None)
+    return failed
+
+
+# S3 DeleteObjects accepts at most this many keys per request
+DELETE_BATCH_SIZE = 1000
+
+
+def delete_files(s3_keys, bucket_name: str = None, max_workers: int = 4) -> list:
+    """Delete many objects with DeleteObjects, 1000 keys per request,
+    several requests at a time.
+
+    Returns the keys that could not be deleted.
+    """
+    bucket_name = _bucket(bucket_name)
+    keys = list(dict.fromkeys(k for k in s3_keys if k))
+    failed = []
+    if not keys:
+        return failed
     s3_client = get_s3_client()
-    s3_client.delete_object(Bucket=bucket_name, Key=s3_key)
 
+    def _delete(group):
+        try:
+            response = s3_client.delete_objects(
+                Bucket=bucket_name,
+                Delete={"Objects": [{"Key": k} for k in group], "Quiet": True},
+            )
+        except Exception as e:
+            print(f"Error deleting files from S3: {e}")
+            return group
+        return [err.get("Key") for err in response.get("Errors", [])]
+
+    groups = [keys[start:start + DELETE_BATCH_SIZE] for start in range(0, len(keys), DELETE_BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(groups)))) as pool:
+        for group_failed in pool.map(_delete, groups):
+            failed.extend(group_failed)
+    return failed
+
+
+def _read_ahead_executor() -> ThreadPoolExecutor:
+    global _read_ahead_pool
+    if _read_ahead_pool is None:
+        with _client_lock:
+            if _read_ahead_pool is None:
+                _read_ahead_pool = ThreadPoolExecutor(
+                    max_workers=S3_READ_AHEAD_WORKERS, thread_name_prefix="s3-read-ahead"
+                )
+    return _read_ahead_pool
+
+
+class S3RangeReader(io.RawIOBase):
+    """Seekable, read-only file object over an S3 object, backed by ranged GETs.
+
+    The object is fetched in fixed-size blocks on demand, so a reader only
+    pays for the parts it touches and never needs a local copy. While reads
+    move forward, the next few blocks are fetched in the background so
+    network time overlaps with whatever consumes the data. A small LRU of
+    blocks serves back-and-forth access such as a PDF's trailer and xref.
+    """
+
+    def __init__(
+        self,
+        s3_key: str,
+        bucket_name: str = None,
+        block_size: int = S3_READ_BLOCK_SIZE,
+        read_ahead: int = S3_READ_AHEAD_BLOCKS,
+        cache_blocks: int = S3_READ_CACHE_BLOCKS,
+    ):
+        super().__init__()
+        self.key = s3_key
+        self.bucket = _bucket(bucket_name)
+        self._client = get_s3_client()
+        head = self._client.head_object(Bucket=self.bucket, Key=s3_key)
+        self.size = int(head["ContentLength"])
+        # Pin the version we started on, so a concurrent overwrite can't mix bytes
+        self._etag = head.get("ETag")
+        self._block_size = max(1, block_size)
+        self._read_ahead = max(0, read_ahead)
+        self._cache_blocks = max(1, cache_blocks) + self._read_ahead
+        self._blocks = OrderedDict()  # block index -> Future[bytes]
+        self._last_block = -1
+        self._pos = 0
+
+    def _fetch(self, index: int) -> bytes:
+        start = index * self._block_size
+        end = min(start + self._block_size, self.size) - 1
+        kwargs = {"Bucket": self.bucket, "Key": self.key, "Range": f"bytes={start}-{end}"}
+        if self._etag:
+            kwargs["IfMatch"] = self._etag
+        response = self._client.get_object(**kwargs)
+        with response["Body"] as body:
+            return body.read()
+
+    def _schedule(self, index: int):
+        future = self._blocks.get(index)
+        if future is None:
+            future = _read_ahead_executor().submit(self._fetch, index)
+            self._blocks[index] = future
+        self._blocks.move_to_end(index)
+        while len(self._blocks) > self._cache_blocks:
+            _, evicted = self._blocks.popitem(last=False)
+            evicted.cancel()
+        return future
+
+    def _block(self, index: int) -> bytes:
+        future = self._schedule(index)
+        if index == self._last_block + 1 or self._last_block < 0:
+            last = (self.size - 1) // self._block_size
+            for ahead in range(index + 1, min(index + self._read_ahead, last) + 1):
+                self._schedule(ahead)
+            # The block being read must stay the most recently used
+            self._blocks.move_to_end(index)
+        self._last_block = index
+        return future.result()
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if pos < 0:
+            raise ValueError("Negative seek position")
+        self._pos = pos
+        return pos
+
+    def readinto(self, buffer) -> int:
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        view = memoryview(buffer).cast("B")
+        wanted = min(len(view), max(0, self.size - self._pos))
+        done = 0
+        while done < wanted:
+            index, offset = divmod(self._pos, self._block_size)
+            data = self._block(index)
+            n = min(len(data) - offset, wanted - done)
+            if n <= 0:
+                break
+            view[done:done + n] = data[offset:offset + n]
+            done += n
+            self._pos += n
+        return done
+
+    def readall(self) -> bytes:
+        remaining = max(0, self.size - self._pos)
+        buffer = bytearray(remaining)
+        n = self.readinto(buffer)
+        return bytes(buffer[:n])
+
+    def close(self) -> None:
+        if not self.closed:
+            for future in self._blocks.values():
+                future.cancel()
+            self._blocks.clear()
+        super().close()
+
+
+def open_object(s3_key: str, bucket_name: str = None, buffered: bool = True):
+    """Open an S3 object for streaming reads without downloading it.
+
+    Raises botocore's ClientError if the object doesn't exist.
+    """
+    reader = S3RangeReader(s3_key, bucket_name)
+    if not buffered:
+        return reader
+    # Small reads (e.g. line iteration) hit the buffer, not the block lookup
+    return io.BufferedReader(reader, buffer_size=64 * 1024)
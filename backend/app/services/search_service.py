@@ -1,12 +1,59 @@
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
-from typing import List, Optional, Dict
+from starlette.concurrency import run_in_threadpool
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Dict, Tuple
 import json
+import os
+import time
 import numpy as np
 from app.models.models import Chunk, Document
-from app.services.embedding_service import get_embedding
+from app.services.embedding_service import get_query_embedding, get_query_embeddings
+from app.services import deadline as deadlines
+from app.services.deadline import Deadline
 from app.database import IS_POSTGRES
-from app.services.vector_store import search as vs_search, load_or_build_index
+from app.services.vector_store import search_with_scores as vs_search, load_or_build_index
+from app.services.vector_store import search_many_with_scores as vs_search_many
+from app.services.vector_store import generation as vector_generation
+from app.services.keyword_index import search_keywords, load_or_build_keyword_index
+from app.services.keyword_index import generation as keyword_generation
+from app.services.semantic_cache import SemanticCache
+from app.services.hydration import Hydrator, HydratedChunk
+from app.services import metrics
+
+RETRIEVAL_MODES = ("vector", "keyword", "hybrid")
+DEFAULT_RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector").lower()
+
+# Hybrid retrieval: candidates pulled from each path before fusion
+HYBRID_VECTOR_DEPTH = int(os.getenv("HYBRID_VECTOR_DEPTH", "50"))
+HYBRID_KEYWORD_DEPTH = int(os.getenv("HYBRID_KEYWORD_DEPTH", "50"))
+HYBRID_VECTOR_WEIGHT = float(os.getenv("HYBRID_VECTOR_WEIGHT", "1.0"))
+HYBRID_KEYWORD_WEIGHT = float(os.getenv("HYBRID_KEYWORD_WEIGHT", "1.0"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+# Result cache: near-duplicate queries in the same scope reuse ranked chunk ids
+_result_cache = SemanticCache(
+    max_entries=int(os.getenv("SEARCH_CACHE_SIZE", "2048")),
+    ttl_seconds=float(os.getenv("SEARCH_CACHE_TTL", "600")),
+    threshold=float(os.getenv("SEARCH_CACHE_THRESHOLD", "0.95")),
+)
+
+_SEARCH = metrics.stage("search")
+_SEARCH_BATCH = metrics.stage("search_batch")
+_HYDRATE = metrics.stage("hydrate")
+_VECTOR = metrics.stage("vector_search")
+_KEYWORD = metrics.stage("keyword_search")
+_FUSE = metrics.stage("fusion")
+RESULT_CACHE_LOOKUPS = metrics.Counter(
+    "rag_search_cache_lookups", "Result cache lookups by outcome (exact, semantic, miss)", ("result",)
+)
+
+# Runs the keyword path alongside embedding + vector search
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("SEARCH_THREADS", "4")),
+    thread_name_prefix="search",
+)
 
 
 def search_relevant_chunks(
@@ -15,48 +62,390 @@ def search_relevant_chunks(
     db: Session,
     document_ids: Optional[List[str]] = None,
     batch_id: Optional[str] = None,
-) -> List[Chunk]:
-    """Search for relevant chunks using vector similarity"""
+    mode: Optional[str] = None,
+    vector_depth: Optional[int] = None,
+    keyword_depth: Optional[int] = None,
+    timings: Optional[Dict[str, float]] = None,
+    deadline: Optional[Deadline] = None,
+    hydrator: Optional[Hydrator] = None,
+) -> List[HydratedChunk]:
+    """Search for relevant chunks using vector, keyword or hybrid retrieval.
+
+    If ``timings`` is given it is filled with per-stage durations in milliseconds.
+    With a ``deadline``, stages that would overrun it are skipped: a query
+    that can't be embedded in time (and isn't cached) or whose vector search
+    wouldn't fit is answered from the keyword index alone.
+    """
+    started = time.perf_counter()
+    ranked = retrieve_chunk_ids(
+        query,
+        top_k,
+        db,
+        document_ids=document_ids,
+        batch_id=batch_id,
+        mode=mode,
+        vector_depth=vector_depth,
+        keyword_depth=keyword_depth,
+        timings=timings,
+        deadline=deadline,
+    )
+    t = time.perf_counter()
+    chunks = (hydrator or Hydrator()).load([cid for cid, _ in ranked], db)
+    hydrate_ms, total_ms = _ms(t, _HYDRATE), _ms(started, _SEARCH)
+    if timings is not None:
+        timings["hydrate_ms"] = hydrate_ms
+        timings["total_ms"] = total_ms
+    return chunks
+
+
+async def search_relevant_chunks_async(
+    query: str,
+    top_k: int,
+    db: Session,
+    adb: AsyncSession,
+    document_ids: Optional[List[str]] = None,
+    batch_id: Optional[str] = None,
+    mode: Optional[str] = None,
+    vector_depth: Optional[int] = None,
+    keyword_depth: Optional[int] = None,
+    timings: Optional[Dict[str, float]] = None,
+    deadline: Optional[Deadline] = None,
+    hydrator: Optional[Hydrator] = None,
+) -> List[HydratedChunk]:
+    """``search_relevant_chunks`` for async callers.
+
+    Retrieval (embedding, index search, scope lookup on ``db``) runs in a
+    worker thread and hydration goes through the async session, so neither
+    blocks the event loop.
+    """
+    started = time.perf_counter()
+    ranked = await run_in_threadpool(
+        retrieve_chunk_ids,
+        query,
+        top_k,
+        db,
+        document_ids=document_ids,
+        batch_id=batch_id,
+        mode=mode,
+        vector_depth=vector_depth,
+        keyword_depth=keyword_depth,
+        timings=timings,
+        deadline=deadline,
+    )
+    t = time.perf_counter()
+    chunks = await (hydrator or Hydrator()).load_async([cid for cid, _ in ranked], adb)
+    hydrate_ms, total_ms = _ms(t, _HYDRATE), _ms(started, _SEARCH)
+    if timings is not None:
+        timings["hydrate_ms"] = hydrate_ms
+        timings["total_ms"] = total_ms
+    return chunks
+
+
+def retrieve_chunk_ids(
+    query: str,
+    top_k: int,
+    db: Session,
+    document_ids: Optional[List[str]] = None,
+    batch_id: Optional[str] = None,
+    mode: Optional[str] = None,
+    vector_depth: Optional[int] = None,
+    keyword_depth: Optional[int] = None,
+    timings: Optional[Dict[str, float]] = None,
+    deadline: Optional[Deadline] = None,
+) -> List[Tuple[int, float]]:
+    """Ranked (chunk_id, score) pairs without loading chunk rows."""
+    mode = (mode or DEFAULT_RETRIEVAL_MODE).lower()
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode '{mode}', expected one of {RETRIEVAL_MODES}")
+    if timings is None:
+        timings = {}
+
+    scope = _scope_key(mode, document_ids, batch_id, top_k, vector_depth, keyword_depth)
+    generation = index_generation()
+
+    def embed() -> Optional[List[float]]:
+        t = time.perf_counter()
+        embedding, timings["embedding"] = get_query_embedding(query, deadline)
+        timings["embed_ms"] = _ms(t)
+        return embedding
+
+    # Keyword results depend on wording, so only exact repeats may reuse them
+    t = time.perf_counter()
+    cached, query_embedding, how = _result_cache.lookup(
+        scope, query, generation, embed=None if mode == "keyword" else embed,
+    )
+    timings["cache"] = how
+    RESULT_CACHE_LOOKUPS.labels(how).inc()
+    if cached is not None:
+        timings["cache_ms"] = _ms(t)
+        return list(cached)
+
+    ranked = _retrieve_uncached(
+        query, query_embedding, mode, top_k, db,
+        document_ids, batch_id, vector_depth, keyword_depth, timings, deadline,
+    )
+    # Don't cache a result computed while the indexes were changing underneath us,
+    # nor a degraded one under the full mode's scope
+    if index_generation() == generation and timings.get("retrieval", mode) == mode:
+        _result_cache.put(scope, query, query_embedding, generation, tuple(ranked))
+    return ranked
+
+
+def search_many(
+    queries: List[str],
+    top_k: int,
+    db: Session,
+    document_ids: Optional[List[str]] = None,
+    batch_id: Optional[str] = None,
+    mode: Optional[str] = None,
+    vector_depth: Optional[int] = None,
+    keyword_depth: Optional[int] = None,
+    timings: Optional[Dict[str, float]] = None,
+) -> List[List[HydratedChunk]]:
+    """Retrieve chunks for many queries sharing one scope.
+
+    The scope is resolved once, uncached queries are embedded in a single
+    batch and searched with one index pass (or one matrix product over the
+    scoped documents), and every distinct chunk is loaded in one query.
+    Results line up with ``queries``.
+    """
+    mode = (mode or DEFAULT_RETRIEVAL_MODE).lower()
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode '{mode}', expected one of {RETRIEVAL_MODES}")
+    if timings is None:
+        timings = {}
+    started = time.perf_counter()
+
+    scope = _scope_key(mode, document_ids, batch_id, top_k, vector_depth, keyword_depth)
+    generation = index_generation()
+    ranked: List[Optional[List[Tuple[int, float]]]] = []
+    for query in queries:
+        cached, _, _ = _result_cache.lookup(scope, query, generation)
+        ranked.append(list(cached) if cached is not None else None)
+    # Repeats within the batch are retrieved once and copied
+    first_of: Dict[str, int] = {}
+    duplicates: Dict[int, int] = {}
+    misses: List[int] = []
+    for i, r in enumerate(ranked):
+        if r is not None:
+            continue
+        key = " ".join(queries[i].lower().split())
+        if key in first_of:
+            duplicates[i] = first_of[key]
+        else:
+            first_of[key] = i
+            misses.append(i)
+    timings["cache_hits"] = len(queries) - len(misses) - len(duplicates)
+
+    scoped_ids = _resolve_scope(db, document_ids, batch_id)
+    embeddings: Dict[int, List[float]] = {}
+    if misses and scoped_ids != []:
+        if mode != "keyword":
+            t = time.perf_counter()
+            vectors = get_query_embeddings([queries[i] for i in misses])
+            embeddings = dict(zip(misses, vectors))
+            timings["embed_ms"] = _ms(t)
+
+        vector_ranked: Dict[int, List[Tuple[int, float]]] = {}
+        if mode != "keyword":
+            depth = top_k if mode == "vector" else max(top_k, vector_depth or HYBRID_VECTOR_DEPTH)
+            t = time.perf_counter()
+            try:
+                if scoped_ids is not None:
+                    results = _filtered_vector_search_many([embeddings[i] for i in misses], depth, db, scoped_ids)
+                else:
+                    load_or_build_index(db)
+                    results = vs_search_many([embeddings[i] for i in misses], depth, db)
+            except Exception:
+                results = [[] for _ in misses]
+            vector_ranked = dict(zip(misses, results))
+            timings["vector_ms"] = _ms(t, _VECTOR)
+
+        t = time.perf_counter()
+        kdepth = top_k if mode == "keyword" else max(top_k, keyword_depth or HYBRID_KEYWORD_DEPTH)
+        for i in misses:
+            if mode == "vector":
+                ranked[i] = vector_ranked[i]
+                if not ranked[i] and scoped_ids is None:
+                    ranked[i] = search_keywords(queries[i], top_k, db)
+            elif mode == "keyword":
+                ranked[i] = search_keywords(queries[i], kdepth, db, document_ids=scoped_ids)
+            else:
+                ranked[i] = _reciprocal_rank_fusion(
+                    [vector_ranked[i], search_keywords(queries[i], kdepth, db, document_ids=scoped_ids)],
+                    [HYBRID_VECTOR_WEIGHT, HYBRID_KEYWORD_WEIGHT],
+                )[:top_k]
+        timings["keyword_ms"] = _ms(t, _KEYWORD)
+
+        if index_generation() == generation:
+            for i in misses:
+                _result_cache.put(scope, queries[i], embeddings.get(i), generation, tuple(ranked[i]))
 
-    # Get query embedding
-    query_embedding = get_embedding(query)
+    for i, original in duplicates.items():
+        ranked[i] = ranked[original]
 
-    # If batch_id is provided, resolve its documents then do filtered vector search (preferred)
+    # One hydration for the union of all results
+    t = time.perf_counter()
+    ids = list(dict.fromkeys(cid for r in ranked for cid, _ in (r or [])))
+    by_id = {chunk.id: chunk for chunk in Hydrator().load(ids, db)}
+    results = [[by_id[cid] for cid, _ in (r or []) if cid in by_id] for r in ranked]
+    timings["hydrate_ms"] = _ms(t, _HYDRATE)
+    timings["total_ms"] = _ms(started, _SEARCH_BATCH)
+    return results
+
+
+def _scope_key(
+    mode: str,
+    document_ids: Optional[List[str]],
+    batch_id: Optional[str],
+    top_k: int,
+    vector_depth: Optional[int],
+    keyword_depth: Optional[int],
+) -> tuple:
+    return (
+        mode,
+        batch_id or None,
+        tuple(sorted(document_ids)) if document_ids and not batch_id else None,
+        top_k,
+        vector_depth if mode == "hybrid" else None,
+        keyword_depth if mode == "hybrid" else None,
+    )
+
+
+def _resolve_scope(db: Session, document_ids: Optional[List[str]], batch_id: Optional[str]) -> Optional[List[str]]:
+    """None means the global index, an empty list means nothing to search."""
     if batch_id:
         doc_rows = db.query(Document.id).filter(Document.batch_id == batch_id).all()
-        scoped_ids = [row[0] for row in doc_rows]
-        if not scoped_ids:
-            return []
-        return _filtered_vector_search(query_embedding, top_k, db, scoped_ids)
-
-    # If specific documents are provided, do an ephemeral, filtered vector search over just those
+        return [row[0] for row in doc_rows]
     if document_ids:
-        return _filtered_vector_search(query_embedding, top_k, db, document_ids)
+        return list(document_ids)
+    return None
+
+
+def index_generation() -> Tuple[int, int]:
+    """Changes whenever either index is mutated (ingest, delete, rebuild)."""
+    return vector_generation(), keyword_generation()
+
+
+def result_cache_stats() -> dict:
+    return _result_cache.stats()
+
+
+def _retrieve_uncached(
+    query: str,
+    query_embedding: Optional[List[float]],
+    mode: str,
+    top_k: int,
+    db: Session,
+    document_ids: Optional[List[str]],
+    batch_id: Optional[str],
+    vector_depth: Optional[int],
+    keyword_depth: Optional[int],
+    timings: Dict[str, float],
+    deadline: Optional[Deadline] = None,
+) -> List[Tuple[int, float]]:
+    scoped_ids = _resolve_scope(db, document_ids, batch_id)
+    if scoped_ids is not None and not scoped_ids:
+        return []
+
+    if mode == "keyword":
+        t = time.perf_counter()
+        ranked = search_keywords(query, top_k, db, document_ids=scoped_ids)
+        timings["keyword_ms"] = _ms(t, _KEYWORD)
+        return ranked
+
+    if query_embedding is None and timings.get("embedding") != "skipped":
+        t = time.perf_counter()
+        query_embedding, timings["embedding"] = get_query_embedding(query, deadline)
+        timings["embed_ms"] = _ms(t)
+
+    if query_embedding is None or (deadline is not None and not deadline.allows("vector")):
+        # Out of time for the vector path: the keyword index answers on its own
+        if deadline is not None:
+            deadline.degrade("keyword_only")
+        timings["retrieval"] = "keyword"
+        t = time.perf_counter()
+        ranked = search_keywords(query, top_k, db, document_ids=scoped_ids)
+        timings["keyword_ms"] = _ms(t, _KEYWORD)
+        return ranked
+
+    if mode == "vector":
+        ranked = _vector_candidates(query_embedding, top_k, db, scoped_ids, timings)
+        if not ranked and scoped_ids is None:
+            # Global index unavailable or empty: fall back to keyword search
+            t = time.perf_counter()
+            ranked = search_keywords(query, top_k, db)
+            timings["keyword_ms"] = _ms(t, _KEYWORD)
+        return ranked
+
+    # Hybrid: keyword search in a worker thread while vector search runs here.
+    # The keyword index only needs the session to build, so make sure that's done first.
+    load_or_build_keyword_index(db)
+    kdepth = max(top_k, keyword_depth or HYBRID_KEYWORD_DEPTH)
+    vdepth = max(top_k, vector_depth or HYBRID_VECTOR_DEPTH)
+    # Sessions aren't thread-safe, so the worker doesn't get this one
+    keyword_future = _executor.submit(_timed_keyword_search, query, kdepth, scoped_ids)
+    vector_ranked = _vector_candidates(query_embedding, vdepth, db, scoped_ids, timings)
+    keyword_ranked, timings["keyword_ms"] = keyword_future.result()
 
-    # Otherwise, use the global index across all chunks
+    t = time.perf_counter()
+    fused = _reciprocal_rank_fusion(
+        [vector_ranked, keyword_ranked],
+        [HYBRID_VECTOR_WEIGHT, HYBRID_KEYWORD_WEIGHT],
+    )[:top_k]
+    timings["fuse_ms"] = _ms(t, _FUSE)
+    return fused
+
+
+def _ms(since: float, stage=None) -> float:
+    """Milliseconds since ``since``, also recorded on ``stage`` if given."""
+    elapsed = time.perf_counter() - since
+    if stage is not None:
+        stage.observe(elapsed)
+    return round(elapsed * 1000.0, 3)
+
+
+def _timed_keyword_search(
+    query: str,
+    depth: int,
+    scoped_ids: Optional[List[str]],
+) -> Tuple[List[Tuple[int, float]], float]:
+    t = time.perf_counter()
+    return search_keywords(query, depth, None, document_ids=scoped_ids), _ms(t, _KEYWORD)
+
+
+def _vector_candidates(
+    query_embedding: List[float],
+    depth: int,
+    db: Session,
+    scoped_ids: Optional[List[str]],
+    timings: Dict[str, float],
+) -> List[Tuple[int, float]]:
+    t = time.perf_counter()
     try:
+        if scoped_ids is not None:
+            # Ephemeral, filtered vector search over just those documents
+            return _filtered_vector_search(query_embedding, depth, db, scoped_ids)
+        # Otherwise, use the global index across all chunks
         load_or_build_index(db)
-        ids = vs_search(query_embedding, top_k, db)
-        if not ids:
-            return _fallback_text_search(query, top_k, db)
-        chunks = db.query(Chunk).filter(Chunk.id.in_(ids)).all()
-        # Preserve ranking order
-        order: Dict[int, int] = {cid: i for i, cid in enumerate(ids)}
-        chunks.sort(key=lambda c: order.get(c.id, 1_000_000))
-        return chunks
+        return vs_search(query_embedding, depth, db)
     except Exception:
-        return _fallback_text_search(query, top_k, db)
-
-
-def _fallback_text_search(query: str, top_k: int, db: Session) -> List[Chunk]:
-    """Fallback text search when vector search is not available"""
+        return []
+    finally:
+        timings["vector_ms"] = _ms(t, _VECTOR)
+        deadlines.observe("vector", timings["vector_ms"] / 1000.0)
 
-    # Simple text search using ILIKE
-    chunks = db.query(Chunk).join(Document).filter(
-        Chunk.content.ilike(f"%{query}%")
-    ).limit(top_k).all()
 
-    return chunks
+def _reciprocal_rank_fusion(
+    rankings: List[List[Tuple[int, float]]],
+    weights: List[float],
+) -> List[Tuple[int, float]]:
+    """Fuse ranked lists: score(d) = sum_i w_i / (RRF_K + rank_i(d))."""
+    fused: Dict[int, float] = {}
+    for ranked, weight in zip(rankings, weights):
+        for rank, (cid, _) in enumerate(ranked, start=1):
+            fused[cid] = fused.get(cid, 0.0) + weight / (RRF_K + rank)
+    return sorted(fused.items(), key=lambda kv: kv[1], reverse=True)
 
 
 def _filtered_vector_search(
@@ -64,8 +453,18 @@ def _filtered_vector_search(
     top_k: int,
     db: Session,
     document_ids: List[str],
-) -> List[Chunk]:
+) -> List[Tuple[int, float]]:
     """Vector search restricted to specific document IDs (ephemeral in-memory)."""
+    return _filtered_vector_search_many([query_embedding], top_k, db, document_ids)[0]
+
+
+def _filtered_vector_search_many(
+    query_embeddings: List[List[float]],
+    top_k: int,
+    db: Session,
+    document_ids: List[str],
+) -> List[List[Tuple[int, float]]]:
+    """Scoped vector search for several queries over one load of the candidate embeddings."""
     # Load candidate chunk embeddings for the specified documents
     rows = (
         db.query(Chunk.id, Chunk.embedding)
@@ -73,7 +472,7 @@ def _filtered_vector_search(
         .all()
     )
     if not rows:
-        return []
+        return [[] for _ in query_embeddings]
 
     ids: List[int] = []
     vecs: List[List[float]] = []
@@ -87,7 +486,7 @@ def _filtered_vector_search(
             continue
 
     if not vecs:
-        return []
+        return [[] for _ in query_embeddings]
 
     mat = np.array(vecs, dtype="float32")
     # Normalize for cosine similarity
@@ -95,17 +494,14 @@ def _filtered_vector_search(
     mat_norms[mat_norms == 0] = 1.0
     mat = mat / mat_norms
 
-    q = np.array([query_embedding], dtype="float32")
+    q = np.array(query_embeddings, dtype="float32")
     q_norm = np.linalg.norm(q, axis=1, keepdims=True)
     q_norm[q_norm == 0] = 1.0
     q = q / q_norm
 
-    sims = np.dot(mat, q.T).reshape(-1)
-    best = np.argsort(-sims)[:top_k]
-    best_ids = [ids[int(i)] for i in best]
-
-    # Fetch chunks and preserve ranking order
-    chunks = db.query(Chunk).filter(Chunk.id.in_(best_ids)).all()
-    order: Dict[int, int] = {cid: i for i, cid in enumerate(best_ids)}
-    chunks.sort(key=lambda c: order.get(c.id, 1_000_000))
-    return chunks
+    sims = np.dot(q, mat.T)
+    results = []
+    for row in sims:
+        best = np.argsort(-row)[:top_k]
+        results.append([(ids[int(i)], float(row[int(i)])) for i in best])
+    return results
@@ -0,0 +1,157 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+
+class SemanticCache:
+    """LRU + TTL cache that matches queries by exact text or embedding similarity.
+
+    Entries live under a scope key (whatever must match exactly, e.g. filters
+    and top_k). Lookups first try the normalised query text, then the closest
+    cached embedding in the same scope whose cosine similarity clears
+    ``threshold``. Every entry is tied to an index generation; when the caller
+    reports a different generation the whole cache is dropped, so results can
+    never outlive an ingest or delete.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, threshold: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._generation: Optional[Hashable] = None
+        self._next_id = 0
+        # entry id -> (scope, text, embedding or None, value, expires_at); ordered oldest first
+        self._entries: "OrderedDict[int, Tuple[Hashable, str, Optional[np.ndarray], Any, float]]" = OrderedDict()
+        self._by_text: Dict[Tuple[Hashable, str], int] = {}
+        self._by_scope: Dict[Hashable, Dict[int, np.ndarray]] = {}
+        self._stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    @staticmethod
+    def _normalize_text(text: str) -> str:
+        return " ".join(text.lower().split())
+
+    @staticmethod
+    def _normalize_vec(embedding: List[float]) -> np.ndarray:
+        vec = np.asarray(embedding, dtype="float32")
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def _check_generation(self, generation: Hashable) -> None:
+        if generation != self._generation:
+            if self._entries:
+                self._stats["invalidations"] += 1
+            self._entries.clear()
+            self._by_text.clear()
+            self._by_scope.clear()
+            self._generation = generation
+
+    def _drop(self, entry_id: int) -> None:
+        scope, text, _, _, _ = self._entries.pop(entry_id)
+        self._by_text.pop((scope, text), None)
+        vectors = self._by_scope.get(scope)
+        if vectors is not None:
+            vectors.pop(entry_id, None)
+            if not vectors:
+                del self._by_scope[scope]
+
+    def _live(self, entry_id: int, now: float) -> bool:
+        if self._entries[entry_id][4] < now:
+            self._drop(entry_id)
+            self._stats["evictions"] += 1
+            return False
+        self._entries.move_to_end(entry_id)
+        return True
+
+    def lookup(
+        self,
+        scope: Hashable,
+        text: str,
+        generation: Hashable,
+        embed: Optional[Callable[[], List[float]]] = None,
+    ) -> Tuple[Optional[Any], Optional[List[float]], str]:
+        """Return (value, embedding, how) for a query.
+
+        Tries the normalised text first; only on a miss is ``embed`` called
+        (outside the lock) to search for a semantically close entry; it may
+        return None to skip that step. The embedding is handed back so callers
+        don't compute it twice. ``how`` is "exact", "semantic" or "miss".
+        """
+        key = (scope, self._normalize_text(text))
+        with self._lock:
+            self._check_generation(generation)
+            entry_id = self._by_text.get(key)
+            if entry_id is not None and self._live(entry_id, time.monotonic()):
+                self._stats["exact_hits"] += 1
+                return self._entries[entry_id][3], None, "exact"
+            if embed is None:
+                self._stats["misses"] += 1
+                return None, None, "miss"
+
+        embedding = embed()
+        if embedding is None:
+            with self._lock:
+                self._stats["misses"] += 1
+            return None, None, "miss"
+        query = self._normalize_vec(embedding)
+        with self._lock:
+            self._check_generation(generation)
+            vectors = self._by_scope.get(scope)
+            if vectors:
+                ids = list(vectors.keys())
+                sims = np.stack([vectors[i] for i in ids]) @ query
+                best = int(np.argmax(sims))
+                if float(sims[best]) >= self.threshold and self._live(ids[best], time.monotonic()):
+                    self._stats["semantic_hits"] += 1
+                    return self._entries[ids[best]][3], embedding, "semantic"
+            self._stats["misses"] += 1
+            return None, embedding, "miss"
+
+    def put(
+        self,
+        scope: Hashable,
+        text: str,
+        embedding: Optional[List[float]],
+        generation: Hashable,
+        value: Any,
+    ) -> None:
+        if self.max_entries <= 0:
+            return
+        text = self._normalize_text(text)
+        vec = self._normalize_vec(embedding) if embedding is not None else None
+        with self._lock:
+            self._check_generation(generation)
+            existing = self._by_text.get((scope, text))
+            if existing is not None:
+                self._drop(existing)
+            while len(self._entries) >= self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (scope, text, vec, value, time.monotonic() + self.ttl_seconds)
+            self._by_text[(scope, text)] = entry_id
+            if vec is not None:
+                self._by_scope.setdefault(scope, {})[entry_id] = vec
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_text.clear()
+            self._by_scope.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self._stats["exact_hits"] + self._stats["semantic_hits"]
+            lookups = hits + self._stats["misses"]
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "threshold": self.threshold,
+            }
@@ -0,0 +1,106 @@
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional
+
+
+class _Flight:
+    """One in-flight producer and the items it has emitted so far."""
+
+    def __init__(self):
+        self.items: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+        self.task: Optional["asyncio.Task[None]"] = None
+
+    def notify(self) -> None:
+        # Wake current waiters and arm a fresh event for the next round
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait(self) -> None:
+        await self._changed.wait()
+
+
+class SingleFlight:
+    """Coalesce concurrent identical work onto a single producer.
+
+    ``stream`` runs one async generator per key and fans every item out to all
+    callers that asked for that key while it was running; callers that join
+    late first get a replay of what was already produced. The producer runs as
+    its own task, so it keeps going for the others if the first caller goes
+    away; once the last one is gone it's cancelled, so abandoned work stops
+    holding upstream capacity. ``do`` is the same for a single awaitable result.
+    """
+
+    def __init__(self):
+        self._flights: Dict[Hashable, _Flight] = {}
+        self.stats = {"leaders": 0, "followers": 0}
+
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    def _start(self, key: Hashable, factory: Callable[[], AsyncIterator[Any]]) -> _Flight:
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.stats["followers"] += 1
+            return flight
+        self.stats["leaders"] += 1
+        flight = _Flight()
+        self._flights[key] = flight
+
+        async def run() -> None:
+            try:
+                async for item in factory():
+                    flight.items.append(item)
+                    flight.notify()
+            except BaseException as e:  # propagate to every subscriber
+                flight.error = e
+            finally:
+                flight.done = True
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.notify()
+
+        flight.task = asyncio.ensure_future(run())
+        return flight
+
+    def _leave(self, key: Hashable, flight: _Flight) -> None:
+        flight.subscribers -= 1
+        if flight.subscribers > 0 or flight.done:
+            return
+        # Nobody is listening any more; new callers start a fresh flight
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if flight.task is not None:
+            flight.task.cancel()
+
+    async def stream(self, key: Hashable, factory: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        flight = self._start(key, factory)
+        flight.subscribers += 1
+        try:
+            i = 0
+            while True:
+                if i < len(flight.items):
+                    yield flight.items[i]
+                    i += 1
+                    continue
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                await flight.wait()
+        finally:
+            self._leave(key, flight)
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        async def one() -> AsyncIterator[Any]:
+            yield await factory()
+
+        results = self.stream(key, one)
+        try:
+            async for result in results:
+                return result
+        finally:
+            # Leave right away rather than whenever the generator is collected
+            await results.aclose()
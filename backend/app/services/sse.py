@@ -0,0 +1,96 @@
+import asyncio
+import json
+import os
+from typing import Any, AsyncIterator, Callable
+
+try:
+    import orjson  # type: ignore
+except Exception:  # pragma: no cover
+    orjson = None  # type: ignore
+
+# Token deltas are batched into one frame until either limit is reached
+SSE_FLUSH_MS = float(os.getenv("SSE_FLUSH_MS", "50"))
+SSE_FLUSH_BYTES = int(os.getenv("SSE_FLUSH_BYTES", "512"))
+# Comment frame sent on idle streams so proxies don't drop the connection
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+
+HEARTBEAT = b": keepalive\n\n"
+
+
+def dumps(obj: Any) -> bytes:
+    """Compact JSON, via orjson when it's installed."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def sse_frame(obj: Any) -> bytes:
+    return b"data: " + dumps(obj) + b"\n\n"
+
+
+async def coalesce_frames(
+    deltas: AsyncIterator[str],
+    frame: Callable[[str], bytes],
+    flush_ms: float = SSE_FLUSH_MS,
+    flush_bytes: int = SSE_FLUSH_BYTES,
+    heartbeat: float = SSE_HEARTBEAT_SECONDS,
+) -> AsyncIterator[bytes]:
+    """Batch small text deltas into fewer SSE frames.
+
+    The first delta goes out on its own so time-to-first-token is unchanged.
+    After that, deltas are joined until ``flush_ms`` has passed since the
+    oldest buffered one or ``flush_bytes`` have accumulated, whichever comes
+    first. While nothing is buffered and the source is quiet, a heartbeat
+    comment is emitted every ``heartbeat`` seconds.
+    """
+    loop = asyncio.get_running_loop()
+    source = deltas.__aiter__()
+    pending = asyncio.ensure_future(source.__anext__())
+    buffer = []
+    size = 0
+    flush_at = 0.0
+    first = True
+    try:
+        while True:
+            timeout = max(0.0, flush_at - loop.time()) if buffer else heartbeat
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                if buffer:
+                    yield frame("".join(buffer))
+                    buffer, size = [], 0
+                else:
+                    yield HEARTBEAT
+                continue
+            try:
+                delta = pending.result()
+            except StopAsyncIteration:
+                break
+            except BaseException:
+                # Don't lose text that arrived before the error
+                if buffer:
+                    yield frame("".join(buffer))
+                raise
+            pending = asyncio.ensure_future(source.__anext__())
+            if first:
+                first = False
+                yield frame(delta)
+                continue
+            if not buffer:
+                flush_at = loop.time() + flush_ms / 1000.0
+            buffer.append(delta)
+            size += len(delta.encode("utf-8"))
+            if size >= flush_bytes:
+                yield frame("".join(buffer))
+                buffer, size = [], 0
+        if buffer:
+            yield frame("".join(buffer))
+    finally:
+        if not pending.done():
+            pending.cancel()
+            try:
+                await pending
+            except BaseException:
+                pass
+        aclose = getattr(source, "aclose", None)
+        if aclose is not None:
+            await aclose()
@@ -0,0 +1,289 @@
+import asyncio
+import contextlib
+import hashlib
+import os
+import pathlib
+import time
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+UPLOAD_ROOT = pathlib.Path(os.getenv("UPLOAD_ROOT", "uploaded_files"))
+# Incoming data is buffered up to this size before each write/hash step
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(4 * 1024 * 1024)))
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024 * 1024)))
+# Running hashes of sessions idle this long are dropped; the partial file stays resumable
+UPLOAD_SESSION_TTL = float(os.getenv("UPLOAD_SESSION_TTL", str(24 * 3600)))
+
+PARTIAL_NAME = ".upload.partial"
+
+
+class UploadTooLarge(Exception):
+    """More bytes arrived than the document declared."""
+
+    def __init__(self, limit: int):
+        super().__init__(f"Upload exceeds declared size of {limit} bytes")
+        self.limit = limit
+
+
+class OffsetMismatch(Exception):
+    """A session chunk didn't start where the stored data ends."""
+
+    def __init__(self, offset: int):
+        super().__init__(f"Upload offset is {offset}")
+        self.offset = offset
+
+
+def target_path(document_id: str, filename: Optional[str]) -> pathlib.Path:
+    # Only the base name, so a crafted filename can't escape the upload dir
+    return UPLOAD_ROOT / document_id / (pathlib.Path(filename or "").name or "upload")
+
+
+def partial_path(document_id: str) -> pathlib.Path:
+    return UPLOAD_ROOT / document_id / PARTIAL_NAME
+
+
+def stored_offset(document_id: str) -> Optional[int]:
+    """Bytes received so far by an open session, or None when there is none."""
+    try:
+        return partial_path(document_id).stat().st_size
+    except FileNotFoundError:
+        return None
+
+
+async def iter_upload(file) -> AsyncIterator[bytes]:
+    """Read an ``UploadFile`` in large chunks without blocking the loop."""
+    while True:
+        data = await file.read(UPLOAD_CHUNK_BYTES)
+        if not data:
+            return
+        yield data
+
+
+def _write(f, hasher, data: bytes) -> None:
+    f.write(data)
+    hasher.update(data)
+
+
+def _open_at(path: pathlib.Path, offset: int):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    f = open(path, "r+b" if offset else "wb")
+    f.seek(offset)
+    f.truncate()
+    return f
+
+
+def _hash_file(path: pathlib.Path) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for data in iter(lambda: f.read(UPLOAD_CHUNK_BYTES), b""):
+            hasher.update(data)
+    return hasher.hexdigest()
+
+
+async def write_stream(
+    chunks: AsyncIterator[bytes],
+    path: pathlib.Path,
+    limit: int,
+    hasher,
+    offset: int = 0,
+) -> int:
+    """Append ``chunks`` to ``path`` from ``offset``, hashing as it goes.
+
+    Writes and hashing run in the threadpool, one ``UPLOAD_CHUNK_BYTES``
+    buffer at a time. Raises ``UploadTooLarge`` as soon as the total would
+    pass ``limit``, with the file cut back to ``offset``. If the stream
+    breaks, everything written so far stays on disk and the returned count
+    isn't reached; the file size is the source of truth for resuming.
+    """
+    f = await run_in_threadpool(_open_at, path, offset)
+    size = offset
+    buffer = bytearray()
+    try:
+        async for data in chunks:
+            if size + len(buffer) + len(data) > limit:
+                await run_in_threadpool(f.truncate, offset)
+                raise UploadTooLarge(limit)
+            buffer += data
+            if len(buffer) >= UPLOAD_CHUNK_BYTES:
+                await run_in_threadpool(_write, f, hasher, bytes(buffer))
+                size += len(buffer)
+                buffer.clear()
+        if buffer:
+            await run_in_threadpool(_write, f, hasher, bytes(buffer))
+            size += len(buffer)
+    finally:
+        await run_in_threadpool(f.close)
+    return size - offset
+
+
+async def save_upload(file, document_id: str, filename: Optional[str], declared_size: int) -> Tuple[pathlib.Path, str]:
+    """Stream a whole ``UploadFile`` to disk; returns (path, sha256 hex).
+
+    The data lands in a partial file that only replaces the target once the
+    declared size has been received in full.
+    """
+    # Not the session's partial file, so a one-shot upload can't clobber it
+    partial = partial_path(document_id).with_name(".direct.partial")
+    hasher = hashlib.sha256()
+    try:
+        received = await write_stream(iter_upload(file), partial, declared_size, hasher)
+    except BaseException:
+        await run_in_threadpool(_discard, partial)
+        raise
+    if received != declared_size:
+        await run_in_threadpool(_discard, partial)
+        raise ValueError(f"Received {received} of {declared_size} declared bytes")
+    target = target_path(document_id, filename)
+    await run_in_threadpool(os.replace, partial, target)
+    return target, hasher.hexdigest()
+
+
+def _touch(path: pathlib.Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.touch()
+
+
+def _discard(path: pathlib.Path) -> None:
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class UploadSessions:
+    """Resumable, chunked uploads that append to a partial file per document.
+
+    The partial file's size is the session offset, so an upload survives a
+    dropped connection (or a restart) and resumes from the last byte written.
+    Chunks for one document are applied one at a time; the per-document lock
+    only exists while a call holds or waits for it. The running sha256 is
+    kept in memory while chunks arrive in order and dropped after
+    ``UPLOAD_SESSION_TTL`` of inactivity; if it's lost the file is hashed
+    once when the upload completes.
+    """
+
+    def __init__(self):
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._users: Dict[str, int] = {}
+        # document_id -> (offset hashed up to, hasher, last activity)
+        self._hashers: Dict[str, Tuple[int, Any, float]] = {}
+
+    @contextlib.asynccontextmanager
+    async def _locked(self, document_id: str):
+        self._users[document_id] = self._users.get(document_id, 0) + 1
+        lock = self._locks.get(document_id)
+        if lock is None:
+            lock = self._locks[document_id] = asyncio.Lock()
+        try:
+            async with lock:
+                yield
+        finally:
+            remaining = self._users.pop(document_id) - 1
+            if remaining:
+                self._users[document_id] = remaining
+            else:
+                # Nobody holds or waits for it, so the next call can start a fresh one
+                self._locks.pop(document_id, None)
+
+    def _keep_hasher(self, document_id: str, offset: int, hasher) -> None:
+        self._hashers[document_id] = (offset, hasher, time.monotonic())
+
+    def _take_hasher(self, document_id: str, offset: Optional[int]):
+        """The running hash if it covers exactly ``offset`` bytes, else None."""
+        known = self._hashers.pop(document_id, None)
+        if known is not None and known[0] == offset:
+            return known[1]
+        return None
+
+    def expire(self, ttl: float = UPLOAD_SESSION_TTL) -> int:
+        """Forget running hashes of sessions idle longer than ``ttl``; returns how many."""
+        cutoff = time.monotonic() - ttl
+        stale = [doc for doc, (_, _, seen) in self._hashers.items() if seen < cutoff and doc not in self._users]
+        for document_id in stale:
+            del self._hashers[document_id]
+        return len(stale)
+
+    async def open(self, document_id: str) -> int:
+        """Start a session (or find the existing one); returns its offset."""
+        self.expire()
+        async with self._locked(document_id):
+            offset = stored_offset(document_id)
+            if offset is None:
+                await run_in_threadpool(_touch, partial_path(document_id))
+                self._keep_hasher(document_id, 0, hashlib.sha256())
+                offset = 0
+            return offset
+
+    async def append(
+        self,
+        document_id: str,
+        offset: int,
+        chunks: AsyncIterator[bytes],
+        declared_size: int,
+        filename: Optional[str] = None,
+    ) -> Tuple[int, Optional[Tuple[pathlib.Path, str]]]:
+        """Write one chunk at ``offset``; returns (new offset, finished).
+
+        The chunk that reaches ``declared_size`` also finishes the upload
+        under the same lock, so ``finished`` is (path, sha256 hex) for exactly
+        one caller and None for everyone else.
+        """
+        async with self._locked(document_id):
+            current = stored_offset(document_id)
+            if current is None:
+                raise FileNotFoundError(document_id)
+            if offset != current:
+                raise OffsetMismatch(current)
+            # A hash that skipped bytes already on disk is useless
+            hasher = self._take_hasher(document_id, offset)
+            in_order = hasher is not None
+            hasher = hasher or hashlib.sha256()
+            try:
+                await write_stream(chunks, partial_path(document_id), declared_size, hasher, offset=offset)
+            except UploadTooLarge:
+                # Hashed bytes were cut back off the file
+                raise
+            except BaseException:
+                # Each buffer is written and hashed together, so the hash
+                # still matches what's on disk after a dropped connection
+                if in_order:
+                    self._keep_hasher(document_id, stored_offset(document_id) or 0, hasher)
+                raise
+            new_offset = stored_offset(document_id) or 0
+            if in_order:
+                self._keep_hasher(document_id, new_offset, hasher)
+            if new_offset != declared_size:
+                return new_offset, None
+            return new_offset, await self._finish_locked(document_id, filename)
+
+    async def _finish_locked(self, document_id: str, filename: Optional[str]) -> Tuple[pathlib.Path, str]:
+        """Move a fully received upload into place; returns (path, sha256 hex)."""
+        partial = partial_path(document_id)
+        hasher = self._take_hasher(document_id, stored_offset(document_id))
+        if hasher is not None:
+            digest = hasher.hexdigest()
+        else:
+            digest = await run_in_threadpool(_hash_file, partial)
+        target = target_path(document_id, filename)
+        await run_in_threadpool(os.replace, partial, target)
+        return target, digest
+
+    async def abort(self, document_id: str) -> bool:
+        """Drop a session and its partial file; returns False if there was none."""
+        async with self._locked(document_id):
+            self._hashers.pop(document_id, None)
+            if stored_offset(document_id) is None:
+                return False
+            await run_in_threadpool(_discard, partial_path(document_id))
+            return True
+
+
+_sessions: Optional[UploadSessions] = None
+
+
+def get_upload_sessions() -> UploadSessions:
+    global _sessions
+    if _sessions is None:
+        _sessions = UploadSessions()
+    return _sessions
@@ -1,11 +1,14 @@
 import json
 import os
-from typing import List, Tuple, Optional
+import threading
+import time
+from typing import Iterable, List, Tuple, Optional
 
 import numpy as np
 from sqlalchemy.orm import Session
 
 from app.models.models import Chunk
+from app.services import metrics
 
 # Try to import faiss; if not available, we'll fall back to numpy scan
 try:
@@ -18,9 +21,45 @@ VECTOR_DIR = os.getenv("VECTOR_DIR", "vector_index")
 INDEX_PATH = os.path.join(VECTOR_DIR, "faiss.index")
 META_PATH = os.path.join(VECTOR_DIR, "meta.json")
 
+# Guards _index, _id_to_chunk_id and _dim together; ingest workers add while
+# the threadpool searches, and the two must never be seen out of step
+_lock = threading.RLock()
 _index = None
 _id_to_chunk_id: List[int] = []
 _dim: Optional[int] = None
+# Bumped on every mutation so result caches can tell they are stale
+_generation = 0
+
+
+_SEARCH = metrics.stage("vector_index_search")
+_ADD = metrics.stage("vector_index_add")
+_REMOVE = metrics.stage("vector_index_remove")
+_REBUILD = metrics.stage("vector_index_rebuild")
+
+
+def _index_bytes() -> int:
+    """Approximate memory held by the vectors and their id map."""
+    if _index is None:
+        return 0
+    if faiss is not None:
+        vectors = int(_index.ntotal) * int(_dim or 0) * 4  # type: ignore[attr-defined]
+    else:
+        vectors = int(_index.nbytes)  # type: ignore[attr-defined]
+    return vectors + 8 * len(_id_to_chunk_id)
+
+
+metrics.Gauge("rag_vector_index_vectors", "Vectors in the global index", fn=lambda: len(_id_to_chunk_id))
+metrics.Gauge("rag_vector_index_dimensions", "Dimension of the indexed vectors", fn=lambda: _dim or 0)
+metrics.Gauge("rag_vector_index_bytes", "Approximate memory used by the global vector index", fn=_index_bytes)
+
+
+def generation() -> int:
+    return _generation
+
+
+def _bump_generation() -> None:
+    global _generation
+    _generation += 1
 
 
 def _ensure_dir() -> None:
@@ -53,6 +92,11 @@ def _load_embeddings_from_db(db: Session) -> Tuple[np.ndarray, List[int]]:
 
 
 def load_or_build_index(db: Session) -> None:
+    with _lock:
+        _load_or_build_index(db)
+
+
+def _load_or_build_index(db: Session) -> None:
     global _index, _id_to_chunk_id, _dim
     if _index is not None:
         return
@@ -93,7 +137,13 @@ def load_or_build_index(db: Session) -> None:
 
 def rebuild_index(db: Session) -> None:
     """Rebuild the entire index from DB and persist to disk."""
+    with _lock, _REBUILD.time():
+        _rebuild_index(db)
+
+
+def _rebuild_index(db: Session) -> None:
     global _index, _id_to_chunk_id, _dim
+    _bump_generation()
     _ensure_dir()
     vectors, ids = _load_embeddings_from_db(db)
     if vectors.shape[0] == 0:
@@ -137,16 +187,32 @@ def _save_index() -> None:
 
 def add_embeddings(pairs: List[Tuple[int, List[float]]], db: Session) -> None:
     """Add (chunk_id, embedding) pairs to the index, creating if needed."""
-    global _index, _id_to_chunk_id, _dim
     if not pairs:
         return
+    # Outside the lock; only the index update has to be serialized
+    ids = [int(cid) for cid, _ in pairs]
+    vecs = np.array([[float(x) for x in emb] for _, emb in pairs], dtype="float32")
+    with _lock:
+        started = time.perf_counter()
+        _add_locked(ids, vecs, db)
+        _ADD.observe(time.perf_counter() - started)
+
+
+def _add_locked(ids: List[int], vecs: np.ndarray, db: Session) -> None:
+    global _index, _id_to_chunk_id, _dim
+    _bump_generation()
     # Ensure index exists
     if _index is None:
         load_or_build_index(db)
+        # The build read committed chunks, which usually include these ones
+        present = set(_id_to_chunk_id)
+        fresh = [i for i, cid in enumerate(ids) if cid not in present]
+        if not fresh:
+            return
+        if len(fresh) < len(ids):
+            ids = [ids[i] for i in fresh]
+            vecs = vecs[fresh]
 
-    # Prepare vectors
-    ids = [int(cid) for cid, _ in pairs]
-    vecs = np.array([[float(x) for x in emb] for _, emb in pairs], dtype="float32")
     if _dim is None:
         _dim = int(vecs.shape[1])
 
@@ -167,29 +233,101 @@ def add_embeddings(pairs: List[Tuple[int, List[float]]], db: Session) -> None:
             _id_to_chunk_id.extend(ids)
 
 
-def search(query_embedding: List[float], top_k: int, db: Session) -> List[int]:
+def remove_chunks(chunk_ids: Iterable[int], db: Session) -> int:
+    """Drop the given chunks from the index in one compaction; returns how many were removed.
+
+    Works on the loaded index, so unlike ``rebuild_index`` it doesn't re-read
+    every embedding from the database. The generation moves even when none of
+    the chunks were indexed, since cached results may still cite them.
+    """
+    doomed = set(int(cid) for cid in chunk_ids)
+    if not doomed:
+        return 0
+    with _lock:
+        _bump_generation()
+        return _remove_locked(doomed, db)
+
+
+def _remove_locked(doomed: set, db: Session) -> int:
     global _index, _id_to_chunk_id, _dim
+    # A persisted index may still hold the chunks even if nothing is loaded yet
     if _index is None:
         load_or_build_index(db)
-    if _index is None or not _id_to_chunk_id:
-        return []
-    q = np.array([query_embedding], dtype="float32")
+    if _index is None:
+        return 0
+    positions = [i for i, cid in enumerate(_id_to_chunk_id) if cid in doomed]
+    if not positions:
+        return 0
+    started = time.perf_counter()
+    if faiss is not None:
+        # IndexFlat shifts the remaining vectors down, keeping positions aligned with ids
+        _index.remove_ids(np.array(positions, dtype="int64"))  # type: ignore[attr-defined]
+    else:
+        keep = np.ones(len(_index), dtype=bool)  # type: ignore[arg-type]
+        keep[positions] = False
+        _index = _index[keep]  # type: ignore[index]
+    _id_to_chunk_id = [cid for cid in _id_to_chunk_id if cid not in doomed]
+    if not _id_to_chunk_id:
+        _index = None
+        _dim = None
+        try:
+            if os.path.exists(INDEX_PATH):
+                os.remove(INDEX_PATH)
+            if os.path.exists(META_PATH):
+                os.remove(META_PATH)
+        except Exception:
+            pass
+    else:
+        _save_index()
+    _REMOVE.observe(time.perf_counter() - started)
+    return len(positions)
+
+
+def search(query_embedding: List[float], top_k: int, db: Session) -> List[int]:
+    return [cid for cid, _ in search_with_scores(query_embedding, top_k, db)]
+
+
+def search_with_scores(query_embedding: List[float], top_k: int, db: Session) -> List[Tuple[int, float]]:
+    """Top-k (chunk_id, cosine similarity) pairs from the global index."""
+    return search_many_with_scores([query_embedding], top_k, db)[0]
+
+
+def search_many_with_scores(
+    query_embeddings: List[List[float]],
+    top_k: int,
+    db: Session,
+) -> List[List[Tuple[int, float]]]:
+    """Top-k (chunk_id, cosine similarity) pairs for several queries in one index pass."""
+    with _lock:
+        if _index is None:
+            load_or_build_index(db)
+        if _index is None or not _id_to_chunk_id or not query_embeddings:
+            return [[] for _ in query_embeddings]
+        with _SEARCH.time():
+            return _search_loaded(query_embeddings, top_k)
+
+
+def _search_loaded(query_embeddings: List[List[float]], top_k: int) -> List[List[Tuple[int, float]]]:
+    q = np.array(query_embeddings, dtype="float32")
     if faiss is not None:
         q = _normalize(q)
         scores, idxs = _index.search(q, top_k)  # type: ignore[attr-defined]
-        idxs = idxs[0]
         return [
-            _id_to_chunk_id[i]
-            for i in idxs
-            if 0 <= i < len(_id_to_chunk_id)
+            [
+                (_id_to_chunk_id[i], float(score))
+                for i, score in zip(row_idxs, row_scores)
+                if 0 <= i < len(_id_to_chunk_id)
+            ]
+            for row_idxs, row_scores in zip(idxs, scores)
         ]
     else:
-        # cosine via numpy
+        # cosine via numpy, one matrix product for all queries
         mat = _index  # type: ignore[assignment]
         mat_norm = _normalize(mat)
         qn = _normalize(q)
-        sims = np.dot(mat_norm, qn.T).reshape(-1)
-        best = np.argsort(-sims)[:top_k]
-        return [_id_to_chunk_id[int(i)] for i in best]
-
-
+        sims = np.dot(qn, mat_norm.T)
+        results = []
+        for row in sims:
+            best = np.argsort(-row)[:top_k]
+            results.append([(_id_to_chunk_id[int(i)], float(row[int(i)])) for i in best])
+        return results
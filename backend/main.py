@@ -1,16 +1,29 @@
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, HTTPException, Response
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import uvicorn
 import os
+from collections import Counter
+from typing import Optional
 from dotenv import load_dotenv
 from pathlib import Path
 
 from app.database import engine, Base, init_db, create_tables
 from app.api import uploads, documents, jobs, search, chat
 from app.services.s3_service import create_bucket_if_not_exists
-from app.database import get_db
+from app.database import get_db, SessionLocal, dispose_async_engine, sqlite_status, IS_SQLITE
 from app.services.vector_store import rebuild_index
+from app.services.keyword_index import rebuild_keyword_index
+from app.services.search_service import result_cache_stats
+from app.services.answer_cache import get_answer_cache
+from app.services import llm_client
+from app.services.admission import get_llm_admission
+from app.services.ingest_service import resume_pending_jobs
+from app.services.ingest_scheduler import get_scheduler
+from app.services import metrics
+from app.services.profiling import ProfilingMiddleware, collapsed, configure_profiling, get_profiling_settings, get_sampler
 
 
 @asynccontextmanager
@@ -32,10 +45,22 @@ async def lifespan(app: FastAPI):
     # Create S3 bucket if it doesn't exist
     bucket_name = os.getenv("S3_BUCKET", "rag-bucket")
     create_bucket_if_not_exists(bucket_name)
+
+    # Re-queue ingestion left unfinished by a previous process
+    try:
+        db = SessionLocal()
+        try:
+            resume_pending_jobs(db)
+        finally:
+            db.close()
+    except Exception as e:
+        print(f"Warning: Could not resume pending ingest jobs: {e}")
     
     yield
     # Shutdown
-    pass
+    get_scheduler().shutdown()
+    await llm_client.aclose()
+    await dispose_async_engine()
 
 
 app = FastAPI(
@@ -54,6 +79,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Opt-in stack sampling of selected requests (PROFILING_ENABLED / PUT /admin/profiling)
+app.add_middleware(ProfilingMiddleware)
+
 # Include routers
 app.include_router(uploads.router, prefix="/uploads", tags=["uploads"])
 app.include_router(documents.router, prefix="/documents", tags=["documents"])
@@ -72,6 +100,12 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Stage latencies, counters and index gauges in Prometheus text format"""
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.get("/test")
 async def test_endpoint():
     return {"message": "Backend is working!"}
@@ -90,8 +124,74 @@ async def env_status():
 @app.post("/admin/reindex")
 async def admin_reindex(db = Depends(get_db)):
     rebuild_index(db)
+    rebuild_keyword_index(db)
     return {"message": "Reindex completed"}
 
 
+@app.get("/admin/search-cache")
+async def admin_search_cache():
+    return result_cache_stats()
+
+
+@app.get("/admin/answer-cache")
+async def admin_answer_cache():
+    cache = get_answer_cache()
+    return cache.stats() if cache is not None else {"enabled": False}
+
+
+@app.get("/admin/llm-admission")
+async def admin_llm_admission():
+    return get_llm_admission().stats()
+
+
+@app.get("/admin/database")
+async def admin_database():
+    return sqlite_status() if IS_SQLITE else {"backend": "postgresql"}
+
+
+class ProfilingSettings(BaseModel):
+    enabled: Optional[bool] = None
+    sample_rate: Optional[float] = None
+
+
+@app.get("/admin/profiles")
+async def admin_profiles():
+    """Settings plus the slowest profiled requests, slowest first"""
+    return {
+        "settings": get_profiling_settings(),
+        "traces": [trace.summary() for trace in get_sampler().traces()],
+    }
+
+
+@app.put("/admin/profiling")
+async def admin_configure_profiling(request: ProfilingSettings):
+    """Turn profiling on/off or change the sample rate without a restart"""
+    return configure_profiling(enabled=request.enabled, sample_rate=request.sample_rate)
+
+
+@app.get("/admin/profiles/collapsed", response_class=PlainTextResponse)
+async def admin_profiles_collapsed():
+    """All kept traces merged into one collapsed-stack (flamegraph) profile"""
+    merged = Counter()
+    for trace in get_sampler().traces():
+        merged.update(trace.stacks)
+    return collapsed(merged)
+
+
+@app.get("/admin/profiles/{trace_id}", response_class=PlainTextResponse)
+async def admin_profile(trace_id: str):
+    """One trace as collapsed stacks, for flamegraph.pl or speedscope"""
+    trace = get_sampler().get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return trace.collapsed()
+
+
+@app.delete("/admin/profiles")
+async def admin_clear_profiles():
+    get_sampler().clear()
+    return {"message": "Profiles cleared"}
+
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
@@ -25,14 +25,24 @@ export default function DocumentList() {
   const fetchDocuments = async () => {
     try {
       setLoading(true)
-      const response = await fetch('/api/documents')
-      
-      if (!response.ok) {
-        throw new Error('Failed to fetch documents')
-      }
-      
-      const data = await response.json()
-      setDocuments(data)
+      // The API returns one page at a time; follow X-Next-Cursor to the end
+      const all: Document[] = []
+      let cursor: string | null = null
+      do {
+        const url: string = cursor
+          ? `/api/documents?cursor=${encodeURIComponent(cursor)}`
+          : '/api/documents'
+        const response: Response = await fetch(url)
+        
+        if (!response.ok) {
+          throw new Error('Failed to fetch documents')
+        }
+        
+        const page: Document[] = await response.json()
+        all.push(...page)
+        cursor = response.headers.get('X-Next-Cursor')
+      } while (cursor)
+      setDocuments(all)
     } catch (err) {
       setError(err instanceof Error ? err.message : 'Failed to fetch documents')
     } finally {